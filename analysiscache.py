@@ -0,0 +1,284 @@
+'''
+Analysis results cached by graph content.
+
+Results for a graph are saved in `./.cache/analysis/{hash}.npz`, where the
+hash covers the graph's nodes and edges (fastgraph.graph_hash), so running
+the analyzer again on an unchanged graph, under any file name or format,
+loads them instead of recomputing.
+
+When a crawl has extended a graph that was analyzed before, the cached
+results for the older graph are updated rather than thrown away:
+
+    degree        old degrees plus the added edges
+    components    weakly connected ones by union-find over the added
+                  edges; strongly connected ones are recounted, which is
+                  fast
+    betweenness   only sources that can reach an added edge have a
+                  different shortest-path DAG, so only their contributions
+                  are taken out and recomputed
+    closeness     only nodes reachable from an added edge have different
+                  distances; the rest are rescaled for the new node count
+
+Both centrality updates are exact. If most of the graph is affected, they
+fall back to a full recompute. Given `hops`, only sources and targets
+within that many edges of the added ones are refreshed, which is
+approximate but keeps the cost proportional to the size of the change.
+Incremental updates need integer node keys (appids).
+'''
+import os
+
+import numpy as np
+
+from fastgraph import (CSRGraph, betweenness_centrality, betweenness_contributions,
+                       closeness_centrality, component_counts, graph_hash, reachable,
+                       rescale_betweenness)
+
+ANALYSIS_CACHE_DIR = "./.cache/analysis"
+
+
+def _edge_codes(nodes, indptr, indices):
+    # One int64 per edge, appids being well below 2^31
+    nodes = np.asarray(nodes, dtype=np.int64)
+    sources = np.repeat(nodes, np.diff(indptr))
+    return (sources << 32) | nodes[indices]
+
+
+def _find(parent, x):
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+class _Base:
+    '''An earlier, smaller version of the graph with cached results'''
+
+    def __init__(self, saved, g, edgeCodes):
+        self.saved = saved
+        self.graph = CSRGraph(saved["nodes"].tolist(), saved["indptr"], saved["indices"])
+        position = {node: i for i, node in enumerate(g.nodes)}
+        # Where each base node is in the current graph
+        self.position = np.array([position[node] for node in self.graph.nodes], dtype=np.int64)
+        self.isNew = np.ones(g.n, dtype=bool)
+        self.isNew[self.position] = False
+        added = ~np.isin(edgeCodes, _edge_codes(saved["nodes"], saved["indptr"], saved["indices"]))
+        sources = np.repeat(np.arange(g.n), np.diff(g.A.indptr))
+        self.tails = sources[added]
+        self.heads = g.A.indices[added].astype(np.int64)
+
+
+class CachedAnalysis:
+    '''Metrics of one graph, loaded, updated or computed as needed'''
+
+    def __init__(self, g, cacheDir=ANALYSIS_CACHE_DIR, workers=0):
+        '''
+        Args:
+            g: a fastgraph.CSRGraph.
+            cacheDir: where results are saved, or None to disable caching.
+            workers: processes used for betweenness and closeness.
+        '''
+        self.g = g
+        self.cacheDir = cacheDir
+        self.workers = workers
+        self.results = {}
+        self.hits = []
+        self.hash = graph_hash(g)
+        self._base = None
+        self._baseChecked = cacheDir is None
+        self._integerKeys = all(isinstance(node, (int, np.integer)) for node in g.nodes)
+        self._saved = {}
+        if cacheDir is not None and os.path.exists(self._path(self.hash)):
+            with np.load(self._path(self.hash)) as saved:
+                self._saved = self._align(dict(saved))
+
+    @property
+    def cached(self):
+        '''Whether results were saved for this exact graph before.'''
+        return bool(self._saved)
+
+    def _path(self, hash):
+        return os.path.join(self.cacheDir, hash + ".npz")
+
+    def _align(self, saved):
+        # Saved arrays follow the saved node order, which may differ
+        order = [node.item() for node in saved["nodes"]] if "nodes" in saved else []
+        if sorted(map(str, order)) != sorted(map(str, self.g.nodes)):
+            return {}
+        position = {str(node): i for i, node in enumerate(order)}
+        permutation = np.array([position[str(node)] for node in self.g.nodes], dtype=np.int64)
+        return {name: values[permutation] if values.ndim == 1 and len(values) == self.g.n
+                else values for name, values in saved.items()
+                if name not in ("nodes", "indptr", "indices")}
+
+    def base(self):
+        '''The largest cached graph this one extends, or None.'''
+        if self._baseChecked:
+            return self._base
+        self._baseChecked = True
+        if not self._integerKeys or not os.path.isdir(self.cacheDir):
+            return None
+        codes = _edge_codes(self.g.nodes, self.g.A.indptr, self.g.A.indices)
+        nodes = np.array(self.g.nodes, dtype=np.int64)
+        best = None
+        for file in os.listdir(self.cacheDir):
+            if not file.endswith(".npz") or file == self.hash + ".npz":
+                continue
+            with np.load(os.path.join(self.cacheDir, file)) as saved:
+                if "nodes" not in saved or saved["nodes"].dtype.kind != "i":
+                    continue
+                if best is not None and len(saved["nodes"]) <= len(best["nodes"]):
+                    continue
+                if not np.isin(saved["nodes"], nodes).all():
+                    continue
+                if not np.isin(_edge_codes(saved["nodes"], saved["indptr"], saved["indices"]),
+                               codes).all():
+                    continue
+                best = dict(saved)
+        if best is not None:
+            self._base = _Base(best, self.g, codes)
+        return self._base
+
+    def _cached(self, name):
+        if name in self.results:
+            return self.results[name]
+        if name in self._saved:
+            self.hits.append(name)
+            self.results[name] = self._saved[name]
+            return self.results[name]
+        return None
+
+    def degree(self):
+        '''Degree centrality.'''
+        degree = self._cached("degree")
+        if degree is None:
+            base = self.base()
+            if base is not None and "degree" in base.saved:
+                degree = np.zeros(self.g.n, dtype=np.int64)
+                degree[base.position] = base.saved["degree"]
+                np.add.at(degree, base.tails, 1)
+                np.add.at(degree, base.heads, 1)
+            else:
+                degree = np.diff(self.g.A.indptr) + np.diff(self.g.AT.indptr)
+            self.results["degree"] = degree
+        if self.g.n <= 1:
+            return np.ones(self.g.n)
+        return degree / (self.g.n - 1)
+
+    def components(self):
+        '''Number of weakly and strongly connected components.'''
+        weak = self._cached("weak")
+        strong = self._cached("strong")
+        if weak is not None and strong is not None:
+            return len(np.unique(weak)), int(strong[0])
+        base = self.base()
+        if base is not None and "weak" in base.saved:
+            # Each old component is one set, each new node its own
+            labels = np.empty(self.g.n, dtype=np.int64)
+            labels[base.position] = base.saved["weak"]
+            offset = int(base.saved["weak"].max()) + 1 if len(base.position) else 0
+            labels[base.isNew] = offset + np.arange(int(base.isNew.sum()))
+            parent = list(range(offset + int(base.isNew.sum())))
+            for tail, head in zip(labels[base.tails].tolist(), labels[base.heads].tolist()):
+                a, b = _find(parent, tail), _find(parent, head)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+            weak = np.array([_find(parent, label) for label in labels.tolist()], dtype=np.int64)
+            _, strongCount = component_counts(self.g)
+        else:
+            from scipy.sparse import csgraph
+
+            _, weak = csgraph.connected_components(self.g.A, directed=True, connection="weak")
+            _, strongCount = component_counts(self.g)
+        self.results["weak"] = weak
+        self.results["strong"] = np.array([strongCount])
+        return len(np.unique(weak)), strongCount
+
+    def betweenness(self, k=None, seed=None, hops=None, progress=None):
+        '''
+        Normalized betweenness centrality, as fastgraph.betweenness_centrality.
+
+        Args:
+            k, seed (optional): estimate from `k` sampled sources. Such
+                estimates are only reused for an identical graph.
+            hops (optional): when updating from an earlier graph, only
+                refresh sources within this many edges of the change.
+        '''
+        if k is not None and k < self.g.n:
+            name = f"betweenness_k{k}_s{seed}"
+            cached = self._cached(name)
+            if cached is None:
+                cached = betweenness_centrality(self.g, workers=self.workers, k=k, seed=seed,
+                                                progress=progress)
+                self.results[name] = cached
+            return cached
+        name = "betweenness" if hops is None else f"betweenness_h{hops}"
+        raw = self._cached(name)
+        if raw is None:
+            raw = self._update_betweenness(hops, progress)
+            self.results[name] = raw
+        return rescale_betweenness(raw, self.g.n)
+
+    def _update_betweenness(self, hops, progress):
+        base = self.base()
+        if base is None or "betweenness" not in base.saved:
+            return betweenness_contributions(self.g, np.arange(self.g.n), workers=self.workers,
+                                             progress=progress)
+        affected = reachable(self.g, base.tails, reverse=True, hops=hops) | base.isNew
+        if hops is None and affected.sum() > self.g.n // 2:
+            return betweenness_contributions(self.g, np.arange(self.g.n), workers=self.workers,
+                                             progress=progress)
+        raw = np.zeros(self.g.n)
+        raw[base.position] = base.saved["betweenness"]
+        oldSources = np.flatnonzero(affected[base.position])
+        if len(oldSources):
+            # Take out what the affected sources contributed on the old graph
+            raw[base.position] -= betweenness_contributions(base.graph, oldSources,
+                                                            workers=self.workers)
+        raw += betweenness_contributions(self.g, np.flatnonzero(affected), workers=self.workers,
+                                         progress=progress)
+        return raw
+
+    def closeness(self, hops=None, progress=None):
+        '''
+        Closeness centrality, as fastgraph.closeness_centrality.
+
+        Args:
+            hops (optional): when updating from an earlier graph, only
+                recompute nodes within this many edges of the change.
+        '''
+        name = "closeness" if hops is None else f"closeness_h{hops}"
+        closeness = self._cached(name)
+        if closeness is not None:
+            return closeness
+        base = self.base()
+        if base is None or "closeness" not in base.saved:
+            closeness = closeness_centrality(self.g, workers=self.workers, progress=progress)
+        else:
+            affected = reachable(self.g, base.heads, hops=hops) | base.isNew
+            if hops is None and affected.sum() > self.g.n // 2:
+                closeness = closeness_centrality(self.g, workers=self.workers, progress=progress)
+            else:
+                closeness = np.zeros(self.g.n)
+                if self.g.n > 1:
+                    # Unchanged distances, only the node count differs
+                    closeness[base.position] = (base.saved["closeness"] * (base.graph.n - 1)
+                                                / (self.g.n - 1))
+                targets = np.flatnonzero(affected)
+                closeness[targets] = closeness_centrality(
+                    self.g, workers=self.workers, progress=progress, targets=targets)[targets]
+        self.results[name] = closeness
+        return closeness
+
+    def save(self):
+        '''Save every result computed or loaded, keyed by the graph's hash.'''
+        if self.cacheDir is None or not self.results:
+            return
+        os.makedirs(self.cacheDir, exist_ok=True)
+        arrays = dict(self._saved)
+        arrays.update(self.results)
+        nodes = np.array(self.g.nodes) if self._integerKeys else np.array(
+            [str(node) for node in self.g.nodes])
+        path = self._path(self.hash)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, nodes=nodes, indptr=self.g.A.indptr, indices=self.g.A.indices, **arrays)
+        os.replace(path + ".tmp", path)
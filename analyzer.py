@@ -3,354 +3,179 @@ import re
 import networkx as nx
 import time
 import random
-from collections import Counter
-from operator import itemgetter
-
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-
-class StopCondition(StopIteration):
-    pass
-class Simulation:
-    '''Simulate state transitions on a network'''
-
-    def __init__(self, G, initial_state, state_transition,
-            stop_condition=None, name=''):
-        '''
-        Create a Simulation instance.
-
-        Args:
-            G: a networkx.Graph instance.
-            initial_state: function with signature `initial_state(G)`, that
-                accepts a single argument, the Graph, and returns a dictionary
-                of all node states. The keys in this dict should be node names
-                and the values the corresponding initial node state.
-            state_transition: function with signature
-                `state_transition(G, current_state)` that accepts two
-                arguments, the Graph and a dictionary of current node states,
-                and returns a dictionary of updated node states. The keys in
-                this dict should be node names and the values the corresponding
-                updated node state.
-            stop_condition (optional): function with signature
-                `stop_condition(G, current_state)` that accepts two arguments,
-                the Graph and a dictionary of current node states, and returns
-                True if the simulation should be stopped at its current state.
-
-        Keyword Args:
-            name (optional): a string used in titles of plots and drawings.
-
-        Raises:
-            ValueError: if not all graph nodes have an initial state.
-        '''
-        self.G = G.copy()
-        self._initial_state = initial_state
-        self._state_transition = state_transition
-        self._stop_condition = stop_condition
-        # It's okay to specify stop_condition=False
-        if stop_condition and not callable(stop_condition):
-            raise TypeError("'stop_condition' should be a function")
-        self.name = name or 'Simulation'
-
-        self._states = []
-        self._value_index = {}
-        self._cmap = plt.cm.get_cmap('tab10')
-
-        self._initialize()
-
-        self._pos = nx.layout.spring_layout(G)
-
-    def _append_state(self, state):
-        self._states.append(state)
-        # Update self._value_index
-        for value in set(state.values()):
-            if value not in self._value_index:
-                self._value_index[value] = len(self._value_index)
-
-    def _initialize(self):
-        if self._initial_state:
-            if callable(self._initial_state):
-                state = self._initial_state(self.G)
-            else:
-                state = self._initial_state
-            nx.set_node_attributes(self.G, state, 'state')
-
-        if any(self.G.nodes[n].get('state') is None for n in self.G.nodes):
-            raise ValueError('All nodes must have an initial state')
-
-        self._append_state(state)
-
-    def _step(self):
-        # We're choosing to use the node attributes as the source of truth.
-        # This allows the user to manually perturb the network in between steps.
-        state = nx.get_node_attributes(self.G, 'state')
-        if self._stop_condition and self._stop_condition(self.G, state):
-            raise StopCondition
-        state = nx.get_node_attributes(self.G, 'state')
-        new_state = self._state_transition(self.G, state)
-        state.update(new_state)
-        nx.set_node_attributes(self.G, state, 'state')
-        self._append_state(state)
-
-    def _categorical_color(self, value):
-        index = self._value_index[value]
-        node_color = self._cmap(index)
-        return node_color
-
-    @property
-    def steps(self):
-        ''' Returns the number of steps the sumulation has run '''
-        return len(self._states) - 1
-
-    def state(self, step=-1):
-        '''
-        Get a state of the simulation; by default returns the current state.
-
-        Args:
-            step: the step of the simulation to return. Default is -1, the
-            current state.
-
-        Returns:
-            Dictionary of node states.
-
-        Raises:
-            IndexError: if `step` argument is greater than the number of steps.
-        '''
-        try:
-            return self._states[step]
-        except IndexError:
-            raise IndexError('Simulation step %i out of range' % step)
-
-    def draw(self, step=-1, labels=None, **kwargs):
-        '''
-        Use networkx.draw to draw a simulation state with nodes colored by
-        their state value. By default, draws the current state.
-
-        Args:
-            step: the step of the simulation to draw. Default is -1, the
-            current state.
-            kwargs: keyword arguments are passed to networkx.draw()
-
-        Raises:
-            IndexError: if `step` argument is greater than the number of steps.
-        '''
-        state = self.state(step)
-        node_colors = [self._categorical_color(state[n]) for n in self.G.nodes]
-        nx.draw(self.G, pos=self._pos, node_color=node_colors, **kwargs)
-
-        if labels is None:
-            labels = sorted(set(state.values()), key=self._value_index.get)
-        patches = [mpl.patches.Patch(color=self._categorical_color(l), label=l)
-                   for l in labels]
-        plt.legend(handles=patches)
-
-        if step == -1:
-            step = self.steps
-        if step == 0:
-            title = 'initial state'
-        else:
-            title = 'step %i' % (step)
-        if self.name:
-            title = '{}: {}'.format(self.name, title)
-        plt.title(title)
-
-    def plot(self, min_step=None, max_step=None, labels=None, **kwargs):
-        '''
-        Use pyplot to plot the relative number of nodes with each state at each
-        simulation step. By default, plots all simulation steps.
-
-        Args:
-            min_step: the first step of the simulation to draw. Default is
-                None, which plots starting from the initial state.
-            max_step: the last step, not inclusive, of the simulation to draw.
-                Default is None, which plots up to the current step.
-            labels: ordered sequence of state values to plot. Default is all
-                observed state values, approximately ordered by appearance.
-            kwargs: keyword arguments are passed along to plt.plot()
-
-        Returns:
-            Axes object for the current plot
-        '''
-        x_range = range(min_step or 0, max_step or len(self._states))
-        counts = [Counter(s.values()) for s in self._states[min_step:max_step]]
-        if labels is None:
-            labels = {k for count in counts for k in count}
-            labels = sorted(labels, key=self._value_index.get)
-
-        for label in labels:
-            series = [count.get(label, 0) / sum(count.values()) for count in counts]
-            plt.plot(x_range, series, label=label, **kwargs)
-
-        title = 'node state proportions'
-        if self.name:
-            title = '{}: {}'.format(self.name, title)
-        plt.title(title)
-        plt.xlabel('Simulation step')
-        plt.ylabel('Proportion of nodes')
-        plt.legend()
-        plt.xlim(x_range.start)
-
-        return plt.gca()
-
-    def run(self, steps=1):
-        '''
-        Run the simulation one or more steps, as specified by the `steps`
-        argument. Default is to run a single step.
-
-        Args:
-            steps: number of steps to advance the simulation.
-        '''
-        for _ in range(steps):
-            try:
-                self._step()
-            except StopCondition as e:
-                print(
-                    "Stop condition met at step %i." % self.steps
-                    )
-                break
-
-
-# SIS functions
-def initial_state(G):
-    state = {}
-    for node in G.nodes:
-        state[node] = 'S'
-    
-    patient_zero = random.choice(list(G.nodes))
-    state[patient_zero] = 'I'
-    return state
-
-MU = 0.2
-BETA = 0.1
-
-def state_transition(G, current_state, mode='SIS'):
-    next_state = {}
-    for node in G.nodes:
-        if current_state[node] == 'I':
-            if random.random() < MU:
-                if mode == 'SIS':
-                    next_state[node] = 'S'
-                elif mode == 'SIR':
-                    next_state[node] = 'R'
-        elif current_state[node] == 'S':
-            for neighbor in G.neighbors(node):
-                if current_state[neighbor] == 'I':
-                    if random.random() < BETA:
-                        next_state[node] = 'I'
-
-    return next_state
-
-def get_state_lists(G, current_state):
-    susceptibles = []
-    infectees = []
-    recovered = []
-    for node in G.nodes:
-        if current_state[node] == 'I':
-            infectees.append(node)
-        elif current_state[node] == 'S':
-            susceptibles.append(node)
-        else:
-            recovered.append(node)
-    return susceptibles, infectees, recovered
-
-def run_sis(G, iterations=10):
-    current_state = initial_state(G)
-    _, infectees, _ = get_state_lists(G, current_state)
-    patient_zero = infectees[0]
-    for _ in range(iterations):
-        current_state = state_transition(G, current_state)
-    susceptibles, infectees, recovered = get_state_lists(G, current_state)
-    return patient_zero, len(susceptibles), len(infectees), len(recovered)
-
-def run_sir(G, iterations=10):
-    current_state = initial_state(G)
-    _, infectees, _ = get_state_lists(G, current_state)
-    patient_zero = infectees[0]
-    for _ in range(iterations):
-        current_state = state_transition(G, current_state, mode='SIR')
-    susceptibles, infectees, recovered = get_state_lists(G, current_state)
-    return patient_zero, len(susceptibles), len(infectees), len(recovered)
-
-def spreading_analysis(G, probability=0.2, iterations=10):
-    
-    def spread(root, G, node, probability, currIter, iterations, spreads):
-        if currIter >= iterations:
-            return
-        for neighbor in G.neighbors(node):
-            if random.random() < probability:
-                spreads[root].append(neighbor)
-                spread(root, G, neighbor, probability, currIter + 1, iterations, spreads)
-
-    spreads = {}
-    for node in G.nodes():
-        currIter = 0
-        spreads[node] = []
-        spread(node, G, node, probability, currIter, iterations, spreads)
-        
-    return spreads
-                
-def main():
+import os
+
+import numpy as np
+
+from config import ask, make_parser, parse_args
+from epidemic import I, MODES, Epidemic, independent_cascade, run_ensemble
+from analysiscache import ANALYSIS_CACHE_DIR, CachedAnalysis
+from fastgraph import CSRGraph
+from graphlog import graph_format, read_graph
+from graphstore import read_arrays
+from layout import LAYOUTS, layout_available
+from results import RESULT_FORMATS, ResultWriter, print_top
+
+def run_epidemic(G, mode, iterations=10, seed=None):
+    sim = Epidemic(G, mode=mode, seed=seed)
+    patient_zero = sim.graph.nodes[int(np.flatnonzero(sim.states(0) == I)[0])]
+    sim.run(iterations)
+    counts = sim.counts()
+    return patient_zero, counts["S"], counts["I"], counts["R"]
+
+def run_sis(G, iterations=10, seed=None):
+    return run_epidemic(G, "SIS", iterations, seed)
+
+def run_sir(G, iterations=10, seed=None):
+    return run_epidemic(G, "SIR", iterations, seed)
+
+def spreading_analysis(G, probability=0.2, iterations=10, sample=None, seed=None, workers=0):
+    '''Games reached by an independent cascade from each game, or a sample of them.'''
+    _, reach = independent_cascade(G, probability, iterations, sample=sample,
+                                   seed=seed, workers=workers)
+    return reach
+
+def print_progress(label, unit="source batches"):
+    def progress(done, total):
+        print("\r" + label + ": " + str(done) + "/" + str(total) + " " + unit,
+              end="\n" if done == total else "", flush=True)
+    return progress
+
+def main(argv=None):
     VERSION = "0.0.1"
     G = nx.DiGraph()
 
+    parser = make_parser("Compute statistics and centralities of a recommendation graph.")
+    parser.add_argument("--graph", help="name of the graph in the graph directory")
+    parser.add_argument("--analysis-dir", default=None,
+                        help="directory results are written to (default ./.analysis)")
+    parser.add_argument("--steps", type=int, default=None,
+                        help="steps of the SIS simulation (default 25, 0 to skip it)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="recompute everything instead of reusing cached results")
+    parser.add_argument("--refresh-hops", type=int, default=None,
+                        help="when updating cached results for an extended graph, only "
+                             "refresh games within this many links of new ones (approximate)")
+    parser.add_argument("--results-format", choices=RESULT_FORMATS, default=None,
+                        help="format of the per-game results table (default csv)")
+    parser.add_argument("--write-each", action="store_true",
+                        help="write each metric to its own file as soon as it is done")
+    parser.add_argument("--top", type=int, default=None,
+                        help="games listed for each metric (default 10)")
+    parser.add_argument("--layout", choices=LAYOUTS, default=None,
+                        help="how the simulation graph is drawn (default spring, "
+                             "spectral is much faster on large graphs)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes used for centrality (default one per CPU)")
+    parser.add_argument("--betweenness-k", type=int, default=None,
+                        help="estimate betweenness from this many sampled sources")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="random seed for sampled sources and the simulation")
+    parser.add_argument("--spread-roots", type=int, default=None,
+                        help="games to start a spreading cascade from, -1 for all (default 0)")
+    parser.add_argument("--ensemble-runs", type=int, default=None,
+                        help="SIS and SIR runs from random starting games to summarize (default 0)")
+    parser.add_argument("--ensemble-steps", type=int, default=None,
+                        help="steps of each ensemble run (default 10)")
+    args = parse_args(parser, argv, "analyzer")
+    # Checked now rather than after every other result has been worked out
+    if args.layout is not None and not layout_available(args.layout):
+        parser.error("the " + args.layout + " layout needs networkx 3.4+ or the fa2 package")
+    analysisDir = args.analysis_dir or "./.analysis"
+    workers = args.workers if args.workers is not None else os.cpu_count() or 1
+    # A single worker is no faster than running in this process
+    workers = workers if workers > 1 else 0
+
     print("Welcome to Steam Recommendation Analyzer v" + VERSION)
 
-    oldGraphName = input("Graph name? ")
-    G = nx.read_gexf(f"./.graphs/{oldGraphName}")
+    oldGraphName = ask(args, "graph", "Graph name? ")
+    graphPath = os.path.join(args.graph_dir, oldGraphName)
+    G = read_graph(graphPath)
     print("Loading graph...")
     print("Loaded graph with " + str(len(G.nodes())) + " nodes")
-    nodeCount = int(oldGraphName.split("-")[0].replace("steam", ""))
-    recCount = int(oldGraphName.split("-")[1])
+    if graph_format(graphPath) == "arrays":
+        csr = CSRGraph.from_arrays(read_arrays(graphPath))
+    else:
+        csr = CSRGraph.from_networkx(G)
     
+    os.makedirs(analysisDir, exist_ok=True)
+    names = [G.nodes[node].get("name", "") for node in csr.nodes]
+    writer = ResultWriter(os.path.join(analysisDir, oldGraphName), csr.nodes, names,
+                          args.results_format or "csv", args.write_each)
+    topK = args.top if args.top is not None else 10
+
     print("Analyzing graph...")
+    analysis = CachedAnalysis(csr, None if args.no_cache else ANALYSIS_CACHE_DIR, workers)
+    if analysis.cached:
+        print("Reusing cached results for this graph")
+    elif analysis.base() is not None:
+        print("Updating results cached for an earlier " + str(analysis.base().graph.n)
+              + " node version of this graph")
+    weakComponents, strongComponents = analysis.components()
     print("Graph has " + str(len(G.nodes())) + " nodes")
     print("Graph has " + str(len(G.edges())) + " edges")
-    print("Graph has " + str(nx.number_weakly_connected_components(G)) + " weakly connected components")
-    print("Graph has " + str(nx.number_strongly_connected_components(G)) + " strongly connected components")
-    print("Graph has " + str(nx.number_connected_components(G.to_undirected())) + " connected components")
+    print("Graph has " + str(weakComponents) + " weakly connected components")
+    print("Graph has " + str(strongComponents) + " strongly connected components")
+    # Ignoring direction, components are the weakly connected ones
+    print("Graph has " + str(weakComponents) + " connected components")
     
     print("Calculating degree centrality...")
-    degreeCentrality = nx.degree_centrality(G)
-    print("Degree centrality is " + str(degreeCentrality))
+    degreeCentrality = analysis.degree()
+    writer.add("degreeCentrality", degreeCentrality)
+    print_top("degree centrality", csr.nodes, degreeCentrality, names, topK)
     print("Calculating betweenness centrality...")
-    betweennessCentrality = nx.betweenness_centrality(G)
-    print("Betweenness centrality is " + str(betweennessCentrality))
+    betweennessCentrality = analysis.betweenness(
+        args.betweenness_k, args.seed, args.refresh_hops, print_progress("Betweenness"))
+    writer.add("betweennessCentrality", betweennessCentrality)
+    print_top("betweenness centrality", csr.nodes, betweennessCentrality, names, topK)
     print("Calculating closeness centrality...")
-    closenessCentrality = nx.closeness_centrality(G)
-    print("Closeness centrality is " + str(closenessCentrality))
-
-    # print("Calculating spreading...")
-    # spreads = spreading_analysis(G)
-    
-    # sis = {}
-    # sir = {}
-
-    # for _ in range(50):
-    #     root, susceptibles, infectees, recovered = run_sis(G)
-    #     sis[root] = {
-    #         "susceptibles": susceptibles,
-    #         "infectees": infectees,
-    #         "recovered": recovered
-    #     }
-    #     root, susceptibles, infectees, recovered = run_sir(G)
-    #     sir[root] = {
-    #         "susceptibles": susceptibles,
-    #         "infectees": infectees,
-    #         "recovered": recovered
-    #     }
+    closenessCentrality = analysis.closeness(args.refresh_hops, print_progress("Closeness"))
+    writer.add("closenessCentrality", closenessCentrality)
+    print_top("closeness centrality", csr.nodes, closenessCentrality, names, topK)
+
+    spreadRoots = args.spread_roots or 0
+    if spreadRoots != 0:
+        print("Calculating spreading...")
+        spreadCounts, _ = independent_cascade(
+            csr, sample=spreadRoots if spreadRoots > 0 else None, seed=args.seed,
+            keepSets=False, workers=workers, progress=print_progress("Spreading", "batches of roots"))
+        spread = np.array([spreadCounts.get(node, np.nan) for node in csr.nodes])
+        writer.add("spreadCount", spread)
+        print_top("spreading reach", csr.nodes, spread, names, topK)
+
+    ensembles = {}
+    ensembleRuns = args.ensemble_runs or 0
+    if ensembleRuns > 0:
+        for mode in MODES:
+            print("Running " + str(ensembleRuns) + " " + mode + " simulations...")
+            ensembles[mode.lower()] = run_ensemble(
+                csr, mode, runs=ensembleRuns, steps=args.ensemble_steps or 10,
+                seed=args.seed, workers=workers,
+                progress=print_progress(mode, "batches of runs")).to_dict()
 
-    sim = Simulation(G, initial_state, state_transition, name='SIS model')
-    sim.run(25)
-    sim.draw()
-    sim.plot()
-            
     print("Saving results...")
-    with open(f"./.analysis/{oldGraphName}.json", "w") as f:
+    writer.close()
+    analysis.save()
+    with open(os.path.join(analysisDir, f"{oldGraphName}.json"), "w") as f:
         json.dump({
-            "degreeCentrality": degreeCentrality,
-            "betweennessCentrality": betweennessCentrality,
-            "closenessCentrality": closenessCentrality,
+            "nodes": len(G.nodes()),
+            "edges": len(G.edges()),
+            "weaklyConnectedComponents": weakComponents,
+            "stronglyConnectedComponents": strongComponents,
+            **ensembles,
         }, f)
-        
+    for path in writer.paths:
+        print("Wrote " + path)
+
+    # Last, so results are saved even if drawing fails
+    steps = args.steps if args.steps is not None else 25
+    if steps > 0:
+        sim = Epidemic(G, mode='SIS', seed=args.seed, name='SIS model',
+                       layout=args.layout or "spring")
+        sim.run(steps)
+        sim.draw()
+        sim.plot()
+
     print("Done!")
 if __name__ == "__main__":
     main()
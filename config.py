@@ -0,0 +1,115 @@
+'''
+Command line and config file handling shared by scraper.py, sanitizer.py and
+analyzer.py.
+
+Every option can be given on the command line or in a config file passed
+with `--config`, under a table named after the tool, e.g.
+
+    [scraper]
+    source-nodes = 1000
+    recs = 10
+    delay = 1.5
+
+Command line values win over the config file. Anything still missing is
+asked for interactively, unless `--no-input` is given, in which case the
+recommended value is used or the run stops with an error. Config files may be
+TOML, JSON or, if PyYAML is installed, YAML.
+'''
+import argparse
+import json
+import os
+
+try:
+    import tomllib
+except ImportError:
+    # Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+def load_config(path, section):
+    '''Read the table for one tool out of a config file.'''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".toml":
+        if tomllib is None:
+            raise SystemExit("Reading TOML config needs Python 3.11 or the tomli package")
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    elif ext in (".yaml", ".yml"):
+        if yaml is None:
+            raise SystemExit("Reading YAML config needs the PyYAML package")
+        with open(path, encoding="utf-8") as f:
+            data = yaml.safe_load(f) or {}
+    elif ext == ".json":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    else:
+        raise SystemExit("Unknown config file type: " + path)
+    return {key.replace("-", "_"): value for key, value in data.get(section, {}).items()}
+
+
+def make_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--config", help="TOML, JSON or YAML file with default options")
+    parser.add_argument("--no-input", action="store_true",
+                        help="never prompt, use recommended values for anything not given")
+    parser.add_argument("--graph-dir", default=None,
+                        help="directory graphs are read from and written to (default ./.graphs)")
+    return parser
+
+
+def parse_args(parser, argv, section):
+    '''
+    Parse the command line, filling options it leaves unset from the config
+    file's `section` table.
+    '''
+    args = parser.parse_args(argv)
+    if args.config:
+        choices = {action.dest: action.choices for action in parser._actions
+                   if action.choices is not None}
+        for key, value in load_config(args.config, section).items():
+            if not hasattr(args, key):
+                parser.error(f"unknown option '{key}' in [{section}] of {args.config}")
+            # Checked like the command line, so a typo fails here rather than mid-run
+            if key in choices and value not in choices[key]:
+                parser.error(f"invalid value {value!r} for '{key}' in [{section}] of "
+                             f"{args.config} (choose from {', '.join(map(str, choices[key]))})")
+            if getattr(args, key) in (None, False):
+                setattr(args, key, value)
+    if args.graph_dir is None:
+        args.graph_dir = "./.graphs"
+    return args
+
+
+def ask(args, name, question, cast=str, recommended=None):
+    '''
+    Value of option `name`, prompting for it if it was not given.
+
+    Args:
+        args: parsed arguments from parse_args.
+        name: attribute name of the option.
+        question: the interactive prompt.
+        cast: converts the answer to the option's type.
+        recommended (optional): used for an empty answer, or without asking
+            when `--no-input` is given.
+    '''
+    value = getattr(args, name)
+    if value is not None:
+        return cast(value)
+    if args.no_input:
+        if recommended is None:
+            raise SystemExit("--" + name.replace("_", "-") + " is required with --no-input")
+        return recommended
+    if recommended is not None:
+        question = f"{question} (Press Enter For the Recommended Value, {recommended}) "
+    answer = input(question)
+    if answer == "" and recommended is not None:
+        return recommended
+    return cast(answer)
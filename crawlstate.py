@@ -0,0 +1,85 @@
+'''
+Everything a crawl needs to pick up where it left off, kept beside the graph
+file, e.g. `./.graphs/steam500-10-1.1.0.state.json`.
+'''
+import json
+import os
+
+
+def state_path(graphPath):
+    return os.path.splitext(graphPath)[0] + ".state.json"
+
+
+class CrawlState:
+    '''Progress, settings and appid bookkeeping of a crawl'''
+
+    def __init__(self, sourceNodes=0, settings=None, seen=(), invalid=(), frontier=None,
+                 expanded=(), pending=None):
+        '''
+        Args:
+            sourceNodes: number of source nodes crawled so far, across runs.
+            settings: dict of the crawl settings, e.g. `recCount` and
+                `requestDelay`.
+            seen: appids already in the graph.
+            invalid: appids known to be DLC or otherwise unfit for the graph.
+            frontier: dict of appid to name for recommendations that have
+                been found but not fetched yet.
+            expanded: appids whose own recommendations have been added to the
+                graph, i.e. that were crawled as source nodes.
+            pending: dict of appid to its recommended appids, in rank order,
+                for expanded games some of whose recommendations are still in
+                the frontier.
+
+        Appids are ints; strings, as found in JSON object keys and in state
+        files written before graphs were keyed by appid, are converted.
+        '''
+        self.sourceNodes = sourceNodes
+        self.settings = dict(settings or {})
+        self.seen = {int(id) for id in seen}
+        self.invalid = {int(id) for id in invalid}
+        self.frontier = {int(id): name for id, name in (frontier or {}).items()}
+        self.expanded = {int(id) for id in expanded}
+        self.pending = {int(id): [int(ref) for ref in recs] for id, recs in (pending or {}).items()}
+
+    @property
+    def recCount(self):
+        return self.settings.get("recCount")
+
+    def known(self, id):
+        '''True if fetching `id` again would be redundant.'''
+        return id in self.seen or id in self.invalid
+
+    def to_dict(self):
+        return {
+            "sourceNodes": self.sourceNodes,
+            "settings": self.settings,
+            "seen": sorted(self.seen),
+            "invalid": sorted(self.invalid),
+            "frontier": self.frontier,
+            "expanded": sorted(self.expanded),
+            "pending": self.pending,
+        }
+
+    def save(self, path):
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmpPath, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(**data)
+
+    @classmethod
+    def from_graph(cls, G, graphPath):
+        '''
+        Best guess at the state of a graph written before state files
+        existed. Counts come from the `steam{sources}-{recs}-...` filename and
+        seen appids from the graph itself. Invalid appids are lost.
+        '''
+        parts = os.path.basename(graphPath).split("-")
+        sourceNodes = int(parts[0].replace("steam", ""))
+        settings = {"recCount": int(parts[1])}
+        return cls(sourceNodes, settings, G.nodes)
@@ -0,0 +1,227 @@
+'''
+Node attributes for recommended games without fetching each one's store page.
+
+Every source page already carries some data on the games it recommends: the
+rgApps blob holds each one's name and, in its `discount_block`, the current
+price and discount. Recommended games are then filled in from, in order:
+
+    1. their store page, when a fresh copy is in the page cache
+    2. the rgApps data harvested from source pages
+    3. one IStoreBrowseService/GetItems request per `batchSize` games, which
+       returns release date, reviews, tags, developer and publisher
+
+instead of one full store page per game. GetItems does not report everything
+a store page shows, so some attributes are approximate or missing: reviews
+are only available as the overall summary, so `recentRating`,
+`recentReviews` and `recentRatio` are left empty, genres are not reported at
+all, and tags are the three most applied ones.
+'''
+import datetime
+import json
+import re
+from functools import partial
+from urllib.parse import quote
+
+from metrics import METRICS
+from pipeline import FAILED
+
+API_URL = "https://api.steampowered.com"
+
+# Attributes of a node, in the order parse_app gives them, with the value
+# used when nothing is known
+RECORD = {
+    "price": -1.0,
+    "discount": 0,
+    "releaseDate": "",
+    "year": 0,
+    "tag1": "",
+    "tag2": "",
+    "tag3": "",
+    "recentRating": "N/A",
+    "recentReviews": -1,
+    "allRating": "N/A",
+    "allReviews": -1,
+    "recentRatio": 0.0,
+    "genre1": "",
+    "genre2": "",
+    "genre3": "",
+    "developer": "",
+    "publisher": "",
+    "franchise": "",
+}
+
+PRICE_FINAL = re.compile(r'data-price-final="(\d+)"')
+DISCOUNT_PCT = re.compile(r'class="discount_pct">\s*-?(\d+)%')
+
+
+def harvest_recommendations(rgApps):
+    '''
+    Attributes found in the rgApps data of a page, by appid.
+
+    Args:
+        rgApps: the page's `rgApps` object, appid strings to app data.
+    '''
+    harvested = {}
+    for id, app in rgApps.items():
+        block = app.get("discount_block") or ""
+        price = PRICE_FINAL.search(block)
+        if price is None:
+            continue
+        discount = DISCOUNT_PCT.search(block)
+        harvested[int(id)] = {
+            "price": int(price.group(1)) / 100,
+            "discount": int(discount.group(1)) if discount is not None else 0,
+        }
+    return harvested
+
+
+def items_url(appids, apiUrl=API_URL, country="US", language="english"):
+    request = {
+        "ids": [{"appid": id} for id in appids],
+        "context": {"language": language, "country_code": country},
+        "data_request": {"include_basic_info": True, "include_release": True,
+                         "include_reviews": True, "include_tag_count": 3},
+    }
+    return (apiUrl + "/IStoreBrowseService/GetItems/v1/?input_json="
+            + quote(json.dumps(request, separators=(",", ":"))))
+
+
+def tag_list_url(apiUrl=API_URL, language="english"):
+    return apiUrl + "/IStoreService/GetTagList/v1/?language=" + language
+
+
+def parse_tag_list(text):
+    return {tag["tagid"]: tag["name"] for tag in json.loads(text)["response"].get("tags", [])}
+
+
+def _first_name(entries):
+    return entries[0]["name"] if entries else ""
+
+
+def parse_item(item, tagNames):
+    '''
+    Node attributes from one GetItems store item, or None for DLC and other
+    apps that are not games, and ones without a release year, as parse_app
+    rejects them.
+    '''
+    if item.get("type", 0) != 0:
+        METRICS.incr("rejected", reason="dlc")
+        return None
+    record = {}
+    release = item.get("release", {})
+    if release.get("steam_release_date"):
+        date = datetime.datetime.fromtimestamp(int(release["steam_release_date"]),
+                                               datetime.timezone.utc)
+        record["releaseDate"] = f"{date:%b} {date.day}, {date.year}"
+        record["year"] = date.year
+    elif release.get("custom_release_date_message"):
+        record["releaseDate"] = release["custom_release_date_message"]
+    if "year" not in record:
+        METRICS.incr("rejected", reason="year")
+        return None
+    if item.get("is_free"):
+        record["price"] = 0.0
+    purchase = item.get("best_purchase_option")
+    if purchase is not None and "final_price_in_cents" in purchase:
+        record["price"] = int(purchase["final_price_in_cents"]) / 100
+        record["discount"] = int(purchase.get("discount_pct", 0))
+    tags = [tagNames.get(tag["tagid"], "") for tag in item.get("tags", [])]
+    for i, tag in enumerate(tags[:3]):
+        record["tag" + str(i + 1)] = tag
+    summary = item.get("reviews", {}).get("summary_filtered")
+    if summary is not None:
+        record["allRating"] = summary.get("review_score_label", "N/A")
+        record["allReviews"] = int(summary.get("review_count", -1))
+    info = item.get("basic_info", {})
+    record["developer"] = _first_name(info.get("developers", []))
+    record["publisher"] = _first_name(info.get("publishers", []))
+    record["franchise"] = _first_name(info.get("franchises", []))
+    return record
+
+
+def parse_items(text, tagNames=None):
+    '''
+    GetItems response to a dict of appid to parse_item's result. Items the
+    API could not answer for, or that are hidden, are left out: that says
+    nothing about whether they are games.
+    '''
+    records = {}
+    for item in json.loads(text)["response"].get("store_items", []):
+        if item.get("success") == 1 and item.get("visible", True):
+            id = item["appid"] if "appid" in item else item["id"]
+            records[int(id)] = parse_item(item, tagNames or {})
+    return records
+
+
+class Enricher:
+    '''Fills in recommended games from data at hand, and batched API requests'''
+
+    def __init__(self, pipeline, parsePage, apiUrl=API_URL, batchSize=50):
+        '''
+        Args:
+            pipeline: the crawl's pipeline.ParsePipeline.
+            parsePage: parses a cached store page into node attributes, e.g.
+                scraper.parse_app_page.
+            apiUrl: base URL of the Steam Web API.
+            batchSize: appids per GetItems request.
+        '''
+        self.pipeline = pipeline
+        self.parsePage = parsePage
+        self.apiUrl = apiUrl
+        self.batchSize = batchSize
+        self.harvested = {}
+        self._tagNames = None
+
+    def harvest(self, harvested):
+        '''Keep attributes from harvest_recommendations until they are needed.'''
+        self.harvested.update(harvested)
+
+    def _cached(self, url):
+        cache = self.pipeline.fetcher.cache
+        return cache is not None and cache.fresh(url)
+
+    def tag_names(self):
+        if self._tagNames is None:
+            # Rarely changes, so it is cached like a store page
+            text = self.pipeline.fetcher.fetch(tag_list_url(self.apiUrl), cached=True)
+            self._tagNames = parse_tag_list(text) if text is not None else {}
+        return self._tagNames
+
+    def records(self, appids, pageUrls):
+        '''
+        Node attributes of each game, as parse_app_page gives them.
+
+        Args:
+            appids: the games to fill in.
+            pageUrls: the store page of each.
+
+        Returns:
+            For each appid in order, a dict of attributes, None if the game
+            is invalid, or pipeline.FAILED if nothing could be fetched or the
+            API gave no answer for it.
+        '''
+        records = {}
+        cached = [(id, url) for id, url in zip(appids, pageUrls) if self._cached(url)]
+        if cached:
+            parsed = self.pipeline.map(self.parsePage, [url for _, url in cached], cached=True)
+            records.update((id, record) for (id, _), record in zip(cached, parsed))
+        missing = [id for id in appids
+                   if id not in records and not set(RECORD) <= set(self.harvested.get(id, ()))]
+        batches = [missing[i:i + self.batchSize] for i in range(0, len(missing), self.batchSize)]
+        if batches:
+            parse = partial(parse_items, tagNames=self.tag_names())
+            found = self.pipeline.map(parse, [items_url(batch, self.apiUrl) for batch in batches])
+            for batch, items in zip(batches, found):
+                for id in batch:
+                    # Missing from a throttled or partial answer, so tried again later
+                    records[id] = FAILED if items is FAILED else items.get(id, FAILED)
+        for id in appids:
+            if id in records and (records[id] is None or records[id] is FAILED):
+                continue
+            record = dict(RECORD)
+            record.update(self.harvested.get(id, {}))
+            record.update(records.get(id, {}))
+            records[id] = record
+        for id in appids:
+            self.harvested.pop(id, None)
+        return [records[id] for id in appids]
@@ -0,0 +1,485 @@
+'''
+Vectorized SIS/SIR spreading on a recommendation graph.
+
+Works like the Simulation class in simulation.py, but node states are an
+int8 array and edges a sparse matrix, so each step is a sparse
+matrix-vector product plus a single batched random draw instead of a
+Python loop over every node and neighbor.
+
+A susceptible game with k infected recommendations is infected with
+probability 1 - (1 - BETA)^k, the same as trying BETA once per infected
+neighbor. An infected game recovers with probability MU, becoming
+susceptible again (SIS) or removed (SIR).
+
+run_ensemble runs thousands of independent realizations at once, each a
+column of a state matrix, optionally across worker processes, and keeps
+only per-step state counts rather than the states themselves.
+independent_cascade estimates how far a single game's influence spreads
+the same way, many roots at a time.
+'''
+from functools import partial
+
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+import networkx as nx
+import numpy as np
+
+from fastgraph import CSRGraph, map_batches
+from history import StateHistory
+from layout import LAYOUT_DIR, cached_layout
+
+MU = 0.2
+BETA = 0.1
+
+S = 0
+I = 1
+R = 2
+LABELS = ("S", "I", "R")
+MODES = ("SIS", "SIR")
+
+
+class StopCondition(StopIteration):
+    pass
+
+
+def _transition(A, states, rng, mu, beta, mode):
+    '''
+    Advance states one step in place. `states` is one state per node, or a
+    matrix with one column per independent realization.
+    '''
+    infected = states == I
+    # Infected recommendations of every node
+    k = A @ infected.astype(np.float64)
+    draw = rng.random(states.shape)
+    # Every node is either infected or not, so one draw per node serves both
+    # for recovery and infection
+    recovering = infected & (draw < mu)
+    catching = (states == S) & (draw < 1.0 - (1.0 - beta) ** k)
+    states[recovering] = S if mode == "SIS" else R
+    states[catching] = I
+
+
+def _column_counts(states):
+    return np.stack([(states == value).sum(axis=0) for value in (S, I, R)], axis=-1)
+
+
+class Epidemic:
+    '''Simulate SIS or SIR spreading on a network'''
+
+    def __init__(self, G, mode="SIS", mu=MU, beta=BETA, seed=None,
+                 initial=None, stop_condition=None, name='',
+                 keyframeInterval=32, retain=None, layout="spring", layoutDir=LAYOUT_DIR):
+        '''
+        Create an Epidemic instance.
+
+        Args:
+            G: a networkx graph, or a fastgraph.CSRGraph.
+            mode: "SIS" or "SIR".
+            mu: probability an infected node recovers each step.
+            beta: probability of infection per infected neighbor each step.
+            seed (optional): seed for the random number generator, making
+                runs repeatable.
+            initial (optional): node keys to infect at the start, or an
+                array of states, one per node. Default is one node chosen
+                at random.
+            stop_condition (optional): function with signature
+                `stop_condition(states)` that accepts the array of current
+                node states and returns True if the simulation should stop.
+
+        Keyword Args:
+            name (optional): a string used in titles of plots and drawings.
+            keyframeInterval (optional): steps between full copies of the
+                states in the history, see history.StateHistory.
+            retain (optional): only keep the states of about this many most
+                recent steps. Counts are kept for every step.
+            layout (optional): how nodes are positioned by draw(), one of
+                layout.LAYOUTS. Only computed when first drawing.
+            layoutDir (optional): where computed layouts are cached, or
+                None to not cache them.
+        '''
+        if mode not in MODES:
+            raise ValueError("mode must be one of " + ", ".join(MODES))
+        if stop_condition and not callable(stop_condition):
+            raise TypeError("'stop_condition' should be a function")
+        if isinstance(G, CSRGraph):
+            self.G = None
+            self.graph = G
+        else:
+            self.G = G
+            self.graph = CSRGraph.from_networkx(G)
+        self.mode = mode
+        self.mu = mu
+        self.beta = beta
+        self.rng = np.random.default_rng(seed)
+        self._stop_condition = stop_condition
+        self.name = name or mode + ' model'
+        self._cmap = plt.cm.get_cmap('tab10')
+        self._layout = layout
+        self._layoutDir = layoutDir
+        self._pos = None
+
+        self._current = self._initial_states(initial)
+        self._history = StateHistory(keyframeInterval, retain)
+        self._history.append(self._current)
+
+    def _initial_states(self, initial):
+        n = self.graph.n
+        if initial is None:
+            states = np.full(n, S, dtype=np.int8)
+            states[self.rng.integers(n)] = I
+            return states
+        initial = np.asarray(initial)
+        if initial.dtype == np.int8 and initial.shape == (n,):
+            return initial.copy()
+        position = {node: i for i, node in enumerate(self.graph.nodes)}
+        states = np.full(n, S, dtype=np.int8)
+        states[[position[node] for node in initial.tolist()]] = I
+        return states
+
+    def _step(self):
+        current = self._current
+        if self._stop_condition and self._stop_condition(current):
+            raise StopCondition
+        new = current.copy()
+        _transition(self.graph.A, new, self.rng, self.mu, self.beta, self.mode)
+        self._current = new
+        self._history.append(new)
+
+    @property
+    def steps(self):
+        ''' Returns the number of steps the simulation has run '''
+        return len(self._history) - 1
+
+    def states(self, step=-1):
+        '''
+        Array of node states at a step, in the order of `graph.nodes`.
+
+        Raises:
+            IndexError: if `step` argument is greater than the number of
+                steps, or the step is older than the history retains.
+        '''
+        return self._history.get(step)
+
+    def state(self, step=-1):
+        '''
+        Get a state of the simulation; by default returns the current state.
+
+        Args:
+            step: the step of the simulation to return. Default is -1, the
+            current state.
+
+        Returns:
+            Dictionary of node states, "S", "I" or "R".
+
+        Raises:
+            IndexError: if `step` argument is greater than the number of steps.
+        '''
+        return {node: LABELS[s] for node, s in
+                zip(self.graph.nodes, self.states(step).tolist())}
+
+    def counts(self, step=-1):
+        '''Number of nodes in each state at a step, as a dict.'''
+        return dict(zip(LABELS, self._history.counts(step, len(LABELS)).tolist()))
+
+    def _labels(self):
+        return list(LABELS[:2] if self.mode == "SIS" else LABELS)
+
+    def draw(self, step=-1, labels=None, **kwargs):
+        '''
+        Use networkx.draw to draw a simulation state with nodes colored by
+        their state value. By default, draws the current state.
+
+        Args:
+            step: the step of the simulation to draw. Default is -1, the
+            current state.
+            kwargs: keyword arguments are passed to networkx.draw()
+        '''
+        if self.G is None:
+            raise ValueError("Drawing needs the simulation built from a networkx graph")
+        if self._pos is None:
+            self._pos = cached_layout(self.G, self._layout, self._layoutDir)
+        states = self.states(step).tolist()
+        node_colors = [self._cmap(s) for s in states]
+        nx.draw(self.G, pos=self._pos, nodelist=self.graph.nodes,
+                node_color=node_colors, **kwargs)
+
+        if labels is None:
+            labels = self._labels()
+        patches = [mpl.patches.Patch(color=self._cmap(LABELS.index(l)), label=l)
+                   for l in labels]
+        plt.legend(handles=patches)
+
+        if step == -1:
+            step = self.steps
+        if step == 0:
+            title = 'initial state'
+        else:
+            title = 'step %i' % (step)
+        if self.name:
+            title = '{}: {}'.format(self.name, title)
+        plt.title(title)
+
+    def plot(self, min_step=None, max_step=None, labels=None, **kwargs):
+        '''
+        Use pyplot to plot the relative number of nodes with each state at each
+        simulation step. By default, plots all simulation steps.
+
+        Args:
+            min_step: the first step of the simulation to draw. Default is
+                None, which plots starting from the initial state.
+            max_step: the last step, not inclusive, of the simulation to draw.
+                Default is None, which plots up to the current step.
+            labels: ordered sequence of state values to plot. Default is the
+                states of the model, "S", "I" and, for SIR, "R".
+            kwargs: keyword arguments are passed along to plt.plot()
+
+        Returns:
+            Axes object for the current plot
+        '''
+        x_range = range(min_step or 0, max_step or len(self._history))
+        counts = self._history.count_matrix(min_step, max_step, len(LABELS)) / max(self.graph.n, 1)
+        if labels is None:
+            labels = self._labels()
+
+        for label in labels:
+            plt.plot(x_range, counts[:, LABELS.index(label)], label=label, **kwargs)
+
+        title = 'node state proportions'
+        if self.name:
+            title = '{}: {}'.format(self.name, title)
+        plt.title(title)
+        plt.xlabel('Simulation step')
+        plt.ylabel('Proportion of nodes')
+        plt.legend()
+        plt.xlim(x_range.start)
+
+        return plt.gca()
+
+    def run(self, steps=1):
+        '''
+        Run the simulation one or more steps, as specified by the `steps`
+        argument. Default is to run a single step.
+
+        Args:
+            steps: number of steps to advance the simulation.
+        '''
+        for _ in range(steps):
+            try:
+                self._step()
+            except StopCondition:
+                print(
+                    "Stop condition met at step %i." % self.steps
+                    )
+                break
+
+
+class Ensemble:
+    '''Statistics gathered from many independent epidemic runs'''
+
+    def __init__(self, nodes, mode, steps):
+        self.nodes = nodes
+        self.mode = mode
+        self.steps = steps
+        self.runs = 0
+        # Per-run state counts at every step, int32, never the states
+        self._trajectories = []
+        # Node position -> [runs, sum of final S/I/R, sum of their squares]
+        self._roots = {}
+
+    def add(self, roots, counts):
+        '''
+        Fold in a batch of runs.
+
+        Args:
+            roots: position of each run's patient zero.
+            counts: array of shape (runs, steps + 1, 3) with the number of
+                S, I and R nodes at each step of each run.
+        '''
+        self.runs += len(roots)
+        self._trajectories.append(counts.astype(np.int32))
+        for root, final in zip(roots.tolist(), counts[:, -1].astype(np.float64)):
+            total = self._roots.setdefault(root, [0, np.zeros(3), np.zeros(3)])
+            total[0] += 1
+            total[1] += final
+            total[2] += final ** 2
+
+    def _all(self):
+        if len(self._trajectories) > 1:
+            self._trajectories = [np.concatenate(self._trajectories)]
+        return self._trajectories[0]
+
+    def mean(self):
+        '''Mean S/I/R counts at each step, shape (steps + 1, 3).'''
+        return self._all().mean(axis=0)
+
+    def quantiles(self, qs=(0.05, 0.5, 0.95)):
+        '''S/I/R count quantiles at each step, shape (len(qs), steps + 1, 3).'''
+        return np.quantile(self._all(), qs, axis=0)
+
+    def by_root(self):
+        '''
+        Final S/I/R counts for each patient zero that was used.
+
+        Returns:
+            Dictionary of node key to `(runs, mean, std)`, with mean and
+            std arrays of S, I and R counts.
+        '''
+        summary = {}
+        for root, (runs, total, squares) in self._roots.items():
+            mean = total / runs
+            std = np.sqrt(np.maximum(squares / runs - mean ** 2, 0.0))
+            summary[self.nodes[root]] = (runs, mean, std)
+        return summary
+
+    def to_dict(self, qs=(0.05, 0.5, 0.95)):
+        '''Summary as plain lists and dicts, ready for json.dump.'''
+        quantiles = self.quantiles(qs)
+        return {
+            "mode": self.mode,
+            "runs": self.runs,
+            "steps": self.steps,
+            "mean": self.mean().tolist(),
+            "quantiles": {str(q): quantiles[i].tolist() for i, q in enumerate(qs)},
+            "roots": {
+                str(node): {
+                    "runs": runs,
+                    "susceptibles": mean[S],
+                    "infectees": mean[I],
+                    "recovered": mean[R],
+                    "std": std.tolist(),
+                }
+                for node, (runs, mean, std) in self.by_root().items()},
+        }
+
+
+def _ensemble_batch(g, job, mode, mu, beta, steps):
+    roots, seedSequence = job
+    rng = np.random.default_rng(seedSequence)
+    columns = np.arange(len(roots))
+    states = np.full((g.n, len(roots)), S, dtype=np.int8)
+    states[roots, columns] = I
+    counts = np.empty((len(roots), steps + 1, 3), dtype=np.int32)
+    counts[:, 0] = _column_counts(states)
+    for step in range(1, steps + 1):
+        _transition(g.A, states, rng, mu, beta, mode)
+        counts[:, step] = _column_counts(states)
+    return roots, counts
+
+
+def run_ensemble(G, mode="SIS", runs=1000, steps=10, mu=MU, beta=BETA, seed=None,
+                 roots=None, workers=0, batchSize=64, progress=None):
+    '''
+    Run many independent epidemics, each from a single patient zero.
+
+    Runs are simulated `batchSize` at a time as the columns of one state
+    matrix. Each batch draws from its own child of `seed`'s SeedSequence,
+    so results depend only on the seed, not on how many workers ran them.
+
+    Args:
+        G: a networkx graph, or a fastgraph.CSRGraph.
+        mode: "SIS" or "SIR".
+        runs: number of realizations.
+        steps: steps each realization runs for.
+        mu, beta: recovery and infection probabilities.
+        seed (optional): makes the ensemble repeatable.
+        roots (optional): node keys to use as patient zero, cycled through
+            in order. Default is a node chosen at random for every run.
+        workers: number of worker processes, or 0 to run in this process.
+        batchSize: runs simulated together as one matrix.
+        progress (optional): called as `progress(done, total)` after each
+            batch.
+
+    Returns:
+        An Ensemble.
+    '''
+    if mode not in MODES:
+        raise ValueError("mode must be one of " + ", ".join(MODES))
+    g = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+    ensemble = Ensemble(g.nodes, mode, steps)
+    if g.n == 0 or runs <= 0:
+        return ensemble
+    batchCount = -(-runs // batchSize)
+    rootSequence, *batchSequences = np.random.SeedSequence(seed).spawn(batchCount + 1)
+    if roots is None:
+        starts = np.random.default_rng(rootSequence).integers(g.n, size=runs)
+    else:
+        position = {node: i for i, node in enumerate(g.nodes)}
+        starts = np.resize([position[node] for node in roots], runs)
+    jobs = [(starts[i * batchSize:(i + 1) * batchSize], batchSequences[i])
+            for i in range(batchCount)]
+    task = partial(_ensemble_batch, mode=mode, mu=mu, beta=beta, steps=steps)
+    for batchRoots, counts in map_batches(g, task, jobs, workers, progress):
+        ensemble.add(batchRoots, counts)
+    return ensemble
+
+
+def _cascade_batch(g, job, probability, iterations, keepSets):
+    roots, seedSequence = job
+    rng = np.random.default_rng(seedSequence)
+    columns = np.arange(len(roots))
+    active = np.zeros((g.n, len(roots)), dtype=bool)
+    active[roots, columns] = True
+    frontier = active
+    for _ in range(iterations):
+        # Newly reached games each get one try at every game they recommend
+        k = g.AT @ frontier.astype(np.float64)
+        exposed = ~active & (k > 0)
+        catching = np.zeros_like(active)
+        catching[exposed] = rng.random(int(exposed.sum())) < 1.0 - (1.0 - probability) ** k[exposed]
+        if not catching.any():
+            break
+        active |= catching
+        frontier = catching
+    active[roots, columns] = False
+    sets = [np.flatnonzero(active[:, j]) for j in columns] if keepSets else None
+    return roots, active.sum(axis=0), sets
+
+
+def independent_cascade(G, probability=0.2, iterations=10, roots=None, sample=None,
+                        seed=None, keepSets=True, workers=0, batchSize=64, progress=None):
+    '''
+    Spread from each root as an independent cascade: every newly reached
+    game gets a single chance, with `probability`, to reach each game it
+    recommends, for at most `iterations` rounds.
+
+    Args:
+        G: a networkx graph, or a fastgraph.CSRGraph.
+        probability: chance each recommendation passes the spread on.
+        iterations: maximum number of rounds, i.e. hops from the root.
+        roots (optional): node keys to start from. Default is every node.
+        sample (optional): start from this many randomly chosen roots
+            instead.
+        seed (optional): makes the sample and the cascades repeatable.
+        keepSets: also return which games each root reached, not only
+            how many.
+        workers: number of worker processes, or 0 to run in this process.
+        batchSize: roots spread together as one matrix.
+        progress (optional): called as `progress(done, total)` after each
+            batch.
+
+    Returns:
+        `(counts, reach)`: dictionaries of root to the number of games it
+        reached, and to the set of them (empty unless `keepSets`). The
+        root itself is not counted.
+    '''
+    g = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+    rootSequence, batchSequence = np.random.SeedSequence(seed).spawn(2)
+    if roots is not None:
+        position = {node: i for i, node in enumerate(g.nodes)}
+        starts = np.array([position[node] for node in roots], dtype=np.int64)
+    elif sample is not None and sample < g.n:
+        starts = np.sort(np.random.default_rng(rootSequence).choice(g.n, sample, replace=False))
+    else:
+        starts = np.arange(g.n)
+    batches = [starts[i:i + batchSize] for i in range(0, len(starts), batchSize)]
+    jobs = list(zip(batches, batchSequence.spawn(len(batches))))
+    task = partial(_cascade_batch, probability=probability, iterations=iterations,
+                   keepSets=keepSets)
+    counts = {}
+    reach = {}
+    for batchRoots, batchCounts, sets in map_batches(g, task, jobs, workers, progress):
+        for j, root in enumerate(batchRoots.tolist()):
+            counts[g.nodes[root]] = int(batchCounts[j])
+            if keepSets:
+                reach[g.nodes[root]] = {g.nodes[i] for i in sets[j].tolist()}
+    return counts, reach
@@ -0,0 +1,368 @@
+'''
+Targeted lxml extraction of store page fields.
+
+Mirrors the BeautifulSoup helpers in scraper.py (get_price, get_tags,
+get_review_data, get_release_data, get_genres_and_developer, is_dlc) field
+for field, but parses each page once with libxml2 and locates every field
+with a precompiled XPath instead of walking the tree with soup.find.
+
+Running this module compares both engines over saved pages and reports
+any field that differs, along with pages/sec for each engine:
+
+    python ./extractor.py [--cache ./.cache/pages.sqlite] [page.html | dir ...]
+
+Saved pages with known field values are kept in ./golden/, with the values
+each should give in ./golden/expected.json: a game, a DLC, a game without a
+release year and a discounted game. To check both engines give exactly
+those values:
+
+    python ./extractor.py --golden ./golden
+'''
+import re
+
+from lxml import etree
+from lxml import html as lxmlhtml
+
+from metrics import METRICS
+
+
+def _has_class(name):
+    # Same semantics as bs4's class_="name" for a single class name
+    return "contains(concat(' ', normalize-space(@class), ' '), ' %s ')" % name
+
+
+def _is_class(value):
+    # bs4 matches a multi-word class_ against the whole attribute value
+    return "normalize-space(@class)='%s'" % value
+
+
+PURCHASE = etree.XPath("(//div[%s])[1]" % _has_class("game_purchase_action_bg"))
+PRICE = etree.XPath("(.//div[%s])[1]" % _is_class("game_purchase_price price"))
+DISCOUNT_PRICE = etree.XPath("(.//div[%s])[1]" % _has_class("discount_final_price"))
+DISCOUNT_PCT = etree.XPath("(.//div[%s])[1]" % _has_class("discount_pct"))
+TAGS = etree.XPath("//a[%s]" % _has_class("app_tag"))
+REVIEWS = etree.XPath("(//div[@id='userReviews'])[1]")
+REVIEW_ROWS = etree.XPath(".//div[%s]" % _has_class("user_reviews_summary_row"))
+REVIEW_SUMMARY = etree.XPath("(.//span[%s])[1]" % _has_class("game_review_summary"))
+REVIEW_COUNT = etree.XPath("(.//span[%s])[1]" % _has_class("responsive_hidden"))
+RELEASE = etree.XPath("(//div[%s])[1]" % _has_class("date"))
+GENRES_AND_DEVELOPER = etree.XPath("(//div[@id='genresAndManufacturer'])[1]")
+FIRST_SPAN = etree.XPath("(.//span)[1]")
+LINKS = etree.XPath(".//a")
+FIRST_LINK = etree.XPath("(.//a)[1]")
+DEV_ROWS = etree.XPath(".//div[%s]" % _has_class("dev_row"))
+DLC = etree.XPath("(//div[%s])[1]" % _has_class("game_area_dlc_bubble"))
+APP_NAME = etree.XPath("(//div[%s])[1]" % _has_class("apphub_AppName"))
+APP_ID = etree.XPath("(//div[%s])[1]" % _is_class("glance_tags popular_tags"))
+
+
+def _first(xpath, node):
+    found = xpath(node)
+    return found[0] if found else None
+
+
+def _text(node):
+    return node.text_content().strip()
+
+
+def get_price(root):
+    price = -1.0
+    discount = 0
+    purchaseTag = _first(PURCHASE, root)
+    if purchaseTag is not None:
+        priceTag = _first(PRICE, purchaseTag)
+        disPriceTag = _first(DISCOUNT_PRICE, purchaseTag)
+        discountTag = _first(DISCOUNT_PCT, purchaseTag)
+        if priceTag is None:
+            if disPriceTag is None or discountTag is None:
+                price = -2.0
+            else:
+                price = float(_text(disPriceTag).replace("$", ""))
+                discount = int(_text(discountTag).replace(
+                    "%", "").replace("-", ""))
+        elif _text(priceTag).find("Free") != -1:
+            price = 0.0
+        elif _text(priceTag)[0] != "$":
+            price = -1.0
+        else:
+            price = float(_text(priceTag).replace("$", ""))
+    return (price, discount)
+
+
+def get_tags(root):
+    tagsTags = TAGS(root)
+    tags = ["", "", ""]
+    for i in range(3):
+        if i < len(tagsTags):
+            tags[i] = _text(tagsTags[i])
+    return tags
+
+
+def _review_row(row):
+    rating = None
+    reviews = None
+    ratingTag = _first(REVIEW_SUMMARY, row)
+    if ratingTag is not None:
+        rating = _text(ratingTag)
+    reviewsTag = _first(REVIEW_COUNT, row)
+    if reviewsTag is not None:
+        reviews = int(re.sub('[(),]', "", _text(reviewsTag)))
+    return rating, reviews
+
+
+def get_review_data(root):
+    reviewData = _first(REVIEWS, root)
+    recentRating = "N/A"
+    recentReviews = -1
+    allRating = "N/A"
+    allReviews = -1
+    recentRatio = 0.0
+    if reviewData is not None:
+        data = REVIEW_ROWS(reviewData)
+        if len(data) > 0:
+            rating, reviews = _review_row(data[0])
+            if rating is not None:
+                recentRating = rating
+            if reviews is not None:
+                recentReviews = reviews
+                recentRatio = 1.0
+        if len(data) == 2:
+            rating, reviews = _review_row(data[1])
+            if rating is not None:
+                allRating = rating
+            if reviews is not None:
+                allReviews = reviews
+            if allReviews != 0:
+                recentRatio = float(recentReviews / allReviews)
+        else:
+            allRating = recentRating
+            allReviews = recentReviews
+    return (recentRating, recentReviews, allRating, allReviews, recentRatio)
+
+
+def get_release_data(root):
+    releaseDate = ""
+    year = 0
+    releaseData = _first(RELEASE, root)
+    if releaseData is not None:
+        releaseDate = _text(releaseData)
+        if releaseDate[-4:].isnumeric():
+            year = int(releaseDate[-4:])
+    return releaseDate, year
+
+
+def get_genres_and_developer(root):
+    genres = ["", "", ""]
+    developer = ""
+    publisher = ""
+    franchise = ""
+    allData = _first(GENRES_AND_DEVELOPER, root)
+    if allData is not None:
+        genreBlock = _first(FIRST_SPAN, allData)
+        if genreBlock is not None:
+            genreTags = LINKS(genreBlock)
+            for i in range(3):
+                if i < len(genreTags):
+                    genres[i] = _text(genreTags[i])
+        developerData = DEV_ROWS(allData)
+        if len(developerData) > 0:
+            developer = _text(_first(FIRST_LINK, developerData[0]))
+            if len(developerData) > 1:
+                publisher = _text(_first(FIRST_LINK, developerData[1]))
+            if len(developerData) > 2:
+                franchise = _text(_first(FIRST_LINK, developerData[2]))
+    return genres, developer, publisher, franchise
+
+
+def is_dlc(root):
+    return _first(DLC, root) is not None
+
+
+def parse(text):
+    '''Parse a page into an lxml tree, or None if there is nothing to parse.'''
+    if text is None or not text.strip():
+        return None
+    return lxmlhtml.document_fromstring(text)
+
+
+def extract_app(root):
+    '''lxml counterpart of scraper.parse_app.'''
+    if root is None:
+        return None
+    with METRICS.timer("extract_seconds", extractor="is_dlc"):
+        dlc = is_dlc(root)
+    if dlc:
+        METRICS.incr("rejected", reason="dlc")
+        return None
+    with METRICS.timer("extract_seconds", extractor="get_price"):
+        price, discount = get_price(root)
+    with METRICS.timer("extract_seconds", extractor="get_tags"):
+        tags = get_tags(root)
+    with METRICS.timer("extract_seconds", extractor="get_release_data"):
+        releaseDate, year = get_release_data(root)
+    with METRICS.timer("extract_seconds", extractor="get_review_data"):
+        recentRating, recentReviews, allRating, allReviews, recentRatio = get_review_data(
+            root)
+    with METRICS.timer("extract_seconds", extractor="get_genres_and_developer"):
+        genres, developer, publisher, franchise = get_genres_and_developer(root)
+
+    if year == 0:
+        METRICS.incr("rejected", reason="year")
+        return None
+
+    return {
+        "price": price,
+        "discount": discount,
+        "releaseDate": releaseDate,
+        "year": year,
+        "tag1": tags[0],
+        "tag2": tags[1],
+        "tag3": tags[2],
+        "recentRating": recentRating,
+        "recentReviews": recentReviews,
+        "allRating": allRating,
+        "allReviews": allReviews,
+        "recentRatio": recentRatio,
+        "genre1": genres[0],
+        "genre2": genres[1],
+        "genre3": genres[2],
+        "developer": developer,
+        "publisher": publisher,
+        "franchise": franchise
+    }
+
+
+def extract_identity(root):
+    '''Name and appid of the game a page belongs to, or None.'''
+    if root is None:
+        return None
+    nameTag = _first(APP_NAME, root)
+    if nameTag is None:
+        return None
+    idTag = _first(APP_ID, root)
+    if idTag is None or idTag.get("data-appid") is None:
+        return None
+    return _text(nameTag), idTag.get("data-appid")
+
+
+def _load_pages(paths, cachePath=None):
+    import os
+    import sqlite3
+    import zlib
+
+    pages = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, f) for f in os.listdir(path))
+        else:
+            files = [path]
+        for file in files:
+            with open(file, encoding="utf-8") as f:
+                pages.append((file, f.read()))
+    if cachePath is not None:
+        db = sqlite3.connect(cachePath)
+        for key, body in db.execute("SELECT key, body FROM pages ORDER BY key"):
+            pages.append((key, zlib.decompress(body).decode("utf-8")))
+        db.close()
+    return pages
+
+
+def check_golden(directory):
+    '''
+    Compare both engines with the expected values of the saved pages in a
+    directory.
+
+    Returns:
+        A list of `(page, engine, field, expected, actual)` for every field
+        an engine got wrong, empty if both got every page right.
+    '''
+    import json
+    import os
+
+    from bs4 import BeautifulSoup
+
+    import scraper
+
+    with open(os.path.join(directory, "expected.json"), encoding="utf-8") as f:
+        expected = json.load(f)
+    engines = {
+        "html.parser": lambda text: scraper.parse_app(BeautifulSoup(text, 'html.parser')),
+        "lxml": lambda text: extract_app(parse(text)),
+    }
+    failures = []
+    for page, want in expected.items():
+        with open(os.path.join(directory, page), encoding="utf-8") as f:
+            text = f.read()
+        for engine, extract in engines.items():
+            got = extract(text)
+            if want is None or got is None:
+                if want != got:
+                    failures.append((page, engine, None, want, got))
+                continue
+            for field in sorted(set(want) | set(got)):
+                if want.get(field) != got.get(field):
+                    failures.append((page, engine, field, want.get(field), got.get(field)))
+    return failures
+
+
+def main():
+    import argparse
+    import time
+
+    from bs4 import BeautifulSoup
+
+    import scraper
+
+    parser = argparse.ArgumentParser(
+        description="Check the lxml extractor against the BeautifulSoup one "
+                    "on saved store pages and compare their speed.")
+    parser.add_argument("pages", nargs="*", help="saved pages or directories of them")
+    parser.add_argument("--cache", help="also use every page in a page cache file")
+    parser.add_argument("--golden", metavar="DIR",
+                        help="check both engines against the expected values of the saved "
+                             "pages in DIR, e.g. ./golden")
+    args = parser.parse_args()
+
+    if args.golden is not None:
+        failures = check_golden(args.golden)
+        for page, engine, field, want, got in failures:
+            print(f"{page}: {engine}: {field or 'record'}: expected {want!r}, got {got!r}")
+        print(f"{len(failures)} golden values wrong")
+        if failures:
+            raise SystemExit(1)
+        return
+
+    pages = _load_pages(args.pages, args.cache)
+    if not pages:
+        parser.error("no pages given")
+
+    start = time.perf_counter()
+    expected = [scraper.parse_app(BeautifulSoup(text, 'html.parser'))
+                for _, text in pages]
+    soupTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [extract_app(parse(text)) for _, text in pages]
+    lxmlTime = time.perf_counter() - start
+
+    mismatches = 0
+    for (name, _), want, got in zip(pages, expected, actual):
+        if want == got:
+            continue
+        mismatches += 1
+        if want is None or got is None:
+            print(f"{name}: html.parser -> {want}, lxml -> {got}")
+            continue
+        for field in want:
+            if want[field] != got[field]:
+                print(f"{name}: {field}: {want[field]!r} != {got[field]!r}")
+
+    print(f"{len(pages)} pages, {mismatches} mismatched")
+    print(f"BeautifulSoup html.parser: {len(pages) / soupTime:.1f} pages/sec")
+    print(f"lxml XPath: {len(pages) / lxmlTime:.1f} pages/sec")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
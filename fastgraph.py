@@ -0,0 +1,396 @@
+'''
+Array-backed graph core for analysis.
+
+Nodes are numbered 0..n-1 and edges held as a SciPy CSR matrix, built once
+from a NetworkX graph or straight from a graph saved with
+`--format arrays`. The metrics below run level-synchronous BFS over a batch
+of sources at a time, as sparse-matrix by dense-matrix products, instead of
+NetworkX's per-node Python loops. They match NetworkX's unweighted results:
+
+    degree_centrality       nx.degree_centrality
+    closeness_centrality    nx.closeness_centrality (incoming distance,
+                            wf_improved=True)
+    betweenness_centrality  nx.betweenness_centrality (normalized)
+    component_counts        nx.number_weakly_connected_components,
+                            nx.number_strongly_connected_components
+
+Closeness and betweenness split their sources into batches that can be
+spread over a pool of worker processes, each holding its own copy of the
+graph, and betweenness can be estimated from a random sample of `k`
+sources as with nx.betweenness_centrality(G, k=k, seed=seed).
+
+To check every metric still matches NetworkX on small random graphs,
+computed in this process, in worker processes, and updated from cached
+results for a smaller version of each graph as analysiscache.py does:
+
+    python ./fastgraph.py [--seed 0] [--workers 2]
+'''
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+
+class CSRGraph:
+    '''A directed graph as integer node ids and CSR adjacency'''
+
+    def __init__(self, nodes, indptr, indices, weights=None):
+        '''
+        Args:
+            nodes: node keys, position i holding the key of node i.
+            indptr, indices: out-edges in CSR form.
+            weights (optional): edge weights aligned with `indices`.
+        '''
+        self.nodes = list(nodes)
+        self.n = len(self.nodes)
+        indptr = np.asarray(indptr, dtype=np.int64)
+        indices = np.asarray(indices, dtype=np.int32)
+        if weights is None:
+            weights = np.ones(len(indices), dtype=np.float32)
+        self.weights = np.asarray(weights)
+        # Unweighted adjacency, A[u, v] == 1 for an edge u -> v
+        self.A = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float64), indices, indptr),
+            shape=(self.n, self.n))
+        self.AT = self.A.T.tocsr()
+
+    @classmethod
+    def from_networkx(cls, G):
+        nodes = list(G.nodes)
+        position = {node: i for i, node in enumerate(nodes)}
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        indices = []
+        weights = []
+        for i, node in enumerate(nodes):
+            targets = G.adj[node]
+            indptr[i + 1] = indptr[i] + len(targets)
+            indices.extend(position[v] for v in targets)
+            weights.extend(data.get("weight", 1.0) for data in targets.values())
+        return cls(nodes, indptr, indices, weights)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''Build from a graphstore.GraphArrays without going through NetworkX.'''
+        return cls(arrays.nodes.tolist(), arrays.indptr, arrays.indices, arrays.weights)
+
+
+def graph_hash(g):
+    '''
+    Hex digest of a graph's nodes and edges, the same however the nodes are
+    ordered. Attributes and weights are not included.
+    '''
+    keys = [str(node) for node in g.nodes]
+    order = sorted(range(g.n), key=keys.__getitem__)
+    rank = np.empty(g.n, dtype=np.int64)
+    rank[order] = np.arange(g.n)
+    sources = rank[np.repeat(np.arange(g.n), np.diff(g.A.indptr))]
+    targets = rank[g.A.indices]
+    edges = np.lexsort((targets, sources))
+    digest = hashlib.sha256()
+    digest.update("\n".join(keys[i] for i in order).encode("utf-8"))
+    digest.update(sources[edges].tobytes())
+    digest.update(targets[edges].tobytes())
+    return digest.hexdigest()
+
+
+def degree_centrality(g):
+    if g.n <= 1:
+        return np.ones(g.n)
+    degree = np.diff(g.A.indptr) + np.diff(g.AT.indptr)
+    return degree / (g.n - 1)
+
+
+def _bfs(step, sources, n):
+    '''
+    BFS from every source at once, one column per source.
+
+    Args:
+        step: sparse matrix taking a frontier to its next level, `AT` to
+            follow edges forwards, `A` to follow them backwards.
+
+    Returns:
+        `(dist, sigma, depth)`: hop distances (-1 if unreachable), shortest
+        path counts and the deepest level reached.
+    '''
+    b = len(sources)
+    columns = np.arange(b)
+    dist = np.full((n, b), -1, dtype=np.int32)
+    sigma = np.zeros((n, b))
+    dist[sources, columns] = 0
+    sigma[sources, columns] = 1.0
+    frontier = sigma.copy()
+    depth = 0
+    while True:
+        reached = step @ frontier
+        reached[dist >= 0] = 0.0
+        found = reached > 0
+        if not found.any():
+            break
+        depth += 1
+        dist[found] = depth
+        sigma[found] = reached[found]
+        frontier = np.where(found, reached, 0.0)
+    return dist, sigma, depth
+
+
+def _batches(sources, batchSize, workers=0):
+    if workers > 0:
+        # Enough batches to keep every worker busy until near the end
+        batchSize = max(1, min(batchSize, -(-len(sources) // (workers * 4))))
+    return [sources[i:i + batchSize] for i in range(0, len(sources), batchSize)]
+
+
+def _closeness_batch(g, sources):
+    # Distances *to* each source, as NetworkX uses for directed graphs
+    dist, _, _ = _bfs(g.A, sources, g.n)
+    reached = dist >= 0
+    totsp = np.where(reached, dist, 0).sum(axis=0).astype(np.float64)
+    r = reached.sum(axis=0)
+    value = np.zeros(len(sources))
+    ok = totsp > 0
+    value[ok] = (r[ok] - 1) / totsp[ok] * (r[ok] - 1) / (g.n - 1)
+    return sources, value
+
+
+def _betweenness_batch(g, sources):
+    # Brandes' dependency accumulation, level by level back from the deepest
+    n = g.n
+    dist, sigma, depth = _bfs(g.AT, sources, n)
+    delta = np.zeros((n, len(sources)))
+    for d in range(depth, 0, -1):
+        atLevel = dist == d
+        coefficient = np.where(atLevel, (1.0 + delta) / np.where(atLevel, sigma, 1.0), 0.0)
+        delta += np.where(dist == d - 1, sigma * (g.A @ coefficient), 0.0)
+    delta[sources, np.arange(len(sources))] = 0.0
+    return delta.sum(axis=1)
+
+
+_workerGraph = None
+
+
+def _start_worker(g):
+    global _workerGraph
+    _workerGraph = g
+
+
+def _run_in_worker(task, batch):
+    return task(_workerGraph, batch)
+
+
+def map_batches(g, task, batches, workers=0, progress=None):
+    '''
+    Run `task(g, batch)` for every batch, e.g. of sources, yielding the
+    results in whatever order they finish.
+
+    Args:
+        task: a module-level function, or functools.partial of one, so it
+            can be sent to worker processes.
+        workers: number of worker processes, or 0 to run in this process.
+        progress (optional): called as `progress(done, total)` after each
+            batch.
+    '''
+    if workers <= 0:
+        for done, batch in enumerate(batches, 1):
+            yield task(g, batch)
+            if progress:
+                progress(done, len(batches))
+        return
+    with ProcessPoolExecutor(workers, initializer=_start_worker, initargs=(g,)) as pool:
+        futures = [pool.submit(_run_in_worker, task, batch) for batch in batches]
+        for done, future in enumerate(as_completed(futures), 1):
+            yield future.result()
+            if progress:
+                progress(done, len(batches))
+
+
+def closeness_centrality(g, batchSize=64, workers=0, progress=None, targets=None):
+    '''
+    Closeness centrality.
+
+    Args:
+        targets (optional): positions of the nodes to compute it for,
+            leaving the rest 0. Default is every node.
+    '''
+    n = g.n
+    closeness = np.zeros(n)
+    if n <= 1:
+        return closeness
+    targets = np.arange(n) if targets is None else np.asarray(targets, dtype=np.int64)
+    batches = _batches(targets, batchSize, workers)
+    for sources, value in map_batches(g, _closeness_batch, batches, workers, progress):
+        closeness[sources] = value
+    return closeness
+
+
+def betweenness_contributions(g, sources, batchSize=64, workers=0, progress=None):
+    '''
+    Unnormalized betweenness gathered from shortest paths starting at
+    `sources`.
+    '''
+    betweenness = np.zeros(g.n)
+    batches = _batches(np.asarray(sources), batchSize, workers)
+    for partial in map_batches(g, _betweenness_batch, batches, workers, progress):
+        betweenness += partial
+    return betweenness
+
+
+def rescale_betweenness(betweenness, n, k=None):
+    '''Normalize as nx.betweenness_centrality does for directed graphs.'''
+    if n <= 2:
+        return betweenness
+    scale = 1.0 / ((n - 1) * (n - 2))
+    if k is not None:
+        scale = scale * n / k
+    return betweenness * scale
+
+
+def betweenness_centrality(g, batchSize=64, workers=0, k=None, seed=None, progress=None):
+    '''
+    Normalized betweenness centrality.
+
+    Args:
+        batchSize: sources searched together in one batch.
+        workers: number of worker processes, or 0 to run in this process.
+        k (optional): estimate from `k` randomly chosen sources instead of
+            all of them.
+        seed (optional): seed for choosing the `k` sources.
+        progress (optional): called as `progress(done, total)` after each
+            batch.
+    '''
+    if k is None or k >= g.n:
+        sources = np.arange(g.n)
+        k = None
+    else:
+        sources = np.sort(np.random.default_rng(seed).choice(g.n, k, replace=False))
+    betweenness = betweenness_contributions(g, sources, batchSize, workers, progress)
+    return rescale_betweenness(betweenness, g.n, k)
+
+
+def reachable(g, starts, reverse=False, hops=None):
+    '''
+    Which nodes can be reached from any of `starts`, or with `reverse`,
+    which can reach one of them, optionally within `hops` edges.
+    '''
+    step = g.A if reverse else g.AT
+    seen = np.zeros(g.n, dtype=bool)
+    seen[np.asarray(starts, dtype=np.int64)] = True
+    frontier = seen.copy()
+    hop = 0
+    while frontier.any() and (hops is None or hop < hops):
+        frontier = (step @ frontier.astype(np.float64) > 0) & ~seen
+        seen |= frontier
+        hop += 1
+    return seen
+
+
+def component_counts(g):
+    '''Number of weakly and strongly connected components.'''
+    weak, _ = csgraph.connected_components(g.A, directed=True, connection="weak")
+    strong, _ = csgraph.connected_components(g.A, directed=True, connection="strong")
+    return weak, strong
+
+
+def check_networkx(seed=0, workers=2, tolerance=1e-9):
+    '''
+    Compare every metric with NetworkX on small random graphs keyed by
+    appid-like integers.
+
+    Each graph is analyzed three ways: here, over `workers` processes in
+    small batches, and through analysiscache.CachedAnalysis updating the
+    saved results of an older version of the graph, before a crawl added a
+    few games recommended by ones already in it.
+
+    Returns:
+        A list of `(graph, way, metric, difference)` for every metric off by
+        more than `tolerance`, empty if all of them match.
+    '''
+    import random
+    import tempfile
+
+    import networkx as nx
+
+    from analysiscache import CachedAnalysis
+
+    rng = random.Random(seed)
+    graphs = {
+        "single": nx.DiGraph([(620, 620)]),
+        "pair": nx.DiGraph([(620, 400)]),
+        "path": nx.relabel_nodes(nx.path_graph(6, nx.DiGraph), lambda i: 1000 + i),
+        "cycle": nx.relabel_nodes(nx.cycle_graph(7, nx.DiGraph), lambda i: 2000 + i),
+    }
+    graphs["single"].remove_edge(620, 620)
+    for n, p in ((30, 0.05), (40, 0.1), (60, 0.03), (80, 0.015), (50, 0.3)):
+        G = nx.gnp_random_graph(n, p, seed=rng.randrange(2 ** 32), directed=True)
+        appids = rng.sample(range(10, 2000000), n)
+        graphs[f"gnp{n}-{p}"] = nx.relabel_nodes(G, dict(enumerate(appids)))
+
+    failures = []
+    for name, older in graphs.items():
+        G = older.copy()
+        # Recommended by games few others lead to, so only part of the
+        # graph is affected and the update is not a full recompute
+        referrers = sorted(older, key=lambda node: len(nx.ancestors(older, node)))
+        referrers = referrers[:max(2, len(referrers) // 2)]
+        for appid in rng.sample(range(2000000, 3000000), 3 if len(older) >= 6 else 1):
+            for node in rng.sample(referrers, min(2, len(referrers))):
+                G.add_edge(node, appid)
+        expected = {
+            "degree": nx.degree_centrality(G),
+            "closeness": nx.closeness_centrality(G),
+            "betweenness": nx.betweenness_centrality(G),
+        }
+        components = (nx.number_weakly_connected_components(G),
+                      nx.number_strongly_connected_components(G))
+        g = CSRGraph.from_networkx(G)
+        ways = {
+            "direct": {"degree": degree_centrality(g),
+                       "closeness": closeness_centrality(g),
+                       "betweenness": betweenness_centrality(g),
+                       "components": component_counts(g)},
+            "workers": {"closeness": closeness_centrality(g, batchSize=4, workers=workers),
+                        "betweenness": betweenness_centrality(g, batchSize=4, workers=workers)},
+        }
+        with tempfile.TemporaryDirectory() as cacheDir:
+            analysis = CachedAnalysis(CSRGraph.from_networkx(older), cacheDir)
+            analysis.degree(), analysis.components(), analysis.betweenness(), analysis.closeness()
+            analysis.save()
+            analysis = CachedAnalysis(g, cacheDir)
+            ways["updated"] = {"degree": analysis.degree(), "closeness": analysis.closeness(),
+                               "betweenness": analysis.betweenness(),
+                               "components": analysis.components()}
+        for way, results in ways.items():
+            for metric, values in results.items():
+                if metric == "components":
+                    if tuple(values) != components:
+                        failures.append((name, way, metric, f"{tuple(values)} != {components}"))
+                    continue
+                difference = max((abs(value - expected[metric][node])
+                                  for node, value in zip(g.nodes, np.asarray(values).tolist())),
+                                 default=0.0)
+                if difference > tolerance:
+                    failures.append((name, way, metric, difference))
+    return failures
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Check the array-backed metrics against NetworkX on small random graphs.")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random graphs")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="worker processes to also compute the metrics in")
+    args = parser.parse_args()
+
+    failures = check_networkx(args.seed, args.workers)
+    for name, way, metric, difference in failures:
+        print(f"{name}: {way}: {metric} differs by {difference}")
+    print(f"{len(failures)} metrics differ from NetworkX")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
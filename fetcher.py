@@ -0,0 +1,177 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from metrics import METRICS
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    # urllib3 only decodes brotli responses when one of these is installed
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        ACCEPT_ENCODING = "gzip, deflate, br"
+    except ImportError:
+        ACCEPT_ENCODING = "gzip, deflate"
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def make_session(concurrency=4, retries=5, backoff=1.0):
+    '''
+    Build a requests.Session with keep-alive connections pooled for every
+    fetch thread, and exponential backoff on throttling and server errors.
+
+    Args:
+        concurrency: number of threads that will share the session. The
+            connection pool for each host is sized to match.
+        retries: attempts made after the first before giving up on a page.
+        backoff: base of the backoff, the nth retry waits
+            `backoff * 2 ** (n - 1)` seconds unless Steam sends Retry-After.
+    '''
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=("GET", "HEAD"),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4, pool_maxsize=concurrency, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    return session
+
+
+class RateLimiter:
+    '''Token bucket shared by every fetch thread'''
+
+    def __init__(self, requestDelay=1.0, burst=1):
+        '''
+        Args:
+            requestDelay: minimum average number of seconds between requests,
+                across all threads.
+            burst: how many requests may be sent back to back after an idle
+                period. The default of 1 keeps the old one-request-per-delay
+                behaviour.
+        '''
+        self.rate = 1.0 / requestDelay if requestDelay > 0 else None
+        self.capacity = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''Block until a request may be sent.'''
+        if self.rate is None:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                waitTime = (1.0 - self._tokens) / self.rate
+            time.sleep(waitTime)
+
+
+class Fetcher:
+    '''Fetch pages from a bounded pool of threads under a global rate limit'''
+
+    def __init__(self, requestDelay=1.0, concurrency=4, cache=None,
+            timeout=(5, 30), retries=5):
+        '''
+        Args:
+            requestDelay: minimum average number of seconds between requests.
+            concurrency: maximum number of requests in flight at once.
+            cache (optional): a PageCache. Only fetches made with
+                `cached=True` read from and write to it.
+            timeout: `(connect, read)` timeout in seconds for each request.
+            retries: retries per page on connection errors, 429 and 5xx.
+        '''
+        self.concurrency = max(1, int(concurrency))
+        self.limiter = RateLimiter(requestDelay)
+        self.cache = cache
+        self.timeout = timeout
+        self.session = make_session(self.concurrency, retries)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+    def _get(self, url, headers=None):
+        self.limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            print("Giving up on " + url + ": " + str(e))
+            METRICS.incr("http_errors", error=type(e).__name__)
+            return None
+        METRICS.observe("fetch_seconds", time.perf_counter() - start)
+        METRICS.incr("http_responses", code=response.status_code)
+        METRICS.incr("fetch_bytes", len(response.content))
+        return response
+
+    def fetch(self, url, cached=False, revalidate=False):
+        '''
+        Fetch a single page and return its body as text, or None if it could
+        not be fetched after retrying.
+
+        With `revalidate`, a cached page is checked with a conditional request
+        even while it is within the cache's TTL.
+        '''
+        if not cached or self.cache is None:
+            response = self._get(url)
+            if response is None or response.status_code != 200:
+                return None
+            return response.text
+
+        entry = self.cache.get(url)
+        headers = {}
+        if entry is not None:
+            text, etag, lastModified, fresh = entry
+            if fresh and not revalidate:
+                METRICS.incr("cache", result="hit")
+                return text
+            if etag:
+                headers["If-None-Match"] = etag
+            if lastModified:
+                headers["If-Modified-Since"] = lastModified
+
+        response = self._get(url, headers)
+        if response is None:
+            return None
+        if response.status_code == 304 and entry is not None:
+            METRICS.incr("cache", result="revalidated")
+            self.cache.touch(url)
+            return entry[0]
+        METRICS.incr("cache", result="miss")
+        if response.status_code != 200:
+            return None
+        self.cache.put(url, response.text, response.headers.get("ETag"),
+                       response.headers.get("Last-Modified"))
+        return response.text
+
+    def submit(self, url, cached=False, revalidate=False):
+        '''Start fetching a page, returning a Future of its body.'''
+        return self._executor.submit(self.fetch, url, cached, revalidate)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,100 @@
+'''
+Order in which a frontier crawl expands games.
+
+A frontier crawl grows the graph outwards from the games it already knows
+instead of sampling random store pages. Candidates for expansion are games
+in the graph whose recommendations have not been harvested yet, and
+recommended appids that have not been fetched at all. Each is expanded with
+a single page fetch, best first by one of these priorities:
+
+    indegree   most recommended by the games known so far
+    reviews    most reviews; an appid not fetched yet is scored by the most
+               reviewed game recommending it
+    staleness  longest since fetched; appids not fetched yet go first
+'''
+import heapq
+
+PRIORITIES = ("indegree", "reviews", "staleness")
+
+
+def node_score(G, id, priority):
+    '''Score of a game in the graph, higher first, by one of PRIORITIES.'''
+    data = G.nodes[id]
+    if priority == "indegree":
+        return G.in_degree(id)
+    if priority == "reviews":
+        return data.get("allReviews", -1)
+    return -data.get("fetchedAt", 0)
+
+
+class Frontier:
+    '''Games waiting to be expanded, best first'''
+
+    def __init__(self, G, state, priority="indegree"):
+        '''
+        Args:
+            G: the graph being crawled.
+            state: its crawlstate.CrawlState. Games in `state.expanded` or
+                `state.invalid` are never handed out.
+            priority: one of PRIORITIES.
+        '''
+        if priority not in PRIORITIES:
+            raise ValueError("Unknown priority: " + priority + ", expected one of "
+                             + ", ".join(PRIORITIES))
+        self.G = G
+        self.state = state
+        self.priority = priority
+        # Appid not fetched yet -> games recommending it
+        self.referrers = {}
+        self._heap = []
+        for source, recs in state.pending.items():
+            for refID in recs:
+                if not G.has_node(refID) and refID not in state.invalid:
+                    self.referrers.setdefault(refID, set()).add(source)
+        for id in G:
+            self.push(id)
+        for id in state.frontier:
+            self.push(id)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def score(self, id):
+        if self.G.has_node(id):
+            return node_score(self.G, id, self.priority)
+        if self.priority == "indegree":
+            return len(self.referrers.get(id, ()))
+        if self.priority == "reviews":
+            return max((self.G.nodes[source].get("allReviews", -1)
+                        for source in self.referrers.get(id, ()) if self.G.has_node(source)),
+                       default=-1)
+        return 0
+
+    def push(self, id):
+        '''Queue a game, or requeue it after its score changed.'''
+        if id in self.state.expanded or id in self.state.invalid:
+            return
+        # Entries are never updated in place; outdated ones are skipped
+        # when they come up
+        heapq.heappush(self._heap, (-self.score(id), id))
+
+    def refer(self, source, refID):
+        '''Record that `source` recommends `refID`, which is not fetched yet.'''
+        self.referrers.setdefault(refID, set()).add(source)
+        self.push(refID)
+
+    def resolve(self, id):
+        '''Forget the referrers of an appid once it is fetched.'''
+        self.referrers.pop(id, None)
+
+    def pop(self, count):
+        '''Up to `count` distinct games to expand next, best first.'''
+        ids = []
+        while self._heap and len(ids) < count:
+            score, id = heapq.heappop(self._heap)
+            if id in ids or id in self.state.expanded or id in self.state.invalid:
+                continue
+            if -score != self.score(id):
+                continue
+            ids.append(id)
+        return ids
@@ -0,0 +1,246 @@
+'''
+Append-only log of the nodes and edges added to a graph during a crawl.
+
+Every event is written as one JSON line next to the graph file, e.g.
+`./.graphs/steam500-10-1.1.0.jsonl` for `steam500-10-1.1.0.gexf`, and the
+log is flushed after every batch. Besides nodes and edges, the log records
+for the crawl state its settings, invalid appids, crawl progress, and the
+games expanded, waiting on recommendations or found but not fetched yet.
+Compacting writes the graph and state files and removes the log. After a
+crash, loading the graph replays whatever the log holds, so only the last
+few seconds of work are lost.
+
+To compact a log left behind by a crashed run without starting a crawl:
+
+    python ./graphlog.py ./.graphs/steam500-10-1.1.0.gexf
+'''
+import json
+import os
+import shutil
+import sys
+import time
+
+import networkx as nx
+
+from crawlstate import CrawlState, state_path
+
+
+GRAPH_FORMATS = ("gexf", "graphml", "arrays")
+
+
+def graph_format(graphPath):
+    format = os.path.splitext(graphPath)[1].lstrip(".").lower()
+    if format not in GRAPH_FORMATS:
+        raise ValueError("Unsupported graph format: " + graphPath)
+    return format
+
+
+def log_path(graphPath):
+    return os.path.splitext(graphPath)[0] + ".jsonl"
+
+
+class GraphLog:
+    '''Writer for the event log of one graph file'''
+
+    def __init__(self, graphPath, base=None, settings=None, syncInterval=1.0):
+        '''
+        Start a new, empty log for `graphPath`.
+
+        Args:
+            graphPath: the graph file the log will be compacted into.
+            base (optional): path of the graph the crawl started from. It is
+                loaded before the log is replayed if `graphPath` itself has
+                not been written yet.
+            settings (optional): the crawl's settings, restored with the
+                rest of the state if the graph is only recovered from the log.
+            syncInterval: maximum seconds between fsyncs of the log.
+
+        Raises:
+            FileExistsError: if a crashed run left a log for `graphPath`.
+                It must be recovered with load_graph first, rather than
+                overwritten.
+        '''
+        self.graphPath = graphPath
+        self.path = log_path(graphPath)
+        self.syncInterval = syncInterval
+        self._file = open(self.path, "x", encoding="utf-8")
+        self._synced = time.monotonic()
+        self._write({"op": "base", "path": base, "settings": settings})
+        self.flush(sync=True)
+
+    def _write(self, event):
+        self._file.write(json.dumps(event) + "\n")
+
+    def add_node(self, node, attrs):
+        self._write({"op": "node", "node": node, "attrs": attrs})
+
+    def add_edge(self, u, v, attrs):
+        self._write({"op": "edge", "u": u, "v": v, "attrs": attrs})
+
+    def add_invalid(self, id):
+        self._write({"op": "invalid", "id": id})
+
+    def add_expanded(self, id):
+        self._write({"op": "expanded", "id": id})
+
+    def set_pending(self, id, recs):
+        '''Record the recommendations a game waits on, or None once it waits on none.'''
+        self._write({"op": "pending", "id": id, "recs": recs})
+
+    def add_frontier(self, id, name):
+        self._write({"op": "frontier", "id": id, "name": name})
+
+    def set_progress(self, sourceNodes):
+        self._write({"op": "progress", "sourceNodes": sourceNodes})
+
+    def flush(self, sync=False):
+        self._file.flush()
+        if sync or time.monotonic() - self._synced >= self.syncInterval:
+            os.fsync(self._file.fileno())
+            self._synced = time.monotonic()
+
+    def compact(self, G, state):
+        '''Write the whole graph and state and drop the events they now contain.'''
+        self.flush(sync=True)
+        write_graph(G, self.graphPath)
+        state.save(state_path(self.graphPath))
+        self._file.close()
+        os.remove(self.path)
+
+    def close(self):
+        if not self._file.closed:
+            self.flush(sync=True)
+            self._file.close()
+
+
+def read_graph(graphPath):
+    '''Read a GEXF, GraphML or arrays graph keyed by integer appid.'''
+    if graph_format(graphPath) == "arrays":
+        from graphstore import read_arrays
+        return read_arrays(graphPath).to_networkx()
+    read = nx.read_graphml if graph_format(graphPath) == "graphml" else nx.read_gexf
+    try:
+        G = read(graphPath, node_type=int)
+    except ValueError:
+        G = None
+    if G is None or any("name" not in data for _, data in G.nodes(data=True)):
+        raise ValueError(
+            graphPath + " is keyed by game name, convert it first with: "
+            "python ./migrate.py " + graphPath)
+    # Drop the bookkeeping attributes read_gexf adds, so a graph is the same
+    # whether it was just crawled or read back from disk
+    for _, data in G.nodes(data=True):
+        data.pop("label", None)
+    for _, _, data in G.edges(data=True):
+        data.pop("id", None)
+    return G
+
+
+def write_graph(G, graphPath):
+    # Written beside the target first so a crash never leaves a torn file
+    tmpPath = graphPath + ".tmp"
+    if graph_format(graphPath) == "arrays":
+        from graphstore import replace_dir, write_arrays
+        if os.path.exists(tmpPath):
+            shutil.rmtree(tmpPath)
+        write_arrays(G, tmpPath)
+        replace_dir(tmpPath, graphPath)
+        return
+    if graph_format(graphPath) == "graphml":
+        nx.write_graphml(G, tmpPath)
+    else:
+        nx.write_gexf(G, path=tmpPath)
+    os.replace(tmpPath, graphPath)
+
+
+def replay(path, G, state):
+    '''
+    Apply the events of a log to G and the crawl state.
+
+    Returns:
+        The number of events applied. A torn last line, as left by a crash
+        mid-write, is ignored.
+    '''
+    applied = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if event["op"] == "base":
+                # The settings of the crawl that wrote the log win over
+                # those of the graph it started from
+                state.settings.update(event.get("settings") or {})
+                continue
+            if event["op"] == "node":
+                G.add_node(event["node"], **event["attrs"])
+                state.seen.add(event["node"])
+                state.frontier.pop(event["node"], None)
+            elif event["op"] == "edge":
+                G.add_edge(event["u"], event["v"], **event["attrs"])
+            elif event["op"] == "invalid":
+                state.invalid.add(event["id"])
+                state.frontier.pop(event["id"], None)
+            elif event["op"] == "expanded":
+                state.expanded.add(event["id"])
+            elif event["op"] == "pending":
+                if event["recs"] is None:
+                    state.pending.pop(event["id"], None)
+                else:
+                    state.pending[event["id"]] = event["recs"]
+            elif event["op"] == "frontier":
+                state.frontier[event["id"]] = event["name"]
+            elif event["op"] == "progress":
+                state.sourceNodes = event["sourceNodes"]
+            else:
+                continue
+            applied += 1
+    return applied
+
+
+def read_base(path):
+    with open(path, encoding="utf-8") as f:
+        try:
+            event = json.loads(f.readline())
+        except json.JSONDecodeError:
+            return None
+    return event.get("path") if event.get("op") == "base" else None
+
+
+def load_graph(graphPath):
+    '''
+    Load a graph file and its crawl state, together with any log a crashed
+    run left for it. The recovered events are compacted into the graph and
+    state files straight away.
+
+    Returns:
+        A tuple `(G, state)`.
+    '''
+    logPath = log_path(graphPath)
+    if os.path.exists(graphPath):
+        G = read_graph(graphPath)
+        if os.path.exists(state_path(graphPath)):
+            state = CrawlState.load(state_path(graphPath))
+        else:
+            state = CrawlState.from_graph(G, graphPath)
+    elif os.path.exists(logPath) and read_base(logPath) is not None:
+        G, state = load_graph(read_base(logPath))
+    elif os.path.exists(logPath):
+        G, state = nx.DiGraph(), CrawlState()
+    else:
+        raise FileNotFoundError(graphPath)
+
+    if os.path.exists(logPath):
+        applied = replay(logPath, G, state)
+        print("Recovered " + str(applied) + " logged changes")
+        write_graph(G, graphPath)
+        state.save(state_path(graphPath))
+        os.remove(logPath)
+    return G, state
+
+
+if __name__ == "__main__":
+    for graphPath in sys.argv[1:]:
+        G, _ = load_graph(graphPath)
+        print("Compacted " + graphPath + " with " + str(len(G.nodes())) + " nodes")
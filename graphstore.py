@@ -0,0 +1,273 @@
+'''
+Compact columnar storage for recommendation graphs.
+
+A graph is stored as a directory, e.g. `./.graphs/steam500-10-1.1.0.arrays/`,
+of plain .npy files that are memory-mapped on load:
+
+    nodes.npy                   appids, sorted ascending (int64)
+    indptr.npy, indices.npy     out-edges in CSR form, as node positions
+    weights.npy                 edge weights, aligned with indices (float32)
+    {attr}.values.npy           a numeric node attribute
+    {attr}.codes.npy            a string node attribute, dictionary-encoded
+    {attr}.strings.npy          ...its distinct values as one UTF-8 blob
+    {attr}.offsets.npy          ...and where each one starts in the blob
+    {attr}.present.npy          which nodes have the attribute, only written
+                                for attributes some nodes lack
+    meta.json                   counts and attribute types
+
+Convert between formats, or compare how long each takes to load, with:
+
+    python ./graphstore.py convert steam500-10-1.1.0.gexf steam500-10-1.1.0.arrays
+    python ./graphstore.py bench steam500-10-1.1.0.gexf
+'''
+import json
+import os
+import shutil
+import sys
+import time
+
+import networkx as nx
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+def _column_kind(values):
+    kinds = {type(value) for value in values}
+    if kinds <= {bool}:
+        return "bool"
+    if kinds <= {int, bool}:
+        return "int"
+    if kinds <= {int, float, bool}:
+        return "float"
+    return "str"
+
+
+def _encode_strings(values):
+    index = {}
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        codes[i] = index.setdefault(value, len(index))
+    encoded = [value.encode("utf-8") for value in index]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return codes, blob, offsets
+
+
+def write_arrays(G, path):
+    '''Write a graph keyed by integer appid as a directory of arrays.'''
+    os.makedirs(path)
+    nodes = np.array(sorted(G.nodes), dtype=np.int64)
+    position = {node: i for i, node in enumerate(nodes.tolist())}
+
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    indices = []
+    weights = []
+    for i, node in enumerate(nodes.tolist()):
+        targets = sorted((position[v], data.get("weight", 1.0))
+                         for v, data in G.adj[node].items())
+        indptr[i + 1] = indptr[i] + len(targets)
+        indices.extend(t for t, _ in targets)
+        weights.extend(w for _, w in targets)
+    np.save(os.path.join(path, "nodes.npy"), nodes)
+    np.save(os.path.join(path, "indptr.npy"), indptr)
+    np.save(os.path.join(path, "indices.npy"), np.array(indices, dtype=np.int32))
+    np.save(os.path.join(path, "weights.npy"), np.array(weights, dtype=np.float32))
+
+    columns = {}
+    attrs = {}
+    for node in nodes.tolist():
+        for attr in G.nodes[node]:
+            attrs.setdefault(attr, None)
+    for attr in attrs:
+        present = np.array([attr in G.nodes[node] for node in nodes.tolist()])
+        values = [G.nodes[node][attr] for node in nodes.tolist() if attr in G.nodes[node]]
+        kind = _column_kind(values)
+        columns[attr] = kind
+        prefix = os.path.join(path, attr)
+        if not present.all():
+            np.save(prefix + ".present.npy", present)
+        if kind == "str":
+            full = [str(G.nodes[node].get(attr, "")) for node in nodes.tolist()]
+            codes, blob, offsets = _encode_strings(full)
+            np.save(prefix + ".codes.npy", codes)
+            np.save(prefix + ".strings.npy", blob)
+            np.save(prefix + ".offsets.npy", offsets)
+        else:
+            dtype = {"bool": np.bool_, "int": np.int64, "float": np.float64}[kind]
+            full = [G.nodes[node].get(attr, 0) for node in nodes.tolist()]
+            np.save(prefix + ".values.npy", np.array(full, dtype=dtype))
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "directed": G.is_directed(),
+        "nodes": len(nodes),
+        "edges": len(indices),
+        "columns": columns,
+    }
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=1)
+
+
+class GraphArrays:
+    '''A graph loaded from a directory of arrays, without building NetworkX objects'''
+
+    def __init__(self, path, mmap=True):
+        '''
+        Args:
+            path: the graph directory.
+            mmap: map the arrays into memory rather than reading them, so
+                only what is used is ever paged in.
+        '''
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != FORMAT_VERSION:
+            raise ValueError("Unsupported graph arrays version in " + path)
+        self._mode = "r" if mmap else None
+        self.nodes = self._load("nodes")
+        self.indptr = self._load("indptr")
+        self.indices = self._load("indices")
+        self.weights = self._load("weights")
+        self.columns = self.meta["columns"]
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, name + ".npy"), mmap_mode=self._mode)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def index_of(self, appid):
+        '''Position of an appid in the node arrays.'''
+        i = int(np.searchsorted(self.nodes, appid))
+        if i == len(self.nodes) or self.nodes[i] != appid:
+            raise KeyError(appid)
+        return i
+
+    def present(self, attr):
+        '''Boolean array of which nodes have `attr`.'''
+        path = os.path.join(self.path, attr + ".present.npy")
+        if os.path.exists(path):
+            return np.load(path, mmap_mode=self._mode)
+        return np.ones(len(self.nodes), dtype=bool)
+
+    def codes(self, attr):
+        '''Dictionary codes of a string attribute, and its distinct values.'''
+        codes = self._load(attr + ".codes")
+        blob = self._load(attr + ".strings").tobytes()
+        offsets = self._load(attr + ".offsets")
+        values = [blob[offsets[i]:offsets[i + 1]].decode("utf-8")
+                  for i in range(len(offsets) - 1)]
+        return codes, values
+
+    def column(self, attr):
+        '''An attribute as an array, decoded to a list for strings.'''
+        if self.columns[attr] == "str":
+            codes, values = self.codes(attr)
+            return [values[code] for code in codes.tolist()]
+        return self._load(attr + ".values")
+
+    def to_networkx(self):
+        G = nx.DiGraph() if self.meta["directed"] else nx.Graph()
+        nodes = self.nodes.tolist()
+        columns = {}
+        for attr, kind in self.columns.items():
+            values = self.column(attr)
+            columns[attr] = (values if kind == "str" else values.tolist(),
+                             self.present(attr))
+        for i, node in enumerate(nodes):
+            G.add_node(node, **{attr: values[i] for attr, (values, present)
+                                in columns.items() if present[i]})
+        sources = np.repeat(self.nodes, np.diff(self.indptr)).tolist()
+        targets = self.nodes[self.indices].tolist()
+        G.add_weighted_edges_from(zip(sources, targets, self.weights.tolist()))
+        return G
+
+
+def filter_arrays(arrays, keep, path):
+    '''
+    Write the nodes of `arrays` where `keep` is True, and the edges between
+    them, as a new graph directory. Works column by column on the arrays,
+    without building a NetworkX graph.
+    '''
+    os.makedirs(path)
+    keep = np.asarray(keep, dtype=bool)
+    newIndex = np.cumsum(keep) - 1
+    sources = np.repeat(np.arange(len(arrays.nodes)), np.diff(arrays.indptr))
+    keepEdges = keep[sources] & keep[arrays.indices]
+    indptr = np.zeros(int(keep.sum()) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(newIndex[sources[keepEdges]], minlength=len(indptr) - 1),
+              out=indptr[1:])
+    np.save(os.path.join(path, "nodes.npy"), arrays.nodes[keep])
+    np.save(os.path.join(path, "indptr.npy"), indptr)
+    np.save(os.path.join(path, "indices.npy"),
+            newIndex[arrays.indices[keepEdges]].astype(np.int32))
+    np.save(os.path.join(path, "weights.npy"), arrays.weights[keepEdges])
+    for attr, kind in arrays.columns.items():
+        present = os.path.join(arrays.path, attr + ".present.npy")
+        if os.path.exists(present):
+            np.save(os.path.join(path, attr + ".present.npy"), np.load(present)[keep])
+        if kind == "str":
+            np.save(os.path.join(path, attr + ".codes.npy"), arrays._load(attr + ".codes")[keep])
+            # The distinct values are kept whole, even ones no longer used
+            for part in ("strings", "offsets"):
+                shutil.copyfile(os.path.join(arrays.path, f"{attr}.{part}.npy"),
+                                os.path.join(path, f"{attr}.{part}.npy"))
+        else:
+            np.save(os.path.join(path, attr + ".values.npy"), arrays._load(attr + ".values")[keep])
+    meta = dict(arrays.meta, nodes=int(keep.sum()), edges=int(keepEdges.sum()))
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=1)
+
+
+def read_arrays(path, mmap=True):
+    return GraphArrays(path, mmap)
+
+
+def replace_dir(tmpPath, path):
+    # Directories cannot be swapped atomically, but the old copy is only
+    # removed once the new one is in place
+    oldPath = path + ".old"
+    if os.path.exists(path):
+        os.replace(path, oldPath)
+    os.replace(tmpPath, path)
+    if os.path.exists(oldPath):
+        shutil.rmtree(oldPath)
+
+
+def bench(graphPath):
+    from graphlog import read_graph
+
+    root = os.path.splitext(graphPath)[0]
+    arraysPath = root + ".arrays"
+    start = time.perf_counter()
+    G = read_graph(graphPath)
+    print(f"{graphPath}: {time.perf_counter() - start:.3f}s "
+          f"({len(G.nodes())} nodes, {len(G.edges())} edges)")
+    if not os.path.exists(arraysPath):
+        write_arrays(G, arraysPath)
+    del G
+    start = time.perf_counter()
+    arrays = read_arrays(arraysPath)
+    print(f"{arraysPath} (memory-mapped): {time.perf_counter() - start:.3f}s")
+    start = time.perf_counter()
+    arrays.to_networkx()
+    print(f"{arraysPath} to NetworkX: {time.perf_counter() - start:.3f}s")
+
+
+def main():
+    from graphlog import read_graph, write_graph
+
+    if len(sys.argv) == 4 and sys.argv[1] == "convert":
+        write_graph(read_graph(sys.argv[2]), sys.argv[3])
+        print("Wrote " + sys.argv[3])
+    elif len(sys.argv) == 3 and sys.argv[1] == "bench":
+        bench(sys.argv[2])
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+'''
+Compact per-step history of node states for simulations.
+
+States are small integer codes, one per node. Every step's count of each
+code is recorded as it is appended, so plots never need the states
+themselves. Full states are kept as a keyframe every `keyframeInterval`
+steps, with only the nodes that changed stored for the steps in between,
+and rebuilt on request. With `retain` set, states older than roughly that
+many steps are dropped a block at a time, while the counts are kept for
+the whole run.
+'''
+import numpy as np
+
+
+class StateHistory:
+    '''Node states at every step, stored as keyframes and deltas'''
+
+    def __init__(self, keyframeInterval=32, retain=None, dtype=np.int8):
+        '''
+        Args:
+            keyframeInterval: steps between full copies of the states.
+                Rebuilding a state replays at most this many deltas.
+            retain (optional): number of most recent steps whose states must
+                stay available. Default is to keep every step.
+            dtype: integer type of the state codes.
+        '''
+        if keyframeInterval < 1:
+            raise ValueError("keyframeInterval must be at least 1")
+        self.keyframeInterval = keyframeInterval
+        self.retain = retain
+        self.dtype = dtype
+        self._counts = []
+        # Step of each kept keyframe -> states at that step
+        self._keyframes = {}
+        # Step -> (positions that changed, their new codes)
+        self._deltas = {}
+        self._last = None
+        self.first = 0
+
+    def __len__(self):
+        return len(self._counts)
+
+    def append(self, states):
+        '''Record the states of the next step.'''
+        states = np.asarray(states, dtype=self.dtype)
+        step = len(self._counts)
+        self._counts.append(np.bincount(states))
+        if step % self.keyframeInterval == 0:
+            self._keyframes[step] = states.copy()
+            self._drop_old(step)
+        else:
+            changed = np.flatnonzero(states != self._last)
+            self._deltas[step] = (changed.astype(np.int32), states[changed])
+        self._last = states.copy()
+
+    def _drop_old(self, step):
+        if self.retain is None:
+            return
+        # A block can go once the next keyframe is itself old enough
+        while self.first + self.keyframeInterval <= step - self.retain:
+            for old in range(self.first, self.first + self.keyframeInterval):
+                self._keyframes.pop(old, None)
+                self._deltas.pop(old, None)
+            self.first += self.keyframeInterval
+
+    def _index(self, step):
+        if step < 0:
+            step += len(self._counts)
+        if not 0 <= step < len(self._counts):
+            raise IndexError('Simulation step %i out of range' % step)
+        return step
+
+    def get(self, step=-1):
+        '''
+        States at a step, rebuilt from the closest earlier keyframe.
+
+        Raises:
+            IndexError: if the step has not been reached, or its states were
+                dropped by the retention policy.
+        '''
+        step = self._index(step)
+        if step < self.first:
+            raise IndexError('Simulation step %i is no longer retained' % step)
+        if step == len(self._counts) - 1:
+            return self._last.copy()
+        base = step - step % self.keyframeInterval
+        states = self._keyframes[base].copy()
+        for delta in range(base + 1, step + 1):
+            changed, codes = self._deltas[delta]
+            states[changed] = codes
+        return states
+
+    def counts(self, step=-1, size=None):
+        '''Number of nodes with each code at a step.'''
+        counts = self._counts[self._index(step)]
+        if size is not None and len(counts) < size:
+            counts = np.pad(counts, (0, size - len(counts)))
+        return counts
+
+    def count_matrix(self, start=None, stop=None, size=None):
+        '''Counts for a range of steps, one row per step.'''
+        rows = self._counts[start:stop]
+        size = max([size or 0] + [len(row) for row in rows])
+        return np.array([np.pad(row, (0, size - len(row))) for row in rows]).reshape(-1, size)
+
+    @property
+    def nbytes(self):
+        '''Memory used by stored states, in bytes.'''
+        return (sum(k.nbytes for k in self._keyframes.values())
+                + sum(c.nbytes + v.nbytes for c, v in self._deltas.values()))
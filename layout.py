@@ -0,0 +1,80 @@
+'''
+Node positions for drawing simulations, cached on disk.
+
+Layouts are only worked out when something is drawn. They are saved to
+`./.cache/layouts/` under a hash of the graph's nodes and edges, so later
+runs on the same graph reuse them. Available methods:
+
+    spring       nx.spring_layout, force-directed, slow on large graphs
+    spectral     nx.spectral_layout, sparse eigenvectors of the Laplacian,
+                 fast even on the full Steam graph
+    forceatlas2  Barnes-Hut ForceAtlas2, from networkx 3.4+ or the fa2
+                 package, whichever is installed
+'''
+import json
+import os
+
+import networkx as nx
+import numpy as np
+
+from fastgraph import CSRGraph, graph_hash
+
+try:
+    from fa2 import ForceAtlas2
+except ImportError:
+    ForceAtlas2 = None
+
+LAYOUTS = ("spring", "spectral", "forceatlas2")
+LAYOUT_DIR = "./.cache/layouts"
+
+
+def layout_available(method):
+    '''Whether a layout can be computed with the packages installed.'''
+    if method == "forceatlas2":
+        return hasattr(nx, "forceatlas2_layout") or ForceAtlas2 is not None
+    return method in LAYOUTS
+
+
+def compute_layout(G, method="spring", seed=None):
+    '''Positions of every node, as a dict of node to (x, y) array.'''
+    if method == "spring":
+        return nx.spring_layout(G, seed=seed)
+    if method == "spectral":
+        if len(G) < 3:
+            return nx.spring_layout(G, seed=seed)
+        return nx.spectral_layout(G)
+    if method == "forceatlas2":
+        if hasattr(nx, "forceatlas2_layout"):
+            return nx.forceatlas2_layout(G, seed=seed)
+        if ForceAtlas2 is not None:
+            pos = ForceAtlas2(barnesHutOptimize=True, verbose=False).forceatlas2_networkx_layout(
+                G.to_undirected(), pos=None, iterations=100)
+            return {node: np.asarray(xy) for node, xy in pos.items()}
+        raise ValueError("The forceatlas2 layout needs networkx 3.4+ or the fa2 package")
+    raise ValueError("Unknown layout: " + method + ", expected one of " + ", ".join(LAYOUTS))
+
+
+def cached_layout(G, method="spring", layoutDir=LAYOUT_DIR, seed=None):
+    '''
+    Positions of every node, computed once per graph and method.
+
+    Args:
+        G: a networkx graph.
+        method: one of LAYOUTS.
+        layoutDir (optional): where layouts are saved, or None to not
+            cache them.
+        seed (optional): seed for the layouts that are random.
+    '''
+    if layoutDir is None:
+        return compute_layout(G, method, seed)
+    path = os.path.join(layoutDir, graph_hash(CSRGraph.from_networkx(G)) + "-" + method + ".json")
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            saved = json.load(f)
+        return {node: np.array(saved[str(node)]) for node in G.nodes}
+    pos = compute_layout(G, method, seed)
+    os.makedirs(layoutDir, exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({str(node): [float(x), float(y)] for node, (x, y) in pos.items()}, f)
+    os.replace(path + ".tmp", path)
+    return pos
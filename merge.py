@@ -0,0 +1,122 @@
+'''
+Merge graphs crawled separately, such as the shards of a sharded crawl, into
+one graph and crawl state.
+
+    python ./merge.py --queue ./.graphs/crawl.queue.sqlite
+    python ./merge.py --output steam1500-10-1.1.0.gexf steam500-10-1.1.0.gexf steam1000-10-1.1.0.gexf
+
+Games are matched by appid. Where several graphs hold the same game, the
+attributes from the most recent fetch (`fetchedAt`) win; graphs from before
+that attribute existed count as oldest. Recommendations found in any graph
+are kept, and one found in several keeps its best rank, the highest weight.
+The result does not depend on the order the graphs are given in.
+'''
+import os
+
+import networkx as nx
+
+from config import make_parser, parse_args
+from crawlstate import CrawlState, state_path
+from graphlog import load_graph, write_graph
+from workqueue import WorkQueue, shard_path
+
+
+def merge_graphs(graphs):
+    '''
+    Combine graphs and their crawl states.
+
+    Args:
+        graphs: list of `(G, state)` tuples as returned by
+            graphlog.load_graph, in a fixed order that breaks ties between
+            copies of a game fetched in the same second.
+
+    Returns:
+        A tuple `(G, state)`. Nodes and edges are added sorted by appid, so
+        the same inputs always give the same file.
+    '''
+    nodes = {}
+    fetched = {}
+    weights = {}
+    for G, _ in graphs:
+        for node, data in G.nodes(data=True):
+            fetchedAt = data.get("fetchedAt", 0)
+            if node not in nodes or fetchedAt > fetched[node]:
+                nodes[node] = data
+                fetched[node] = fetchedAt
+        for u, v, data in G.edges(data=True):
+            weight = data.get("weight", 0)
+            weights[(u, v)] = max(weight, weights.get((u, v), weight))
+
+    merged = nx.DiGraph()
+    for node in sorted(nodes):
+        merged.add_node(node, **nodes[node])
+    for (u, v) in sorted(weights):
+        merged.add_edge(u, v, weight=weights[(u, v)])
+
+    recCounts = {other.recCount for _, other in graphs if other.recCount is not None}
+    if len(recCounts) > 1:
+        print("Warning: graphs were crawled with different recommendation counts "
+              + str(sorted(recCounts)) + ", so their edge weights are not comparable")
+    state = CrawlState(settings=graphs[0][1].settings if graphs else None, seen=merged.nodes)
+    for _, other in graphs:
+        state.sourceNodes += other.sourceNodes
+        state.invalid |= other.invalid
+        state.frontier.update(other.frontier)
+        state.expanded |= other.expanded
+        for id, recs in sorted(other.pending.items()):
+            state.pending.setdefault(id, recs)
+    # A game that did make it into some graph is not invalid
+    state.invalid -= state.seen
+    state.frontier = {id: name for id, name in sorted(state.frontier.items())
+                      if not state.known(id)}
+    state.expanded &= state.seen
+    state.pending = {id: recs for id, recs in sorted(state.pending.items())
+                     if id in state.seen and not all(state.known(ref) for ref in recs)}
+    return merged, state
+
+
+def main(argv=None):
+    parser = make_parser("Merge separately crawled graphs, e.g. the shards of a sharded crawl.")
+    parser.add_argument("graphs", nargs="*", help="names of graphs in the graph directory")
+    parser.add_argument("--queue", metavar="FILE",
+                        help="work queue of a sharded crawl whose finished shards to merge")
+    parser.add_argument("--output", metavar="GRAPH",
+                        help="name of the merged graph (default the sharded crawl's)")
+    args = parse_args(parser, argv, "merge")
+
+    paths = [os.path.join(args.graph_dir, graph) for graph in args.graphs]
+    output = args.output
+    if args.queue is not None:
+        queue = WorkQueue(args.queue)
+        if not queue.settings:
+            parser.error(args.queue + " holds no sharded crawl")
+        output = output or queue.settings["graph"]
+        counts = queue.counts()
+        if counts["done"] < sum(counts.values()):
+            print(f"Warning: only {counts['done']} of {sum(counts.values())} shards are done, "
+                  "merging those")
+        paths += [shard_path(os.path.join(args.graph_dir, queue.settings["graph"]), shard)
+                  for shard in queue.done()]
+        queue.close()
+    if output is None:
+        parser.error("--output is required without --queue")
+    if not paths:
+        parser.error("no graphs to merge")
+
+    graphs = []
+    # Sorted so ties are broken the same way whatever order graphs are given in
+    for path in sorted(set(paths)):
+        G, state = load_graph(path)
+        print(f"Loaded {path} with {len(G)} nodes and {G.number_of_edges()} edges")
+        graphs.append((G, state))
+    G, state = merge_graphs(graphs)
+
+    outputPath = os.path.join(args.graph_dir, output)
+    write_graph(G, outputPath)
+    state.save(state_path(outputPath))
+    print(f"Saved {outputPath} with {len(G)} nodes and {G.number_of_edges()} edges "
+          f"from {state.sourceNodes} source nodes")
+
+
+if __name__ == "__main__":
+    main()
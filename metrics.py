@@ -0,0 +1,140 @@
+'''
+Counters and timings for the crawler.
+
+Code records into the module-level METRICS registry:
+
+    METRICS.incr("http_responses", code=200)
+    with METRICS.timer("parse_seconds", extractor="get_price"):
+        ...
+
+and the scraper can print a snapshot as a JSON line every few seconds and/or
+serve it in Prometheus text format on a local port.
+'''
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format(key, suffix="", quote='"'):
+    name, labels = key
+    if not labels:
+        return name + suffix
+    return name + suffix + "{" + ",".join(f'{k}={quote}{v}{quote}' for k, v in labels) + "}"
+
+
+class Metrics:
+    '''Thread-safe registry of counters and timers'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        # key -> [count, total seconds, max seconds]
+        self._timers = {}
+        self.started = time.time()
+
+    def incr(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            timer = self._timers.setdefault(key, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def drain(self):
+        '''Take everything recorded so far, leaving the registry empty.'''
+        with self._lock:
+            raw = (self._counters, self._timers)
+            self._counters = {}
+            self._timers = {}
+        return raw
+
+    def merge(self, raw):
+        '''Add in what another registry, e.g. a worker process's, drained.'''
+        counters, timers = raw
+        with self._lock:
+            for key, value in counters.items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, (count, total, longest) in timers.items():
+                timer = self._timers.setdefault(key, [0, 0.0, 0.0])
+                timer[0] += count
+                timer[1] += total
+                timer[2] = max(timer[2], longest)
+
+    def snapshot(self):
+        with self._lock:
+            counters = {_format(k, quote=""): v for k, v in sorted(self._counters.items())}
+            timers = {
+                _format(k, quote=""): {"count": c, "total": round(t, 6),
+                                       "mean": round(t / c, 6), "max": round(m, 6)}
+                for k, (c, t, m) in sorted(self._timers.items())}
+        return {"time": time.time(), "uptime": time.time() - self.started,
+                "counters": counters, "timers": timers}
+
+    def prometheus(self):
+        '''Everything recorded, in Prometheus text exposition format.'''
+        lines = []
+        with self._lock:
+            for key, value in sorted(self._counters.items()):
+                lines.append(f"steam_scraper_{_format(key, '_total')} {value}")
+            for key, (count, total, _) in sorted(self._timers.items()):
+                lines.append(f"steam_scraper_{_format(key, '_count')} {count}")
+                lines.append(f"steam_scraper_{_format(key, '_sum')} {total}")
+        return "\n".join(lines) + "\n"
+
+    def report_every(self, interval, stream=None):
+        '''Print a snapshot as one JSON line every `interval` seconds.'''
+        stream = stream or sys.stdout
+
+        def report():
+            while True:
+                time.sleep(interval)
+                stream.write(json.dumps(self.snapshot()) + "\n")
+                stream.flush()
+
+        threading.Thread(target=report, daemon=True).start()
+
+    def serve(self, port, host="127.0.0.1"):
+        '''Serve the metrics for Prometheus at http://host:port/metrics.'''
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+METRICS = Metrics()
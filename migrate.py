@@ -0,0 +1,93 @@
+'''
+Convert graphs written by scraper versions that keyed nodes by game name into
+graphs keyed by integer appid, with the name kept as the `name` attribute.
+
+In those files a node's GEXF id is its appid and its label is its name, except
+for nodes that only ever appeared as an edge target. Those were keyed by name
+and carry no attributes. They are matched back to an appid by name (raw or
+HTML-unescaped) where possible and dropped otherwise, together with their
+edges.
+
+    python ./migrate.py ./.graphs/steam500-10-1.1.0.gexf [...]
+
+writes `./.graphs/steam500-10-1.1.0-appid.gexf` and a crawl state file for it.
+'''
+import html
+import os
+import sys
+
+import networkx as nx
+
+from crawlstate import CrawlState, state_path
+from graphlog import write_graph
+
+
+def migrate(old):
+    '''
+    Re-key a name-keyed graph by appid.
+
+    Returns:
+        A tuple `(G, dropped)` of the new graph and the number of nodes that
+        could not be matched to an appid.
+    '''
+    G = nx.DiGraph()
+    byName = {}
+    for node, data in old.nodes(data=True):
+        data = dict(data)
+        if "id" in data:
+            # Graph still in memory rather than read back from GEXF
+            id = int(data.pop("id"))
+            name = node
+        elif str(node).isnumeric():
+            id = int(node)
+            name = data.pop("label", str(node))
+        else:
+            continue
+        data.pop("label", None)
+        data["name"] = html.unescape(name)
+        G.add_node(id, **data)
+        byName.setdefault(name, id)
+        byName.setdefault(html.unescape(name), id)
+
+    mapping = {}
+    dropped = 0
+    for node in old.nodes:
+        id = None
+        if str(node).isnumeric() and G.has_node(int(node)):
+            id = int(node)
+        elif node in byName:
+            id = byName[node]
+        elif html.unescape(node) in byName:
+            id = byName[html.unescape(node)]
+        if id is None:
+            dropped += 1
+        else:
+            mapping[node] = id
+
+    for u, v, data in old.edges(data=True):
+        if u in mapping and v in mapping and mapping[u] != mapping[v]:
+            G.add_edge(mapping[u], mapping[v], **data)
+    return G, dropped
+
+
+def main():
+    for oldPath in sys.argv[1:]:
+        root, ext = os.path.splitext(oldPath)
+        newPath = root + "-appid" + ext
+        print("Loading " + oldPath + "...")
+        old = nx.read_gexf(oldPath)
+        G, dropped = migrate(old)
+        print("Kept " + str(len(G.nodes())) + " of " + str(len(old.nodes())) + " nodes, "
+              + str(dropped) + " could not be matched to an appid")
+        write_graph(G, newPath)
+        if os.path.exists(state_path(oldPath)):
+            state = CrawlState.load(state_path(oldPath))
+        else:
+            state = CrawlState.from_graph(G, oldPath)
+        state.seen = set(G.nodes)
+        state.save(state_path(newPath))
+        print("Saved " + newPath)
+
+
+if __name__ == "__main__":
+    main()
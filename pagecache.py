@@ -0,0 +1,131 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+DAY = 24 * 60 * 60
+
+
+def cache_key(url):
+    # http and https copies of a page are the same page
+    return re.sub("^https?://", "", url)
+
+
+class PageCache:
+    '''Persistent store of fetched pages, keyed by URL'''
+
+    def __init__(self, path="./.cache/pages.sqlite", ttl=7 * DAY,
+            maxAge=30 * DAY, maxBytes=2 * 1024 ** 3):
+        '''
+        Args:
+            path: SQLite file holding the cache. Created if missing.
+            ttl: seconds a page is served without asking Steam. Older pages
+                are revalidated with a conditional request.
+            maxAge: seconds after which a page that has not been revalidated
+                is dropped altogether.
+            maxBytes: upper bound on the compressed size of all stored pages.
+                The least recently used pages are evicted first.
+        '''
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl = ttl
+        self.maxAge = maxAge
+        self.maxBytes = maxBytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "key TEXT PRIMARY KEY, body BLOB, etag TEXT, lastModified TEXT, "
+            "fetchedAt REAL, accessedAt REAL, size INTEGER)")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS pagesAccessed ON pages (accessedAt)")
+        self._db.commit()
+        self.purge()
+        self._size = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    def get(self, url):
+        '''
+        Look up a page.
+
+        Returns:
+            None if the page is not cached, otherwise a tuple of
+            `(text, etag, lastModified, fresh)` where `fresh` is False once
+            the page is older than the TTL and should be revalidated.
+        '''
+        key = cache_key(url)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT body, etag, lastModified, fetchedAt FROM pages WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE pages SET accessedAt = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        body, etag, lastModified, fetchedAt = row
+        fresh = time.time() - fetchedAt < self.ttl
+        return zlib.decompress(body).decode("utf-8"), etag, lastModified, fresh
+
+    def fresh(self, url):
+        '''
+        Whether a page is cached and younger than the TTL, without reading
+        its body or counting as an access.
+        '''
+        with self._lock:
+            row = self._db.execute(
+                "SELECT fetchedAt FROM pages WHERE key = ?", (cache_key(url),)).fetchone()
+        return row is not None and time.time() - row[0] < self.ttl
+
+    def put(self, url, text, etag=None, lastModified=None):
+        body = zlib.compress(text.encode("utf-8"))
+        now = time.time()
+        key = cache_key(url)
+        with self._lock:
+            old = self._db.execute(
+                "SELECT size FROM pages WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, body, etag, lastModified, now, now, len(body)))
+            self._size += len(body) - (old[0] if old else 0)
+            if self._size > self.maxBytes:
+                self._evict()
+            self._db.commit()
+
+    def touch(self, url):
+        '''Mark a page as revalidated, e.g. after a 304 Not Modified.'''
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE pages SET fetchedAt = ?, accessedAt = ? WHERE key = ?",
+                (now, now, cache_key(url)))
+            self._db.commit()
+
+    def purge(self):
+        '''Drop every page that has not been revalidated within maxAge.'''
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM pages WHERE fetchedAt < ?", (time.time() - self.maxAge,))
+            self._db.commit()
+
+    def _evict(self):
+        # Called with the lock held. Frees roughly a tenth of the budget at a
+        # time so a full cache is not trimmed on every single insert.
+        target = self.maxBytes * 0.9
+        rows = self._db.execute(
+            "SELECT key, size FROM pages ORDER BY accessedAt").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._db.executemany("DELETE FROM pages WHERE key = ?", evicted)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
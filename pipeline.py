@@ -0,0 +1,101 @@
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from metrics import METRICS
+
+# Result for a page that could not be fetched, as opposed to a page that was
+# fetched but parsed to None
+FAILED = object()
+
+
+def _timed_parse(parse, text):
+    with METRICS.timer("parse_seconds"):
+        return parse(text)
+
+
+def _start_worker():
+    # A worker forked from the parent would start with a copy of its metrics
+    METRICS.drain()
+
+
+def _parse_in_worker(parse, text):
+    # Metrics recorded in a worker process are shipped back with the result
+    result = _timed_parse(parse, text)
+    return result, METRICS.drain()
+
+
+class ParsePipeline:
+    '''Fetch pages on the Fetcher's threads and parse them in worker processes'''
+
+    def __init__(self, fetcher, workers=0):
+        '''
+        Args:
+            fetcher: the Fetcher pages are downloaded with.
+            workers: number of parser processes. With 0, pages are parsed on
+                the fetch threads instead.
+        '''
+        self.fetcher = fetcher
+        self.workers = workers
+        self._pool = None
+        if workers > 0:
+            # Workers are started on the first page parsed, from a fetch
+            # thread's callback. Forking there could copy a lock another
+            # fetch thread holds, e.g. METRICS', into the worker, where
+            # nothing would ever release it.
+            context = None
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+            self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                             initializer=_start_worker)
+
+    def _chain(self, fetched, parse, result):
+        try:
+            text = fetched.result()
+            if text is None:
+                result.set_result(FAILED)
+            elif self._pool is None:
+                result.set_result(_timed_parse(parse, text))
+            else:
+                parsed = self._pool.submit(_parse_in_worker, parse, text)
+                parsed.add_done_callback(lambda f: self._copy(f, result))
+        except BaseException as e:
+            result.set_exception(e)
+
+    def _copy(self, parsed, result):
+        if parsed.cancelled():
+            result.cancel()
+        elif parsed.exception() is not None:
+            result.set_exception(parsed.exception())
+        else:
+            value, metrics = parsed.result()
+            METRICS.merge(metrics)
+            result.set_result(value)
+
+    def submit(self, parse, url, cached=False, revalidate=False):
+        '''
+        Fetch a page and parse it with `parse(text)`, which must be a module
+        level function so it can be sent to the worker processes.
+
+        Returns:
+            A Future of the parsed value, or of FAILED if the page could not
+            be fetched.
+        '''
+        result = Future()
+        fetched = self.fetcher.submit(url, cached, revalidate)
+        fetched.add_done_callback(lambda f: self._chain(f, parse, result))
+        return result
+
+    def map(self, parse, urls, cached=False, revalidate=False):
+        '''Fetch and parse every url, returning results in the same order.'''
+        futures = [self.submit(parse, url, cached, revalidate) for url in urls]
+        return [future.result() for future in futures]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
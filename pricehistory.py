@@ -0,0 +1,67 @@
+'''
+Price and review count history of the games in a graph, kept beside the
+graph file, e.g. `./.graphs/steam500-10-1.1.0.history.sqlite`.
+
+A row is only written when one of the tracked values of a game differs from
+its last row, so games that never change cost one row each. To read a
+game's history:
+
+    sqlite3 ./.graphs/steam500-10-1.1.0.history.sqlite \
+        "SELECT datetime(at, 'unixepoch'), price, discount, allReviews FROM history WHERE appid = 620"
+'''
+import os
+import sqlite3
+
+FIELDS = ("price", "discount", "recentReviews", "allReviews")
+
+
+def history_path(graphPath):
+    return os.path.splitext(graphPath)[0] + ".history.sqlite"
+
+
+class PriceHistory:
+    '''Changes in each game's price, discount and review counts over time'''
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        # Keyed by game then time, which is also the only order rows are read in
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            "appid INTEGER, at INTEGER, price REAL, discount INTEGER, "
+            "recentReviews INTEGER, allReviews INTEGER, "
+            "PRIMARY KEY (appid, at)) WITHOUT ROWID")
+        self._db.commit()
+
+    def last(self, appid):
+        '''The latest recorded values of a game, or None.'''
+        row = self._db.execute(
+            "SELECT " + ", ".join(FIELDS) + " FROM history WHERE appid = ? "
+            "ORDER BY at DESC LIMIT 1", (appid,)).fetchone()
+        return None if row is None else dict(zip(FIELDS, row))
+
+    def record(self, appid, attrs, at):
+        '''
+        Record the values in `attrs` as of `at`, if they changed.
+
+        Returns:
+            True if a row was written.
+        '''
+        values = {field: attrs.get(field) for field in FIELDS}
+        if self.last(appid) == values:
+            return False
+        self._db.execute("INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?, ?, ?)",
+                         (appid, int(at)) + tuple(values[field] for field in FIELDS))
+        return True
+
+    def rows(self, appid):
+        '''Every recorded change of a game, oldest first, as `(at, values)`.'''
+        return [(row[0], dict(zip(FIELDS, row[1:]))) for row in self._db.execute(
+            "SELECT at, " + ", ".join(FIELDS) + " FROM history WHERE appid = ? ORDER BY at",
+            (appid,))]
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
@@ -0,0 +1,99 @@
+'''
+Per-game analysis results, written as CSV or JSON lines keyed by appid.
+
+By default every metric becomes a column of one `{graph}.nodes.csv` table,
+written row by row once all metrics are done. With `eager=True` each metric
+is instead written to its own `{graph}.{metric}.csv` as soon as it is added,
+so results are usable while slower metrics are still running.
+'''
+import csv
+import json
+import os
+
+import numpy as np
+
+RESULT_FORMATS = ("csv", "jsonl")
+
+
+def _write_rows(path, format, header, rows):
+    with open(path + ".tmp", "w", encoding="utf-8", newline="") as f:
+        if format == "csv":
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                f.write(json.dumps(dict(zip(header, row))) + "\n")
+    # Only complete files ever carry the final name
+    os.replace(path + ".tmp", path)
+
+
+class ResultWriter:
+    '''Collects per-node metrics and writes them out keyed by appid'''
+
+    def __init__(self, basePath, nodes, names=None, format="csv", eager=False):
+        '''
+        Args:
+            basePath: path results are written next to, e.g.
+                ./.analysis/steam500-10-1.1.0.gexf
+            nodes: appid of each node, in the order of the metric arrays.
+            names (optional): game name of each node, written alongside.
+            format: "csv" or "jsonl".
+            eager: write each metric to its own file as soon as it is added.
+        '''
+        if format not in RESULT_FORMATS:
+            raise ValueError("Unknown result format: " + format)
+        self.basePath = basePath
+        self.nodes = nodes
+        self.names = names
+        self.format = format
+        self.eager = eager
+        self.metrics = {}
+        self.paths = []
+
+    def _keys(self):
+        if self.names is None:
+            return ["appid"], [[node] for node in self.nodes]
+        return ["appid", "name"], [[node, name] for node, name in zip(self.nodes, self.names)]
+
+    def _write(self, suffix, metrics):
+        path = f"{self.basePath}.{suffix}.{self.format}"
+        header, keys = self._keys()
+        # Missing values, e.g. for games a sampled metric skipped, are NaN
+        columns = [[None if value != value else value for value in np.asarray(values).tolist()]
+                   for values in metrics.values()]
+        rows = (key + [column[i] for column in columns] for i, key in enumerate(keys))
+        _write_rows(path, self.format, header + list(metrics), rows)
+        self.paths.append(path)
+        return path
+
+    def add(self, metric, values):
+        '''Add one value per node for a metric.'''
+        self.metrics[metric] = values
+        if self.eager:
+            return self._write(metric, {metric: values})
+
+    def close(self):
+        '''Write the combined table, unless each metric was already written.'''
+        if not self.eager and self.metrics:
+            return self._write("nodes", self.metrics)
+
+
+def top(values, k=10):
+    '''Positions and values of the `k` largest values, largest first.'''
+    values = np.asarray(values, dtype=np.float64)
+    known = np.flatnonzero(~np.isnan(values))
+    k = min(k, len(known))
+    if k == 0:
+        return []
+    best = known[np.argpartition(-values[known], k - 1)[:k]]
+    best = best[np.argsort(-values[best], kind="stable")]
+    return [(int(i), values[i].item()) for i in best]
+
+
+def print_top(label, nodes, values, names=None, k=10):
+    best = top(values, k)
+    print("Top " + str(len(best)) + " by " + label + ":")
+    for rank, (i, value) in enumerate(best, 1):
+        name = names[i] + " " if names is not None else ""
+        print(f"  {rank:>3}. {name}({nodes[i]}) {value:.6g}")
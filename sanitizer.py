@@ -1,28 +1,332 @@
-import json
+'''
+Removes unwanted nodes, and their edges, from a recommendation graph.
+
+GEXF graphs are filtered in a single streaming pass: node and edge records
+are read one at a time and written straight back out if kept, so memory use
+does not grow with the size of the graph. Graphs in the arrays format are
+filtered column by column. GraphML graphs are loaded whole.
+
+Filters are chosen with `--filter`, e.g. `--filter numeric,dlc,zero-year`.
+Each one is a pair of functions in FILTERS, one deciding on a single node
+from its id and attributes, the other on a whole graphstore.GraphArrays at
+once; adding an entry there makes a new filter available.
+'''
+import os
+import re
+import shutil
+import time
+
 import networkx as nx
-                
-def main():
+import numpy as np
+
+from config import ask, make_parser, parse_args
+from graphlog import graph_format, write_graph
+
+try:
+    from lxml import etree
+except ImportError:
+    # Without lxml GEXF graphs are loaded whole like GraphML
+    etree = None
+
+BUNDLE = re.compile(r"\bbundle\b", re.IGNORECASE)
+
+
+def not_appid(node, attrs):
+    # Name-keyed nodes, which in old graphs are DLC and bundles
+    return not str(node).isnumeric()
+
+
+def not_appid_column(arrays):
+    # Array graphs are always keyed by appid
+    return np.zeros(len(arrays), dtype=bool)
+
+
+def is_dlc(node, attrs):
+    # DLC is never parsed from its store page, so has no release year
+    return str(attrs.get("dlc", "")).lower() == "true" or "year" not in attrs
+
+
+def is_dlc_column(arrays):
+    if "year" not in arrays.columns:
+        return np.ones(len(arrays), dtype=bool)
+    return ~arrays.present("year")
+
+
+def negative_price(node, attrs):
+    return "price" in attrs and float(attrs["price"]) < 0
+
+
+def negative_price_column(arrays):
+    if "price" not in arrays.columns:
+        return np.zeros(len(arrays), dtype=bool)
+    return arrays.present("price") & (arrays.column("price") < 0)
+
+
+def zero_year(node, attrs):
+    return "year" in attrs and int(attrs["year"]) == 0
+
+
+def zero_year_column(arrays):
+    if "year" not in arrays.columns:
+        return np.zeros(len(arrays), dtype=bool)
+    return arrays.present("year") & (arrays.column("year") == 0)
+
+
+def is_bundle(node, attrs):
+    return BUNDLE.search(str(attrs.get("name", node))) is not None
+
+
+def is_bundle_column(arrays):
+    if "name" not in arrays.columns:
+        return np.zeros(len(arrays), dtype=bool)
+    codes, values = arrays.codes("name")
+    # Each distinct name is only matched once
+    bundles = np.array([BUNDLE.search(value) is not None for value in values] + [False])
+    return bundles[codes]
+
+
+FILTERS = {
+    "numeric": (not_appid, not_appid_column),
+    "dlc": (is_dlc, is_dlc_column),
+    "negative-price": (negative_price, negative_price_column),
+    "zero-year": (zero_year, zero_year_column),
+    "bundle": (is_bundle, is_bundle_column),
+}
+
+
+class Throughput:
+    '''Counts records and bytes, printing the rate every few seconds'''
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.lastReport = self.started
+        self.bytes = 0
+        self.nodes = 0
+        self.kept = 0
+        self.edges = 0
+        self.keptEdges = 0
+
+    def line(self):
+        seconds = max(time.perf_counter() - self.started, 1e-9)
+        return (f"{self.bytes / 1e6:.1f} MB, {self.nodes} nodes ({self.kept} kept), "
+                f"{self.edges} edges ({self.keptEdges} kept) in {seconds:.1f}s: "
+                f"{self.bytes / 1e6 / seconds:.1f} MB/s, {self.nodes / seconds:.0f} nodes/s")
+
+    def tick(self, position=None):
+        if position is not None:
+            self.bytes = position
+        now = time.perf_counter()
+        if now - self.lastReport >= self.interval:
+            self.lastReport = now
+            print(self.line())
+
+
+def _local(element):
+    tag = element.tag
+    return tag[tag.rfind("}") + 1:]
+
+
+def _start_tag(element, declareNamespaces=False):
+    parts = [_local(element)]
+    if declareNamespaces:
+        for prefix, uri in element.nsmap.items():
+            parts.append(("xmlns:" + prefix if prefix else "xmlns") + "=" + _quote(uri))
+    prefixes = {uri: prefix for prefix, uri in element.nsmap.items() if prefix}
+    for key, value in element.attrib.items():
+        name = etree.QName(key)
+        key = prefixes[name.namespace] + ":" + name.localname if name.namespace else name.localname
+        parts.append(key + "=" + _quote(value))
+    return "<" + " ".join(parts) + ">"
+
+
+def _quote(value):
+    return '"' + (value.replace("&", "&amp;").replace("<", "&lt;")
+                  .replace('"', "&quot;")) + '"'
+
+
+NAMESPACE_DECLARATIONS = re.compile(rb'( xmlns(?::\w+)?="[^"]*")+')
+
+
+class _Records:
+    '''Serializes records without the namespace declarations lxml repeats on each'''
+
+    def __init__(self):
+        self.declarations = None
+
+    def __call__(self, element):
+        data = etree.tostring(element, encoding="utf-8")
+        if self.declarations is None:
+            # Records inherit the root's namespaces, and lxml writes them the
+            # same way every time
+            found = NAMESPACE_DECLARATIONS.search(data[:data.index(b">")])
+            self.declarations = found.group(0) if found else b""
+        return data.replace(self.declarations, b"", 1) if self.declarations else data
+
+
+def _typed(value, kind):
+    if kind in ("double", "float"):
+        return float(value)
+    if kind in ("long", "integer"):
+        return int(value)
+    if kind == "boolean":
+        return value == "true"
+    return value
+
+
+CONTAINERS = ("gexf", "graph", "nodes", "edges")
+RECORDS = ("meta", "attributes", "node", "edge")
+
+
+def sanitize_gexf(inPath, outPath, predicates, throughput=None):
+    '''
+    Copy a GEXF graph, leaving out nodes any predicate matches and every
+    edge touching them, in one pass over the file.
+
+    Args:
+        predicates: functions with signature `predicate(node, attrs)`,
+            taking a node id and a dict of its attributes, that return True
+            for nodes to remove.
+        throughput (optional): a Throughput to count records into.
+    '''
+    throughput = throughput or Throughput()
+    attributeTypes = {}
+    removed = set()
+    record = _Records()
+    with open(inPath, "rb") as source, open(outPath, "wb") as out:
+        out.write(b"<?xml version='1.0' encoding='utf-8'?>\n")
+        # Skipping events for the elements inside records saves most of the
+        # time spent in Python
+        tags = ["{*}" + name for name in CONTAINERS + RECORDS]
+        for event, element in etree.iterparse(source, events=("start", "end"), tag=tags):
+            name = _local(element)
+            if name in CONTAINERS:
+                if event == "start":
+                    out.write(_start_tag(element, name == "gexf").encode("utf-8"))
+                else:
+                    out.write(("</" + name + ">").encode("utf-8"))
+                continue
+            if event != "end":
+                continue
+            keep = True
+            if name == "attributes" and element.get("class") == "node":
+                for attribute in element:
+                    attributeTypes[attribute.get("id")] = (attribute.get("title"),
+                                                           attribute.get("type"))
+            elif name == "node":
+                throughput.nodes += 1
+                attrs = {}
+                for values in element:
+                    for value in values:
+                        title, kind = attributeTypes.get(value.get("for"), (value.get("for"), None))
+                        attrs[title] = _typed(value.get("value"), kind)
+                node = element.get("id")
+                if any(predicate(node, attrs) for predicate in predicates):
+                    removed.add(node)
+                    keep = False
+                else:
+                    throughput.kept += 1
+            elif name == "edge":
+                throughput.edges += 1
+                keep = element.get("source") not in removed and element.get("target") not in removed
+                throughput.keptEdges += keep
+            if keep:
+                out.write(record(element))
+            # Forget the record and any already written before it
+            element.clear()
+            parent = element.getparent()
+            while element.getprevious() is not None:
+                del parent[0]
+            if (throughput.nodes + throughput.edges) % 10000 == 0:
+                throughput.tick(source.tell())
+        throughput.bytes = source.tell()
+
+
+def sanitize_arrays(inPath, outPath, columnFilters, throughput=None):
+    '''Copy an arrays graph, leaving out nodes any column filter matches.'''
+    from graphstore import filter_arrays, read_arrays
+
+    throughput = throughput or Throughput()
+    arrays = read_arrays(inPath)
+    remove = np.zeros(len(arrays), dtype=bool)
+    for columnFilter in columnFilters:
+        remove |= columnFilter(arrays)
+    filter_arrays(arrays, ~remove, outPath)
+    throughput.nodes = len(arrays)
+    throughput.kept = int((~remove).sum())
+    throughput.edges = len(arrays.indices)
+    throughput.keptEdges = read_arrays(outPath).meta["edges"]
+    throughput.bytes = sum(os.path.getsize(os.path.join(inPath, f)) for f in os.listdir(inPath))
+
+
+def sanitize_graph(G, predicates, throughput=None):
+    '''Remove the nodes any predicate matches from a loaded graph.'''
+    throughput = throughput or Throughput()
+    throughput.nodes = len(G)
+    throughput.edges = G.number_of_edges()
+    G.remove_nodes_from([node for node, attrs in G.nodes(data=True)
+                         if any(predicate(node, attrs) for predicate in predicates)])
+    throughput.kept = len(G)
+    throughput.keptEdges = G.number_of_edges()
+    return G
+
+
+def main(argv=None):
     VERSION = "0.0.1"
-    G = nx.DiGraph()
+
+    parser = make_parser("Remove DLC and bundle nodes from a recommendation graph.")
+    parser.add_argument("--graph", help="name of the graph in the graph directory")
+    parser.add_argument("--output", help="name of the sanitized graph "
+                                         "(default {graph}-sanitized)")
+    parser.add_argument("--filter", default=None,
+                        help="comma-separated filters to apply, from: " + ", ".join(FILTERS)
+                             + " (default numeric)")
+    args = parse_args(parser, argv, "sanitizer")
+    filters = (args.filter or "numeric").split(",")
+    for name in filters:
+        if name not in FILTERS:
+            parser.error("unknown filter '" + name + "', expected one of " + ", ".join(FILTERS))
 
     print("Welcome to Steam Recommendation Graph Sanitizer v" + VERSION)
     print("Let remove most of those pesky DLCs and bundles from your graph!")
 
-    oldGraphName = input("Graph name? ")
-    G = nx.read_gexf(f"./.graphs/{oldGraphName}")
-    print("Loading graph...")
-    print("Loaded graph with " + str(len(G.nodes())) + " nodes")
-    nodeCount = int(oldGraphName.split("-")[0].replace("steam", ""))
-    recCount = int(oldGraphName.split("-")[1])
-    
-    nodes = list(G.nodes()).copy()
-
-    for node in nodes:
-        if not node.isnumeric():
-            G.remove_node(node)
-            
-    print("Saving graph...")
-    nx.write_gexf(G, f"./.graphs/{oldGraphName[:-5]}-sanitized.gexf")
-    
+    oldGraphName = ask(args, "graph", "Graph name? ")
+    oldGraphPath = os.path.join(args.graph_dir, oldGraphName)
+    root, ext = os.path.splitext(oldGraphName)
+    newGraphName = args.output or f"{root}-sanitized{ext}"
+    newGraphPath = os.path.join(args.graph_dir, newGraphName)
+    format = graph_format(oldGraphPath)
+    if graph_format(newGraphPath) != format:
+        parser.error("the sanitized graph must be in the same format, " + format)
+
+    throughput = Throughput()
+    tmpPath = newGraphPath + ".tmp"
+    print("Filtering graph...")
+    if format == "arrays":
+        from graphstore import replace_dir
+
+        if os.path.exists(tmpPath):
+            shutil.rmtree(tmpPath)
+        sanitize_arrays(oldGraphPath, tmpPath, [FILTERS[name][1] for name in filters], throughput)
+        replace_dir(tmpPath, newGraphPath)
+    elif format == "gexf" and etree is not None:
+        sanitize_gexf(oldGraphPath, tmpPath, [FILTERS[name][0] for name in filters], throughput)
+        os.replace(tmpPath, newGraphPath)
+    else:
+        # Read with string ids so graphs from before nodes were keyed by
+        # appid, which are the ones holding name-keyed DLC nodes, can be
+        # cleaned too
+        if format == "graphml":
+            G = nx.read_graphml(oldGraphPath)
+        else:
+            G = nx.read_gexf(oldGraphPath)
+        throughput.bytes = os.path.getsize(oldGraphPath)
+        sanitize_graph(G, [FILTERS[name][0] for name in filters], throughput)
+        print("Saving graph...")
+        write_graph(G, newGraphPath)
+    print(throughput.line())
+    print("Saved " + newGraphPath)
+
+
 if __name__ == "__main__":
     main()
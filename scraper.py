@@ -1,20 +1,36 @@
-import requests
 import json
 import re
 import networkx as nx
 from bs4 import BeautifulSoup
 import time
 import html
-lastRequestTime = 0.0
-
-def request_page(url, requestDelay=1.0):
-  global lastRequestTime
-  waitTime = requestDelay - (time.time() - lastRequestTime)
-  if waitTime > 0:
-    print("Waiting " + str(waitTime) + " seconds...")
-    time.sleep(waitTime)
-  lastRequestTime = time.time()
-  return requests.get(url)
+import os
+import shutil
+from fetcher import Fetcher
+from metrics import METRICS
+from config import ask, make_parser, parse_args
+from crawlstate import CrawlState
+from graphlog import GRAPH_FORMATS, GraphLog, load_graph, log_path
+from enrichment import API_URL, Enricher, harvest_recommendations
+from frontier import PRIORITIES, Frontier, node_score
+from pagecache import DAY, PageCache
+from pipeline import FAILED, ParsePipeline
+from pricehistory import PriceHistory, history_path
+from workqueue import LEASE, LeaseLost, WorkQueue, default_worker, shard_path
+
+try:
+    import extractor
+except ImportError:
+    # lxml is optional, html.parser is used without it
+    extractor = None
+
+STORE_URL = "https://store.steampowered.com"
+CRAWL_MODES = ("random", "frontier", "refresh")
+ENRICH_MODES = ("page", "batch")
+
+
+def app_url(id, storeUrl=STORE_URL):
+    return storeUrl + "/app/" + str(id)
 
 
 def get_price(soup):
@@ -111,7 +127,7 @@ def get_genres_and_developer(soup):
                 if i < len(genreTags):
                     genres[i] = genreTags[i].text.strip()
         developerData = allData.find_all("div", class_="dev_row")
-        if developerData is not None:
+        if len(developerData) > 0:
             developer = developerData[0].find("a").text.strip()
             if len(developerData) > 1:
                 publisher = developerData[1].find("a").text.strip()
@@ -128,148 +144,624 @@ def is_dlc(soup):
     return dlc
 
 
-def add_node(G, id, name, requestDelay=1.0, soup=None):
-    # print("Name: " + name)
-    if soup is None:
-        page = request_page("http://store.steampowered.com/app/" + str(id), requestDelay)
-        soup = BeautifulSoup(page.text, 'html.parser')
-    if is_dlc(soup):
-        return "invalid"
-    price, discount = get_price(soup)
-    tags = get_tags(soup)
-    releaseDate, year = get_release_data(soup)
-    recentRating, recentReviews, allRating, allReviews, recentRatio = get_review_data(
-        soup)
-    genres, developer, publisher, franchise = get_genres_and_developer(soup)
+def parse_app(soup):
+    with METRICS.timer("extract_seconds", extractor="is_dlc"):
+        dlc = is_dlc(soup)
+    if dlc:
+        METRICS.incr("rejected", reason="dlc")
+        return None
+    with METRICS.timer("extract_seconds", extractor="get_price"):
+        price, discount = get_price(soup)
+    with METRICS.timer("extract_seconds", extractor="get_tags"):
+        tags = get_tags(soup)
+    with METRICS.timer("extract_seconds", extractor="get_release_data"):
+        releaseDate, year = get_release_data(soup)
+    with METRICS.timer("extract_seconds", extractor="get_review_data"):
+        recentRating, recentReviews, allRating, allReviews, recentRatio = get_review_data(
+            soup)
+    with METRICS.timer("extract_seconds", extractor="get_genres_and_developer"):
+        genres, developer, publisher, franchise = get_genres_and_developer(soup)
 
     if year == 0:
+        METRICS.incr("rejected", reason="year")
+        return None
+
+    return {
+        "price": price,
+        "discount": discount,
+        "releaseDate": releaseDate,
+        "year": year,
+        "tag1": tags[0],
+        "tag2": tags[1],
+        "tag3": tags[2],
+        "recentRating": recentRating,
+        "recentReviews": recentReviews,
+        "allRating": allRating,
+        "allReviews": allReviews,
+        "recentRatio": recentRatio,
+        "genre1": genres[0],
+        "genre2": genres[1],
+        "genre3": genres[2],
+        "developer": developer,
+        "publisher": publisher,
+        "franchise": franchise
+    }
+
+
+def parse_app_page(text):
+    if extractor is not None:
+        return extractor.extract_app(extractor.parse(text))
+    return parse_app(BeautifulSoup(text, 'html.parser'))
+
+
+def get_rg_apps(text):
+    recommendations = re.search("{\"rgApps\".*", text)
+    if recommendations is None:
+        return {}
+    recString = recommendations.group(0)
+    recString = recString.replace(");", "")
+    return json.loads(recString)['rgApps']
+
+
+def get_recommendations(text):
+    recsDict = get_rg_apps(text)
+    return [(int(id), recsDict[id]['name']) for id in recsDict]
+
+
+def parse_source_page(text):
+    if extractor is not None:
+        root = extractor.parse(text)
+        identity = extractor.extract_identity(root)
+        if identity is None:
+            return None
+        name, id = identity
+        return name, int(id), extractor.extract_app(root), get_recommendations(text)
+
+    soup = BeautifulSoup(text, 'html.parser')
+    nameTag = soup.find("div", class_="apphub_AppName")
+    if nameTag is None:
+        return None
+    name = nameTag.text.strip()
+    idTag = soup.find("div", class_="glance_tags popular_tags")
+    if idTag is None:
+        return None
+    id = int(idTag['data-appid'])
+    return name, id, parse_app(soup), get_recommendations(text)
+
+
+def harvest_source_page(text):
+    '''parse_source_page, plus what the page tells about each recommendation.'''
+    source = parse_source_page(text)
+    if source is None:
+        return None
+    return source + (harvest_recommendations(get_rg_apps(text)),)
+
+
+def add_node(G, id, name, record, state, log=None):
+    # print("Name: " + name)
+    state.frontier.pop(id, None)
+    if record is None:
+        state.invalid.add(id)
+        if log is not None:
+            log.add_invalid(id)
         return "invalid"
-
-    G.add_node(
-        html.unescape(name),
-        id=id,
-        price=price,
-        discount=discount,
-        releaseDate=releaseDate,
-        year=year, tag1=tags[0],
-        tag2=tags[1],
-        tag3=tags[2],
-        recentRating=recentRating,
-        recentReviews=recentReviews,
-        allRating=allRating,
-        allReviews=allReviews,
-        recentRatio=recentRatio,
-        genre1=genres[0],
-        genre2=genres[1],
-        genre3=genres[2],
-        developer=developer,
-        publisher=publisher,
-        franchise=franchise
-    )
+    # Nodes are keyed by appid, names are neither unique nor consistently
+    # escaped across pages. fetchedAt decides which copy of a game wins when
+    # graphs crawled separately are merged.
+    with METRICS.timer("graph_insert_seconds", kind="node"):
+        G.add_node(id, name=html.unescape(name), **record, fetchedAt=int(time.time()))
+    state.seen.add(id)
+    if log is not None:
+        log.add_node(id, G.nodes[id])
     return "added"
 
 
-def main():
+def add_edge(G, id, refID, weight, log=None):
+    # print(G.nodes[id]["name"] + " -> " + G.nodes[refID]["name"])
+    with METRICS.timer("graph_insert_seconds", kind="edge"):
+        G.add_edge(id, refID, weight=weight)
+    if log is not None:
+        log.add_edge(id, refID, {"weight": weight})
+
+
+def crawl(G, nodes, pipeline, state, storeUrl=STORE_URL, checkpoint=None, log=None,
+          progress=None, enricher=None):
+    randomUrl = storeUrl + "/explore/random/"
+    recCount = state.recCount
+    parse = parse_source_page if enricher is None else harvest_source_page
+    z = 0
+    while z < nodes:
+        # Batches never straddle a multiple of 100 so checkpoints land on
+        # the same source node counts as before.
+        batch = min(pipeline.fetcher.concurrency, nodes - z, 100 - z % 100)
+        parsed = pipeline.map(parse, [randomUrl] * batch)
+
+        sources = []
+        resolved = set()
+        for source in parsed:
+            if source is FAILED or source is None:
+                continue
+            name, id, record, recs = source[:4]
+            if enricher is not None:
+                enricher.harvest(source[4])
+            if not state.known(id) and not G.has_node(id):
+                add_node(G, id, name, record, state, log)
+                resolved.add(id)
+            if G.has_node(id):
+                sources.append((id, recs[:recCount]))
+
+        # Every recommendation target in the batch is fetched at once, each
+        # appid only once even when several sources recommend it.
+        pending = {}
+        for id, recs in sources:
+            for refID, refName in recs:
+                if not state.known(refID) and not G.has_node(refID):
+                    pending.setdefault(refID, refName)
+        urls = [app_url(refID, storeUrl) for refID in pending]
+        if enricher is None:
+            records = pipeline.map(parse_app_page, urls, cached=True)
+        else:
+            records = enricher.records(list(pending), urls)
+        for (refID, refName), record in zip(pending.items(), records):
+            if record is FAILED:
+                # Not fetched, so neither added nor known to be invalid
+                state.frontier[refID] = refName
+                if log is not None:
+                    log.add_frontier(refID, refName)
+                continue
+            add_node(G, refID, refName, record, state, log)
+            resolved.add(refID)
+
+        # Games left waiting on a recommendation by an earlier failed fetch
+        for id, recs in list(state.pending.items()):
+            if resolved.intersection(recs):
+                link(G, id, recs, state, log)
+        for id, recs in sources:
+            # Recommendations that failed to fetch hold their rank, and the
+            # game waits in state.pending until they are fetched
+            link(G, id, [refID for refID, _ in recs], state, log)
+            # Only once its edges are in, so a crawl stopped before then
+            # expands it again
+            state.expanded.add(id)
+            if log is not None:
+                log.add_expanded(id)
+
+        z += batch
+        state.sourceNodes += batch
+        if log is not None:
+            log.set_progress(state.sourceNodes)
+            log.flush()
+        if checkpoint is not None and z % 100 == 0:
+            checkpoint(z)
+        if progress is not None:
+            progress(z)
+
+
+def link(G, id, recs, state, log=None):
+    '''
+    Add edges from an expanded game to its recommendations that are in the
+    graph, weighted by rank among the valid ones as in crawl. Ones not
+    fetched yet hold their rank, and the game is kept in `state.pending`
+    so its edges can be completed, and reweighted, once they are.
+    '''
+    weight = state.recCount
+    waiting = False
+    for refID in recs:
+        if refID in state.invalid:
+            continue
+        if G.has_node(refID):
+            if not G.has_edge(id, refID) or G[id][refID].get("weight") != weight:
+                add_edge(G, id, refID, weight, log)
+        else:
+            waiting = True
+        weight -= 1
+    if waiting:
+        if state.pending.get(id) != list(recs):
+            state.pending[id] = list(recs)
+            if log is not None:
+                log.set_pending(id, list(recs))
+    elif state.pending.pop(id, None) is not None and log is not None:
+        log.set_pending(id, None)
+
+
+def _relink_referrers(G, id, frontier, state, log):
+    # Games waiting on this one can now link to it, or, if it turned out
+    # invalid, rank past it
+    for referrer in frontier.referrers.get(id, ()):
+        if referrer in state.pending:
+            link(G, referrer, state.pending[referrer], state, log)
+    frontier.resolve(id)
+
+
+def crawl_frontier(G, nodes, pipeline, state, priority="indegree", storeUrl=STORE_URL,
+                   checkpoint=None, log=None, progress=None):
+    '''
+    Expand `nodes` games from the frontier, best first by `priority`.
+
+    Games are taken from those in the graph whose recommendations have not
+    been added yet and from recommendations not fetched yet, skipping any
+    already expanded or invalid before a request is made. Each expansion is
+    one fetch, of a page usually already cached for games in the graph, and
+    its recommendations join the frontier. Random games are only fetched
+    when the frontier is empty.
+    '''
+    randomUrl = storeUrl + "/explore/random/"
+    recCount = state.recCount
+    if not state.expanded:
+        # State from before expansions were recorded, when only source nodes
+        # had recommendations of their own
+        state.expanded = {id for id in G if G.out_degree(id)}
+    frontier = Frontier(G, state, priority)
+    z = 0
+    while z < nodes:
+        batch = min(pipeline.fetcher.concurrency, nodes - z, 100 - z % 100)
+        ids = frontier.pop(batch)
+        if ids:
+            parsed = pipeline.map(parse_source_page, [app_url(id, storeUrl) for id in ids],
+                                  cached=True)
+        else:
+            parsed = pipeline.map(parse_source_page, [randomUrl] * batch)
+            ids = [None if source is FAILED or source is None else source[1]
+                   for source in parsed]
+
+        for id, source in zip(ids, parsed):
+            if source is FAILED or id in state.expanded or id in state.invalid:
+                # Not fetched ones stay in the frontier for the next run
+                continue
+            if source is None:
+                if id is not None and not G.has_node(id):
+                    add_node(G, id, None, None, state, log)
+                    _relink_referrers(G, id, frontier, state, log)
+                continue
+            name, _, record, recs = source
+            if not G.has_node(id):
+                add_node(G, id, name, record, state, log)
+                _relink_referrers(G, id, frontier, state, log)
+            if not G.has_node(id):
+                continue
+            recs = recs[:recCount]
+            link(G, id, [refID for refID, _ in recs], state, log)
+            state.expanded.add(id)
+            if log is not None:
+                log.add_expanded(id)
+            for refID, refName in recs:
+                if G.has_node(refID):
+                    # Its in-degree went up
+                    frontier.push(refID)
+                elif refID not in state.invalid:
+                    if refID not in state.frontier:
+                        state.frontier[refID] = refName
+                        if log is not None:
+                            log.add_frontier(refID, refName)
+                    frontier.refer(id, refID)
+
+        z += len(ids)
+        state.sourceNodes += len(ids)
+        if log is not None:
+            log.set_progress(state.sourceNodes)
+            log.flush()
+        if checkpoint is not None and z % 100 == 0:
+            checkpoint(z)
+        if progress is not None:
+            progress(z)
+
+
+def refresh(G, nodes, pipeline, history, maxAge, priority="staleness", storeUrl=STORE_URL,
+            checkpoint=None, log=None):
+    '''
+    Fetch again up to `nodes` games last fetched more than `maxAge` seconds
+    ago, best first by `priority`, and update their attributes in place.
+    Pages still in the cache are revalidated with conditional requests.
+    Edges are left as they are.
+
+    Args:
+        history: a pricehistory.PriceHistory that changes are recorded in.
+
+    Returns:
+        A dict counting games that `changed`, were `unchanged` and `failed`
+        to fetch or are no longer valid games, which are left as they were.
+    '''
+    now = time.time()
+    stale = [id for id in G if now - G.nodes[id].get("fetchedAt", 0) >= maxAge]
+    stale.sort(key=lambda id: (-node_score(G, id, priority), id))
+    stale = stale[:nodes]
+    counts = {"changed": 0, "unchanged": 0, "failed": 0}
+    z = 0
+    while z < len(stale):
+        batch = min(pipeline.fetcher.concurrency, len(stale) - z, 100 - z % 100)
+        ids = stale[z:z + batch]
+        records = pipeline.map(parse_app_page, [app_url(id, storeUrl) for id in ids],
+                               cached=True, revalidate=True)
+        for id, record in zip(ids, records):
+            if record is FAILED or record is None:
+                counts["failed"] += 1
+                continue
+            data = G.nodes[id]
+            if history.last(id) is None:
+                # The values the game was first crawled with
+                history.record(id, data, data.get("fetchedAt", 0))
+            fetchedAt = int(time.time())
+            history.record(id, record, fetchedAt)
+            changed = any(data.get(key) != value for key, value in record.items())
+            counts["changed" if changed else "unchanged"] += 1
+            data.update(record, fetchedAt=fetchedAt)
+            if log is not None:
+                log.add_node(id, data)
+
+        z += batch
+        history.commit()
+        if log is not None:
+            log.flush()
+        if checkpoint is not None and z % 100 == 0:
+            checkpoint(z)
+    return counts
+
+
+def heartbeat(queue, shard):
+    '''Renew the lease on a shard, or raise LeaseLost if another worker holds it.'''
+    if not queue.heartbeat(shard):
+        raise LeaseLost(shard.id)
+
+
+def crawl_shards(queue, pipeline, graphPath, storeUrl=STORE_URL, worker=None, enricher=None):
+    '''
+    Claim and crawl shards of a sharded crawl until none are left.
+
+    Each shard is crawled into its own partial graph beside `graphPath`,
+    starting from an empty graph, or from what an earlier worker managed
+    before it stopped.
+
+    Args:
+        queue: a workqueue.WorkQueue.
+        graphPath: path of the merged graph the shards are named after.
+        worker (optional): name recorded with each claim.
+        enricher (optional): an enrichment.Enricher, as for crawl.
+
+    Returns:
+        The number of shards crawled.
+    '''
+    worker = worker or default_worker()
+    crawled = 0
+    while True:
+        shard = queue.claim(worker)
+        if shard is None:
+            return crawled
+        path = shard_path(graphPath, shard.id)
+        if os.path.exists(path) or os.path.exists(log_path(path)):
+            G, state = load_graph(path)
+        else:
+            G, state = nx.DiGraph(), CrawlState()
+        # Every shard is crawled with the settings of the queue
+        state.settings["recCount"] = queue.settings["recCount"]
+        remaining = shard.sources - state.sourceNodes
+        print(f"Crawling shard {shard.id} ({remaining} source nodes) into {path}")
+        log = GraphLog(path, settings=state.settings)
+        try:
+            crawl(G, remaining, pipeline, state, storeUrl, log=log,
+                  progress=lambda z: heartbeat(queue, shard), enricher=enricher)
+            heartbeat(queue, shard)
+        except LeaseLost:
+            # The new owner already took over the log and crawls into the
+            # same files, so nothing of this copy is written
+            log.close()
+            print(f"Lost shard {shard.id} to another worker, leaving it to them")
+            continue
+        except BaseException:
+            # Saved so whoever takes the shard next carries on from here
+            log.compact(G, state)
+            queue.release(shard)
+            raise
+        log.compact(G, state)
+        queue.finish(shard)
+        crawled += 1
+
+
+def main(argv=None):
     VERSION = "1.1.0"
-    RANDOM_URL = "http://store.steampowered.com/explore/random/"
     G = nx.DiGraph()
-    oldRecCount = False
-    oldNodeCount = 0
+    state = CrawlState()
     newPrompt = ""
-    dlcList = []
+    basePath = None
+
+    parser = make_parser("Build a graph of Steam store recommendations.")
+    parser.add_argument("--existing", metavar="GRAPH",
+                        help="name of a graph in the graph directory to add to")
+    parser.add_argument("--new", action="store_true",
+                        help="start a new graph without asking about existing ones")
+    parser.add_argument("--previous-settings", action="store_true",
+                        help="reuse the settings of the existing graph")
+    parser.add_argument("--source-nodes", type=int, help="number of source nodes to crawl")
+    parser.add_argument("--recs", type=int, help="recommendations per source node")
+    parser.add_argument("--delay", type=float, help="seconds between requests")
+    parser.add_argument("--concurrency", type=int, help="requests in flight at once")
+    parser.add_argument("--parse-workers", type=int, help="parser processes")
+    parser.add_argument("--format", choices=GRAPH_FORMATS, default=None,
+                        help="output graph format (default gexf)")
+    parser.add_argument("--output", metavar="GRAPH",
+                        help="output graph name instead of steam{sources}-{recs}-{version}")
+    parser.add_argument("--cache", default=None,
+                        help="page cache file (default ./.cache/pages.sqlite)")
+    parser.add_argument("--store-url", default=None,
+                        help="base URL of the store, e.g. a local stand-in server")
+    parser.add_argument("--metrics-interval", type=float, default=None,
+                        help="print crawl metrics as a JSON line every this many seconds")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on this local port")
+    parser.add_argument("--mode", choices=CRAWL_MODES, default=None,
+                        help="random: sample source nodes from the explore page (default); "
+                             "frontier: expand the graph from games found but not expanded yet; "
+                             "refresh: fetch the attributes of games in the graph again")
+    parser.add_argument("--priority", choices=PRIORITIES, default=None,
+                        help="order of a frontier crawl (default indegree) "
+                             "or a refresh (default staleness)")
+    parser.add_argument("--max-age", type=float, default=None,
+                        help="only refresh games last fetched more than this many days ago "
+                             "(default 7)")
+    parser.add_argument("--enrich", choices=ENRICH_MODES, default=None,
+                        help="page: fetch the store page of every recommended game (default); "
+                             "batch: fill them in from data at hand and batched API requests")
+    parser.add_argument("--api-url", default=None,
+                        help="base URL of the Steam Web API, for --enrich batch")
+    parser.add_argument("--queue", metavar="FILE",
+                        help="work queue of a sharded crawl to create or join, "
+                             "e.g. ./.graphs/crawl.queue.sqlite")
+    parser.add_argument("--shard-size", type=int, default=None,
+                        help="source nodes per shard of a new sharded crawl (default 100)")
+    parser.add_argument("--worker", default=None,
+                        help="name this worker's claims are recorded under (default host-pid)")
+    parser.add_argument("--lease", type=float, default=None,
+                        help="seconds before a silent worker's shard is taken over (default 600)")
+    args = parse_args(parser, argv, "scraper")
     
     print("Welcome to Steam Recommendation Scraper v" + VERSION)
-    useOld = input("Add to existing graph? (y/n) ")
-
-    if useOld == "y":
+    queue = None
+    if args.mode in ("frontier", "refresh") and args.queue is not None:
+        parser.error("sharded crawls sample random source nodes, --mode " + args.mode
+                     + " needs one crawler")
+    if args.mode in ("frontier", "refresh") and args.enrich == "batch":
+        parser.error("--enrich batch only applies to random crawls")
+    if args.queue is not None:
+        if args.existing is not None:
+            parser.error("a sharded crawl starts a new graph, "
+                         "combine it with older graphs using merge.py")
+        queue = WorkQueue(args.queue, args.lease or LEASE)
+        queued = queue.settings
+        if queued:
+            # Joining a crawl another worker set up
+            print(f"Joining sharded crawl of {queued['graph']}")
+            args.source_nodes = queued["sourceNodes"]
+            args.recs = queued["recCount"]
+            args.output = queued["graph"]
+    elif args.existing is None and not args.new and not args.no_input:
+        if input("Add to existing graph? (y/n) ") == "y":
+            args.existing = input("Old graph name? ")
+
+    if args.existing is not None:
         newPrompt = "new "
-        oldGraphName = input("Old graph name? ")
-        G = nx.read_gexf(f"./.graphs/{oldGraphName}")
+        basePath = os.path.join(args.graph_dir, args.existing)
         print("Loading old graph...")
+        G, state = load_graph(basePath)
         print("Loaded graph with " + str(len(G.nodes())) + " nodes")
-        oldNodeCount = int(oldGraphName.split("-")[0].replace("steam", ""))
-        oldSettings = input("Use previous settings? (y/n) ")
-        if oldSettings == "y":
-            oldRecCount = True
-            recCount = int(oldGraphName.split("-")[1])
-
-    nodes = int(input(f"How many {newPrompt}source nodes? "))
-    if not oldRecCount:
-        recCount = int(input("How many recommendations per source node? "))
-
-    requestDelay = input("Delay between requests (seconds)? (Press Enter For the Recommended Value, 1.0) ")
-
-    if requestDelay == "":
-        requestDelay = 1.0
+        print("Skipping " + str(len(state.invalid)) + " known invalid appids")
+        if not args.previous_settings and not args.no_input:
+            args.previous_settings = input("Use previous settings? (y/n) ") == "y"
+        if args.previous_settings:
+            for option, setting in (("recs", "recCount"), ("delay", "requestDelay"),
+                                    ("concurrency", "concurrency"),
+                                    ("parse_workers", "parseWorkers")):
+                if getattr(args, option) is None and setting in state.settings:
+                    setattr(args, option, state.settings[setting])
+
+    if args.mode == "refresh":
+        if basePath is None:
+            parser.error("--mode refresh needs an --existing graph")
+        nodes = ask(args, "source_nodes", "How many games to refresh at most? ", int, len(G))
+        maxAge = ask(args, "max_age", "Refresh games last fetched how many days ago?",
+                     float, 7.0) * DAY
     else:
-        requestDelay = float(requestDelay)
+        nodes = ask(args, "source_nodes", f"How many {newPrompt}source nodes? ", int)
+    state.settings["recCount"] = ask(
+        args, "recs", "How many recommendations per source node? ", int)
+    state.settings["requestDelay"] = ask(
+        args, "delay", "Delay between requests (seconds)?", float, 1.0)
+    state.settings["concurrency"] = ask(
+        args, "concurrency", "Concurrent requests?", int, 4)
+    state.settings["parseWorkers"] = ask(
+        args, "parse_workers", "Parser processes?", int, 0)
+
+    graphName = args.output or f"steam{str(state.sourceNodes+nodes)}-{str(state.recCount)}-{VERSION}"
+    if args.mode == "refresh" and args.output is None:
+        # Nothing is added, so the graph keeps its name and is updated in place
+        graphName = args.existing
+    if os.path.splitext(graphName)[1].lstrip(".") not in GRAPH_FORMATS:
+        graphName += "." + (args.format or "gexf")
+    if queue is not None:
+        if queue.create(graphName, nodes, args.shard_size or 100, {"recCount": state.recCount}):
+            print(f"Created sharded crawl of {graphName} in {args.queue}")
+        # Another worker may have got there first
+        graphName = queue.settings["graph"]
+        state.settings["recCount"] = queue.settings["recCount"]
+
+    def checkpoint(z):
+        print("Node " + str(z) + " of " + str(nodes))
+        print("Elapsed time: " + str(time.time() - start) + " seconds")
+
+    if args.metrics_interval:
+        METRICS.report_every(args.metrics_interval)
+    if args.metrics_port:
+        METRICS.serve(args.metrics_port)
+        print(f"Serving metrics at http://127.0.0.1:{args.metrics_port}/metrics")
 
     print("Starting scrape...")
     start = time.time()
 
-    try:
-        for z in range(nodes):
-            if (z+1) % 100 == 0:
-                print("Node " + str(z+1) + " of " + str(nodes))
-                print("Elapsed time: " + str(time.time() - start) + " seconds")
-                print(
-                    f"Saving steam{str(oldNodeCount+nodes)}-{str(recCount)}-{VERSION}.gexf...")
-                nx.write_gexf(
-                    G, path=f"./.graphs/steam{str(oldNodeCount+nodes)}-{str(recCount)}-{VERSION}.gexf")
-            page = request_page(RANDOM_URL, requestDelay)
-            soup = BeautifulSoup(page.text, 'html.parser')
-            nameTag = soup.find("div", class_="apphub_AppName")
-            if nameTag is None:
-                continue
-            name = nameTag.text.strip()
-            idTag = soup.find("div", class_="glance_tags popular_tags")
-            if idTag is None:
-                continue
-            id = idTag['data-appid']
-            if not G.has_node(name) and id not in dlcList:
-                if add_node(G, id, name, requestDelay, soup).isnumeric():
-                    dlcList.append(id)
-                    continue
-
-            recList = []
-            recommendations = re.search("{\"rgApps\".*", page.text)
-            recString = recommendations.group(0)
-            recString = recString.replace(");", "")
-            recsDict = json.loads(recString)['rgApps']
-
-            for i in range(recCount):
-                if i < len(recsDict):
-                    id = list(recsDict.keys())[i]
-                    recList.append((id, recsDict[id]['name']))
-
-            # print(nameTag.text)
-            # print(idTag['value'])
-            # print(recList)
-            weight = recCount
-            for rec in recList:
-                refID, refName = rec[0], rec[1]
-                if not G.has_node(refName) and refID not in dlcList:
-                    if add_node(G, refID, refName, requestDelay) == "invalid":
-                        dlcList.append(refID)
-                        continue
-                # print(html.unescape(name) + " -> " + html.unescape(rec[0]))
-                G.add_edge(html.unescape(name),
-                           html.unescape(refName), weight=weight)
-                weight -= 1
-    except KeyboardInterrupt:
-        print("Exiting Loop...")
-    except AttributeError as e:
-        print(e)
-        print("❌ AttributeError: saving current progress...")
+    # Progress is logged as it happens and only compacted into the graph
+    # file once the crawl stops, rather than rewriting it every 100 nodes
+    os.makedirs(args.graph_dir, exist_ok=True)
+    graphPath = os.path.join(args.graph_dir, graphName)
+    if queue is None:
+        if os.path.exists(log_path(graphPath)):
+            # Starting over would overwrite what the crashed run logged
+            raise SystemExit(
+                "A crashed crawl left a log for " + graphName + ". Continue it with "
+                "--existing " + graphName + ", or compact it with: python ./graphlog.py "
+                + graphPath)
+        log = GraphLog(graphPath, base=basePath, settings=state.settings)
+
+    settings = state.settings
+    cache = PageCache(args.cache) if args.cache else PageCache()
+    with Fetcher(settings["requestDelay"], settings["concurrency"], cache) as fetcher, \
+            ParsePipeline(fetcher, settings["parseWorkers"]) as pipeline:
+        enricher = None
+        if args.enrich == "batch":
+            enricher = Enricher(pipeline, parse_app_page, args.api_url or API_URL)
+        try:
+            if queue is not None:
+                crawl_shards(queue, pipeline, graphPath, args.store_url or STORE_URL, args.worker,
+                             enricher)
+            elif args.mode == "refresh":
+                if graphPath != basePath and not os.path.exists(history_path(graphPath)) \
+                        and os.path.exists(history_path(basePath)):
+                    shutil.copyfile(history_path(basePath), history_path(graphPath))
+                history = PriceHistory(history_path(graphPath))
+                try:
+                    counts = refresh(G, nodes, pipeline, history, maxAge,
+                                     args.priority or "staleness", args.store_url or STORE_URL,
+                                     checkpoint=checkpoint, log=log)
+                finally:
+                    history.close()
+                print(f"Refreshed {counts['changed'] + counts['unchanged']} games, "
+                      f"{counts['changed']} changed, {counts['failed']} could not be fetched")
+            elif args.mode == "frontier":
+                crawl_frontier(G, nodes, pipeline, state, args.priority or "indegree",
+                               args.store_url or STORE_URL, checkpoint=checkpoint, log=log)
+            else:
+                crawl(G, nodes, pipeline, state, args.store_url or STORE_URL,
+                      checkpoint=checkpoint, log=log, enricher=enricher)
+        except KeyboardInterrupt:
+            print("Exiting Loop...")
+        except AttributeError as e:
+            print(e)
+            print("❌ AttributeError: saving current progress...")
+
+    if queue is not None:
+        # Shards are saved as they finish, and merged once all are done
+        counts = queue.counts()
+        print(f"Shards done: {counts['done']}, in progress: {counts['claimed']}, "
+              f"pending: {counts['pending']}")
+        if counts["done"] == sum(counts.values()):
+            print(f"Merge them with: python ./merge.py --queue {args.queue}")
+        print(f"Finished in: {str(time.time() - start)} seconds")
+        return
 
     # nx.write_gml(G, path=f"./.graphs/steam{str(nodes)}.gml")
-    nx.write_gexf(
-        G, path=f"./.graphs/steam{str(oldNodeCount+nodes)}-{str(recCount)}-{VERSION}.gexf")
+    print(f"Saving {graphName}...")
+    log.compact(G, state)
 
     end = time.time()
 
     print(
-        f"Complete!\nSaved to steam{str(oldNodeCount+nodes)}-{str(recCount)}-{VERSION}.gexf\nFinished in: {str(end - start)} seconds")
+        f"Complete!\nSaved to {graphName}\nFinished in: {str(end - start)} seconds")
 
 
 if __name__ == "__main__":
@@ -4,12 +4,15 @@ Simulation class for Chapter 7 Tutorial of Intro Network Science book
 Copyright 2018 Indiana University and Cambridge University Press
 '''
 
-from collections import Counter
 from operator import itemgetter
 
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import networkx as nx
+import numpy as np
+
+from history import StateHistory
+from layout import LAYOUT_DIR, cached_layout
 
 
 class StopCondition(StopIteration):
@@ -19,7 +22,8 @@ class Simulation:
     '''Simulate state transitions on a network'''
 
     def __init__(self, G, initial_state, state_transition,
-            stop_condition=None, name=''):
+            stop_condition=None, name='', keyframe_interval=32, retain=None,
+            layout='spring', layout_dir=LAYOUT_DIR):
         '''
         Create a Simulation instance.
 
@@ -42,6 +46,15 @@ class Simulation:
 
         Keyword Args:
             name (optional): a string used in titles of plots and drawings.
+            keyframe_interval (optional): steps between full copies of the
+                node states in the history. Steps in between only store the
+                nodes whose state changed.
+            retain (optional): only keep the states of about this many most
+                recent steps. State counts are kept for every step.
+            layout (optional): how nodes are positioned by draw(), one of
+                layout.LAYOUTS. Only computed when first drawing.
+            layout_dir (optional): where computed layouts are cached, or
+                None to not cache them.
 
         Raises:
             ValueError: if not all graph nodes have an initial state.
@@ -55,20 +68,26 @@ class Simulation:
             raise TypeError("'stop_condition' should be a function")
         self.name = name or 'Simulation'
 
-        self._states = []
+        self._nodes = list(self.G.nodes)
+        self._history = StateHistory(keyframe_interval, retain, dtype=np.int16)
         self._value_index = {}
+        self._values = []
         self._cmap = plt.cm.get_cmap('tab10')
 
         self._initialize()
 
-        self._pos = nx.layout.spring_layout(G)
+        self._layout = layout
+        self._layout_dir = layout_dir
+        self._pos = None
 
     def _append_state(self, state):
-        self._states.append(state)
         # Update self._value_index
         for value in set(state.values()):
             if value not in self._value_index:
                 self._value_index[value] = len(self._value_index)
+                self._values.append(value)
+        # Stored as each node's value index, in the order of self._nodes
+        self._history.append([self._value_index[state[n]] for n in self._nodes])
 
     def _initialize(self):
         if self._initial_state:
@@ -103,7 +122,7 @@ class Simulation:
     @property
     def steps(self):
         ''' Returns the number of steps the sumulation has run '''
-        return len(self._states) - 1
+        return len(self._history) - 1
 
     def state(self, step=-1):
         '''
@@ -117,12 +136,11 @@ class Simulation:
             Dictionary of node states.
 
         Raises:
-            IndexError: if `step` argument is greater than the number of steps.
+            IndexError: if `step` argument is greater than the number of
+                steps, or the step is older than the history retains.
         '''
-        try:
-            return self._states[step]
-        except IndexError:
-            raise IndexError('Simulation step %i out of range' % step)
+        codes = self._history.get(step)
+        return {n: self._values[c] for n, c in zip(self._nodes, codes.tolist())}
 
     def draw(self, step=-1, labels=None, **kwargs):
         '''
@@ -139,6 +157,8 @@ class Simulation:
         '''
         state = self.state(step)
         node_colors = [self._categorical_color(state[n]) for n in self.G.nodes]
+        if self._pos is None:
+            self._pos = cached_layout(self.G, self._layout, self._layout_dir)
         nx.draw(self.G, pos=self._pos, node_color=node_colors, **kwargs)
 
         if labels is None:
@@ -174,14 +194,16 @@ class Simulation:
         Returns:
             Axes object for the current plot
         '''
-        x_range = range(min_step or 0, max_step or len(self._states))
-        counts = [Counter(s.values()) for s in self._states[min_step:max_step]]
+        x_range = range(min_step or 0, max_step or len(self._history))
+        counts = self._history.count_matrix(min_step, max_step, len(self._values))
         if labels is None:
-            labels = {k for count in counts for k in count}
-            labels = sorted(labels, key=self._value_index.get)
+            labels = [v for v in self._values if counts[:, self._value_index[v]].any()]
 
         for label in labels:
-            series = [count.get(label, 0) / sum(count.values()) for count in counts]
+            if label in self._value_index:
+                series = counts[:, self._value_index[label]] / counts.sum(axis=1)
+            else:
+                series = np.zeros(len(counts))
             plt.plot(x_range, series, label=label, **kwargs)
 
         title = 'node state proportions'
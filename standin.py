@@ -0,0 +1,274 @@
+'''
+Local stand-in for the Steam store, serving the canned store pages in
+./standin/ so crawls can be run and checked without sending Steam a single
+request.
+
+    python ./standin.py --port 8765
+    python ./scraper.py --store-url http://127.0.0.1:8765 ...
+
+`/explore/random/` serves a random canned game and `/app/{appid}/` the page
+of that appid, each with an ETag so refresh crawls get `304 Not Modified`.
+`--fail` answers that share of app page requests with `404 Not Found`,
+which is not retried, to crawl through failed fetches.
+
+The pages are twelve games recommending one another, one of them a DLC and
+one without a release year, with the games and the appids that must end up
+invalid listed in ./standin/expected.json. To crawl them in every mode
+(random with failed fetches, frontier, refresh and sharded) and check each
+resulting graph against the one the pages describe:
+
+    python ./standin.py --check
+'''
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STANDIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "standin")
+
+
+class StandinStore:
+    '''The canned pages of a directory, served like the Steam store'''
+
+    def __init__(self, directory=STANDIN_DIR, fail=0.0, seed=None):
+        '''
+        Args:
+            directory: holds `{appid}.html` pages and expected.json.
+            fail: share of app page requests answered with 404 Not Found.
+            seed (optional): seed for random games and failed requests.
+        '''
+        with open(os.path.join(directory, "expected.json"), encoding="utf-8") as f:
+            self.expected = json.load(f)
+        self.pages = {}
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".html"):
+                with open(os.path.join(directory, name), "rb") as f:
+                    self.pages[int(os.path.splitext(name)[0])] = f.read()
+        self.games = sorted(int(id) for id in self.expected["games"])
+        self.fail = fail
+        self.counts = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def respond(self, path, etag=None):
+        '''
+        Answer one request.
+
+        Returns:
+            A tuple `(status, body, etag)`.
+        '''
+        with self._lock:
+            if path.startswith("/explore/random"):
+                id = self._random.choice(self.games)
+            else:
+                match = re.match(r"/app/(\d+)", path)
+                id = int(match.group(1)) if match is not None else None
+                if id is not None and self._random.random() < self.fail:
+                    id = None
+            status = 404 if id not in self.pages else 200
+            if status == 200:
+                body = self.pages[id]
+                tag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+                if etag == tag:
+                    status, body = 304, b""
+            else:
+                body, tag = b"", None
+            self.counts[status] = self.counts.get(status, 0) + 1
+        return status, body, tag
+
+    def serve(self, port=0, host="127.0.0.1"):
+        '''Serve the pages at http://host:port, on any free port by default.'''
+        store = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body, etag = store.respond(self.path, self.headers.get("If-None-Match"))
+                self.send_response(status)
+                if etag is not None:
+                    self.send_header("ETag", etag)
+                if status != 304:
+                    self.send_header("Content-Type", "text/html; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def expected_edges(store, recCount):
+    '''
+    Edges every game should have once expanded, by game: its first
+    `recCount` recommendations that are not invalid, weighted by rank
+    among them.
+    '''
+    import scraper
+
+    invalid = set(store.expected["invalid"])
+    edges = {}
+    for id in store.games:
+        recs = [refID for refID, _ in scraper.get_recommendations(
+            store.pages[id].decode("utf-8"))[:recCount]]
+        valid = [refID for refID in recs if refID not in invalid]
+        edges[id] = {refID: recCount - rank for rank, refID in enumerate(valid)}
+    return edges
+
+
+def check_graph(G, state, store, complete=False):
+    '''
+    Compare a crawled graph with the canned store.
+
+    Every node must be a canned game under its own name, every invalid
+    appid one that is meant to be, and every expanded game must have
+    exactly its expected edges, or some of them while it still waits on
+    recommendations in `state.pending`.
+
+    Args:
+        complete: also require every game and invalid appid to be known
+            and every game expanded, as after an exhaustive frontier crawl.
+
+    Returns:
+        A list of what is wrong, empty if nothing is.
+    '''
+    games = {int(id): name for id, name in store.expected["games"].items()}
+    invalid = set(store.expected["invalid"])
+    edges = expected_edges(store, state.recCount)
+    wrong = []
+    for id, data in G.nodes(data=True):
+        if id not in games:
+            wrong.append(f"{id} is not a game")
+        elif data.get("name") != games[id]:
+            wrong.append(f"{id} is named {data.get('name')!r}, not {games[id]!r}")
+    for id in sorted(state.invalid - invalid):
+        wrong.append(f"{id} is wrongly invalid")
+    for id in sorted(G):
+        got = {refID: data["weight"] for _, refID, data in G.out_edges(id, data=True)}
+        if got and id not in state.expanded:
+            wrong.append(f"{id} has edges but is not expanded")
+        if id not in state.expanded or id not in edges:
+            continue
+        if id in state.pending:
+            got = {refID: weight for refID, weight in got.items()
+                   if edges[id].get(refID) != weight}
+            if got:
+                wrong.append(f"{id}, waiting on recommendations, has edges {got}")
+        elif got != edges[id]:
+            wrong.append(f"{id} has edges {got}, expected {edges[id]}")
+    if complete:
+        if set(G) != set(games):
+            wrong.append(f"games {sorted(set(games) - set(G))} are missing")
+        if state.invalid != invalid:
+            wrong.append(f"invalid appids {sorted(invalid - state.invalid)} are missing")
+        if state.expanded != set(games):
+            wrong.append(f"games {sorted(set(games) - state.expanded)} are not expanded")
+        if state.pending or state.frontier:
+            wrong.append(f"games are left pending {sorted(state.pending)} "
+                         f"or in the frontier {sorted(state.frontier)}")
+    return wrong
+
+
+def check_crawls(directory=STANDIN_DIR, seed=0):
+    '''
+    Crawl the canned store through --store-url in every mode, one after the
+    other in a temporary graph directory, and check each graph.
+
+    Returns:
+        A list of `(crawl, problem)`, empty if every crawl came out right.
+    '''
+    import merge
+    import scraper
+    from graphlog import load_graph
+
+    store = StandinStore(directory, seed=seed)
+    server = store.serve()
+    failures = []
+    with tempfile.TemporaryDirectory() as graphDir:
+        common = ["--no-input", "--graph-dir", graphDir, "--store-url",
+                  f"http://127.0.0.1:{server.server_port}",
+                  "--cache", os.path.join(graphDir, "pages.sqlite")]
+        new = ["--new", "--recs", "5", "--delay", "0", "--concurrency", "4",
+               "--parse-workers", "0"]
+        crawls = [
+            ("random", 0.3, False, new + ["--source-nodes", "12", "--output", "random.gexf"]),
+            ("frontier", 0.0, True,
+             ["--existing", "random.gexf", "--previous-settings", "--mode", "frontier",
+              "--source-nodes", "30", "--output", "frontier.gexf"]),
+            ("refresh", 0.0, True,
+             ["--existing", "frontier.gexf", "--previous-settings", "--mode", "refresh",
+              "--max-age", "0"]),
+            # Every page is cached by now, so nothing is downloaded again
+            ("refresh again", 0.0, True,
+             ["--existing", "frontier.gexf", "--previous-settings", "--mode", "refresh",
+              "--max-age", "0"]),
+            ("sharded", 0.3, False,
+             new + ["--queue", os.path.join(graphDir, "crawl.queue.sqlite"),
+                    "--source-nodes", "12", "--shard-size", "4", "--output", "sharded.gexf"]),
+        ]
+        for name, fail, complete, argv in crawls:
+            store.fail = fail
+            before = dict(store.counts)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                scraper.main(common + argv)
+                if name == "sharded":
+                    merge.main(["--graph-dir", graphDir, "--queue", argv[argv.index("--queue") + 1]])
+            refresh = name.startswith("refresh")
+            graph = "frontier.gexf" if refresh else argv[argv.index("--output") + 1]
+            G, state = load_graph(os.path.join(graphDir, graph))
+            failures += [(name, problem) for problem in check_graph(G, state, store, complete)]
+            if refresh:
+                downloaded = store.counts.get(200, 0) - before.get(200, 0)
+                revalidated = store.counts.get(304, 0) - before.get(304, 0)
+                if downloaded + revalidated != len(G) or (name != "refresh" and downloaded):
+                    failures.append((name, f"{downloaded} pages downloaded and {revalidated} "
+                                           f"revalidated for {len(G)} games"))
+    server.shutdown()
+    server.server_close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve canned Steam store pages locally, or check crawls against them.")
+    parser.add_argument("--pages", default=STANDIN_DIR,
+                        help="directory of canned pages (default ./standin)")
+    parser.add_argument("--port", type=int, default=8765, help="port to serve on")
+    parser.add_argument("--fail", type=float, default=0.0,
+                        help="share of app page requests to answer with 404 Not Found")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for random games and failed requests")
+    parser.add_argument("--check", action="store_true",
+                        help="crawl the pages in every mode and check the graphs")
+    args = parser.parse_args()
+
+    if args.check:
+        failures = check_crawls(args.pages, args.seed or 0)
+        for name, problem in failures:
+            print(f"{name}: {problem}")
+        print(f"{len(failures)} crawl problems found")
+        if failures:
+            raise SystemExit(1)
+        return
+
+    store = StandinStore(args.pages, args.fail, args.seed)
+    server = store.serve(args.port)
+    print(f"Serving {len(store.pages)} pages at http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+'''
+SQLite work queue that splits one crawl into shards for several workers.
+
+A sharded crawl of N source nodes is cut into shards of `shardSize` source
+nodes each. Every worker, whether another process on the same machine or
+another machine sharing the queue file, claims one pending shard at a time,
+crawls it into its own partial graph, e.g.
+`./.graphs/steam1000-10-1.1.0.shard003.gexf`, and marks it done. The partial
+graphs are combined afterwards with merge.py.
+
+Claims are taken in a single write transaction, so no two workers ever hold
+the same shard. A worker touches its claim after every batch; a claim left
+untouched for longer than the lease, by a worker that was killed or lost its
+connection, goes back to the pool and its partial graph is picked up where
+it stopped. Heartbeats, releases and finishes only apply to the worker
+holding the claim, so a worker that stalled past its lease finds out it lost
+the shard instead of overwriting the new owner's work.
+'''
+import json
+import os
+import socket
+import sqlite3
+import time
+
+LEASE = 10 * 60
+
+
+def shard_path(graphPath, shard):
+    root, ext = os.path.splitext(graphPath)
+    return f"{root}.shard{shard:03d}{ext}"
+
+
+def default_worker():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaseLost(Exception):
+    '''Raised when a shard was taken over by another worker'''
+
+
+class Shard:
+    '''One slice of a sharded crawl, as claimed by one worker'''
+
+    def __init__(self, id, sources, worker):
+        self.id = id
+        self.sources = sources
+        self.worker = worker
+
+
+class WorkQueue:
+    '''Shards of a crawl and which worker holds each'''
+
+    def __init__(self, path, lease=LEASE):
+        '''
+        Args:
+            path: SQLite file holding the queue. Created if missing.
+            lease: seconds a claimed shard may go without a heartbeat before
+                another worker may take it over.
+        '''
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lease = lease
+        # Transactions are opened explicitly so claims can lock the queue
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS shards ("
+            "id INTEGER PRIMARY KEY, sources INTEGER, status TEXT, worker TEXT, "
+            "claimedAt REAL, heartbeatAt REAL, finishedAt REAL)")
+
+    def create(self, graphName, sourceNodes, shardSize, settings):
+        '''
+        Cut a crawl into shards, unless the queue already holds one.
+
+        Every worker may call this with its own options; only the first call
+        creates the shards and the rest join that crawl as it is.
+
+        Args:
+            graphName: file name of the merged graph, e.g.
+                steam1000-10-1.1.0.gexf. Shards are named after it.
+            sourceNodes: total number of source nodes to crawl.
+            shardSize: source nodes per shard.
+            settings: crawl settings every worker must share, e.g. `recCount`.
+
+        Returns:
+            True if the shards were created by this call.
+        '''
+        if shardSize < 1:
+            raise ValueError("shardSize must be at least 1")
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if self._db.execute("SELECT COUNT(*) FROM shards").fetchone()[0]:
+                self._db.execute("COMMIT")
+                return False
+            values = dict(settings, graph=graphName, sourceNodes=sourceNodes, shardSize=shardSize)
+            self._db.executemany("INSERT OR REPLACE INTO settings VALUES (?, ?)",
+                                 [(key, json.dumps(value)) for key, value in values.items()])
+            self._db.executemany(
+                "INSERT INTO shards (id, sources, status) VALUES (?, ?, 'pending')",
+                [(id, min(shardSize, sourceNodes - start))
+                 for id, start in enumerate(range(0, sourceNodes, shardSize))])
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return True
+
+    @property
+    def settings(self):
+        '''Settings of the crawl, including `graph`, `sourceNodes` and `shardSize`.'''
+        return {key: json.loads(value)
+                for key, value in self._db.execute("SELECT key, value FROM settings")}
+
+    def claim(self, worker):
+        '''
+        Take the next shard that is pending or whose lease ran out.
+
+        Returns:
+            A Shard, or None once every shard is done or held by a live worker.
+        '''
+        now = time.time()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._db.execute(
+                "SELECT id, sources FROM shards WHERE status = 'pending' "
+                "OR (status = 'claimed' AND heartbeatAt < ?) ORDER BY id LIMIT 1",
+                (now - self.lease,)).fetchone()
+            if row is not None:
+                self._db.execute(
+                    "UPDATE shards SET status = 'claimed', worker = ?, claimedAt = ?, "
+                    "heartbeatAt = ? WHERE id = ?", (worker, now, now, row[0]))
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return None if row is None else Shard(*row, worker)
+
+    def heartbeat(self, shard):
+        '''
+        Renew the lease on a claimed shard.
+
+        Returns:
+            False if the shard is no longer held by `shard.worker`, because
+            its lease ran out and another worker claimed it.
+        '''
+        return self._db.execute(
+            "UPDATE shards SET heartbeatAt = ? WHERE id = ? AND status = 'claimed' "
+            "AND worker = ?", (time.time(), shard.id, shard.worker)).rowcount > 0
+
+    def release(self, shard):
+        '''Hand a shard back unfinished, e.g. when its worker is stopped.'''
+        self._db.execute("UPDATE shards SET status = 'pending', worker = NULL WHERE id = ? "
+                         "AND status = 'claimed' AND worker = ?", (shard.id, shard.worker))
+
+    def finish(self, shard):
+        '''
+        Mark a shard done.
+
+        Returns:
+            False if the shard is no longer held by `shard.worker`.
+        '''
+        return self._db.execute(
+            "UPDATE shards SET status = 'done', finishedAt = ? WHERE id = ? "
+            "AND status = 'claimed' AND worker = ?",
+            (time.time(), shard.id, shard.worker)).rowcount > 0
+
+    def counts(self):
+        '''Number of shards with each status.'''
+        counts = {"pending": 0, "claimed": 0, "done": 0}
+        counts.update(self._db.execute("SELECT status, COUNT(*) FROM shards GROUP BY status"))
+        return counts
+
+    def done(self):
+        '''Ids of the finished shards.'''
+        return [id for id, in self._db.execute(
+            "SELECT id FROM shards WHERE status = 'done' ORDER BY id")]
+
+    def close(self):
+        self._db.close()